@@ -7,6 +7,8 @@ from dotenv import load_dotenv
 from routes.auth import auth_bp
 from routes.calculation import calc_bp
 from routes.stats import stats_bp
+from routes.metrics import metrics_bp, init_request_metrics
+from routes.admin import admin_bp
 
 # 載入環境變數
 load_dotenv()
@@ -38,6 +40,13 @@ app.register_blueprint(calc_bp, url_prefix='/api/calculate')
 
 app.register_blueprint(stats_bp, url_prefix='/api/stats')
 
+# 效能指標：/api/metrics (Prometheus 文字格式)，並為每個請求計時
+app.register_blueprint(metrics_bp, url_prefix='/api')
+init_request_metrics(app)
+
+# 管理用 API (需設定 ADMIN_TOKEN)：/api/admin/queries
+app.register_blueprint(admin_bp, url_prefix='/api/admin')
+
 # 測試用首頁
 @app.route('/')
 def home():
@@ -0,0 +1,58 @@
+# benchmarks/bench_batch.py
+"""
+逐筆 POST /api/calculate/detailed 與 POST /api/calculate/batch 的吞吐量比較
+
+以 Flask test client 直接呼叫 app (不經過網路)，需要本機 MySQL 與一個已存在的使用者
+用法 (在專案根目錄執行)：
+  python -m benchmarks.bench_batch --user-id 1 --rows 2000 --batch-size 200
+"""
+import argparse
+import random
+import time
+
+from app import app
+from generate_100_random import generate_detailed_data, OCCUPATIONS, TAIWAN_PLACES
+
+
+def make_payloads(n):
+    payloads = []
+    for _ in range(n):
+        profile = {"city": random.choice(list(TAIWAN_PLACES)), "occupation": random.choice(OCCUPATIONS)}
+        payloads.append(generate_detailed_data(profile))
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-item vs batch calculation")
+    parser.add_argument("--user-id", type=int, required=True, help="紀錄要寫入的使用者 id")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    payloads = make_payloads(args.rows)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = args.user_id
+
+    start = time.perf_counter()
+    for data in payloads:
+        res = client.post('/api/calculate/detailed', json=data)
+        assert res.status_code == 200, res.get_data(as_text=True)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(payloads), args.batch_size):
+        chunk = [{"type": "detailed", "data": d} for d in payloads[i:i + args.batch_size]]
+        res = client.post('/api/calculate/batch', json=chunk)
+        assert res.status_code == 200, res.get_data(as_text=True)
+    batch = time.perf_counter() - start
+
+    print(f"rows: {args.rows}, batch size: {args.batch_size}")
+    print(f"per-item : {single:8.2f}s  {args.rows / single:10.1f} rows/s")
+    print(f"batch    : {batch:8.2f}s  {args.rows / batch:10.1f} rows/s  (x{single / batch:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_password_hashing.py
+"""
+登入與計算混合流量：密碼雜湊在請求執行緒內計算 (舊行為) vs 交給 process pool
+
+一部分 thread 持續登入，另一部分 thread 持續呼叫 /api/calculate/quick，
+比較兩種模式下計算 API 的延遲 (p50 / p99)、登入吞吐量與 503 次數
+以 Flask test client 直接呼叫 app (不經過網路)，需要本機 MySQL
+用法 (在專案根目錄執行)：
+  python -m benchmarks.bench_password_hashing --duration 10 --login-threads 8 --calc-threads 4
+"""
+import argparse
+import os
+import threading
+import time
+
+from app import app
+from generate_100_random import generate_random_user
+from services import password_hasher
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def run(duration, login_threads, calc_threads, credentials):
+    deadline = time.perf_counter() + duration
+    calc_latencies = []
+    login_counts = {"ok": 0, "busy": 0, "error": 0}
+    lock = threading.Lock()
+
+    def login_loop():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            res = client.post('/api/login', json=credentials)
+            key = "ok" if res.status_code == 200 else "busy" if res.status_code == 503 else "error"
+            with lock:
+                login_counts[key] += 1
+
+    def calc_loop():
+        client = app.test_client()
+        client.post('/api/login', json=credentials)
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            res = client.post('/api/calculate/quick', json={"commute": "bus", "diet": "balanced", "shopping": "low"})
+            local.append(time.perf_counter() - start)
+            assert res.status_code == 200, res.get_data(as_text=True)
+        with lock:
+            calc_latencies.extend(local)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(login_threads)]
+    threads += [threading.Thread(target=calc_loop) for _ in range(calc_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(calc_latencies), login_counts
+
+
+def report(label, duration, latencies, logins):
+    print(f"{label:8s}: calc p50 {percentile(latencies, 50) * 1000:7.2f} ms  p99 {percentile(latencies, 99) * 1000:7.2f} ms  "
+          f"{len(latencies) / duration:7.1f} calc/s | login {logins['ok'] / duration:6.1f}/s  "
+          f"503 {logins['busy']}  error {logins['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark inline vs pooled password hashing under mixed traffic")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--login-threads", type=int, default=8)
+    parser.add_argument("--calc-threads", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=password_hasher.PASSWORD_HASH_WORKERS or (os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    # 建立測試帳號 (註冊本身也會用到 hasher)
+    profile = generate_random_user(0)
+    profile['username'] = f"bench_login_{int(time.time())}"
+    profile['email'] = f"{profile['username']}@bench.local"
+    res = app.test_client().post('/api/register', json=profile)
+    assert res.status_code == 201, res.get_data(as_text=True)
+    credentials = {"username": profile['username'], "password": profile['password']}
+
+    # inline：在請求執行緒內計算，不限制同時數量 (等同舊行為)
+    password_hasher.configure(workers=0, max_pending=10 ** 6)
+    latencies, logins = run(args.duration, args.login_threads, args.calc_threads, credentials)
+    report("inline", args.duration, latencies, logins)
+
+    password_hasher.configure(workers=args.workers, max_pending=args.workers * 4)
+    # 先暖身讓 worker process 啟動完成
+    password_hasher.hash_password("warmup")
+    latencies, logins = run(args.duration, args.login_threads, args.calc_threads, credentials)
+    report("pool", args.duration, latencies, logins)
+    print(f"hasher: {password_hasher.get_stats()}")
+    password_hasher.get_hasher().shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# benchmarks/bench_region_stats.py
+"""
+區域統計效能比較：
+  legacy  - 舊版作法：撈出所有 carbon_logs，在 Python 端 json.loads + 加總
+  sql     - 單一 SQL 聚合查詢 (bd_* 生成欄位 + users(city, district) 索引)
+  rollup  - 讀取 region_stats_rollup 彙總表
+
+需要本機 MySQL 且已套用 database/migrations 下的 migration
+用法 (在專案根目錄執行)：
+  python -m benchmarks.bench_region_stats --logs 300000
+  python -m benchmarks.bench_region_stats --skip-seed      # 沿用上次灌的資料
+  python -m benchmarks.bench_region_stats --cleanup        # 刪除 bench_ 開頭的測試帳號
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from db_manager import db_connection
+from generate_100_random import generate_random_user, generate_detailed_data
+from routes.stats import _query_logs, _query_rollup
+from services.calculator import calculate_detailed_footprint
+from services.log_store import INSERT_LOG_SQL, log_row, rebuild_rollup
+
+BENCH_PREFIX = "bench_"
+CHUNK = 5000
+
+
+def seed(conn, n_users, n_logs):
+    """灌入測試帳號與紀錄 (帳號以 bench_ 開頭，方便清除)"""
+    cursor = conn.cursor()
+    users = []
+    for i in range(n_users):
+        u = generate_random_user(i)
+        users.append((
+            f"{BENCH_PREFIX}{i}", f"{BENCH_PREFIX}{i}@bench.local", "x", u['fullName'],
+            u['gender'], None, u['city'], u['district'], u['birthdate'], u['occupation']
+        ))
+    cursor.executemany("""
+        INSERT IGNORE INTO users (username, email, password_hash, full_name, gender, gender_other, city, district, birthdate, occupation)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, users)
+    conn.commit()
+
+    cursor.execute("SELECT id, city, occupation FROM users WHERE username LIKE %s", (f"{BENCH_PREFIX}%",))
+    profiles = cursor.fetchall()
+
+    start = time.perf_counter()
+    batch = []
+    for i in range(n_logs):
+        user_id, city, occupation = random.choice(profiles)
+        data = generate_detailed_data({"city": city, "occupation": occupation})
+        result = calculate_detailed_footprint(data)
+        batch.append(log_row(user_id, 'Detailed', data, result))
+        if len(batch) >= CHUNK:
+            cursor.executemany(INSERT_LOG_SQL, batch)
+            conn.commit()
+            batch.clear()
+            print(f"  seeded {i + 1}/{n_logs}", end="\r")
+    if batch:
+        cursor.executemany(INSERT_LOG_SQL, batch)
+        conn.commit()
+    cursor.close()
+    print(f"\n🌱 seeded {n_logs} logs in {time.perf_counter() - start:.1f}s")
+
+
+def legacy_aggregate(cursor, city, district):
+    """舊版 get_regional_stats 的資料處理方式 (逐筆拉回 Python 計算)"""
+    query = """
+        SELECT l.total_carbon, l.breakdown, l.log_type
+        FROM carbon_logs l
+        JOIN users u ON l.user_id = u.id
+        WHERE 1=1
+    """
+    params = []
+    if city:
+        query += " AND u.city = %s"
+        params.append(city)
+    if district:
+        query += " AND u.district = %s"
+        params.append(district)
+    cursor.execute(query, tuple(params))
+    logs = cursor.fetchall()
+
+    total_sum = 0
+    breakdown_sums = {}
+    for log in logs:
+        total_sum += log['total_carbon']
+        bd = log['breakdown']
+        if isinstance(bd, str):
+            bd = json.loads(bd)
+        for key, val in bd.items():
+            breakdown_sums[key] = breakdown_sums.get(key, 0) + val
+    return len(logs), total_sum, breakdown_sums
+
+
+def time_it(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /api/stats/region aggregation paths")
+    parser.add_argument("--logs", type=int, default=300000, help="要灌入的紀錄筆數")
+    parser.add_argument("--users", type=int, default=5000, help="測試帳號數")
+    parser.add_argument("--repeat", type=int, default=5, help="每個查詢重複次數 (取中位數)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--cleanup", action="store_true")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with db_connection() as conn:
+        if not conn:
+            print("❌ 資料庫連線失敗")
+            return
+
+        if args.cleanup:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM users WHERE username LIKE %s", (f"{BENCH_PREFIX}%",))
+            conn.commit()
+            cursor.close()
+            rebuild_rollup(conn)
+            print("🧹 已清除測試資料")
+            return
+
+        if not args.skip_seed:
+            seed(conn, args.users, args.logs)
+        rebuild_rollup(conn)
+
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT city, district FROM users WHERE username LIKE %s LIMIT 1", (f"{BENCH_PREFIX}%",))
+        sample = cursor.fetchone()
+        filters = [
+            ("全台", None, None),
+            ("縣市", sample['city'], None),
+            ("行政區", sample['city'], sample['district']),
+        ]
+
+        print(f"{'filter':<8}{'legacy ms':>12}{'sql ms':>12}{'rollup ms':>12}")
+        for label, city, district in filters:
+            legacy = time_it(lambda: legacy_aggregate(cursor, city, district), args.repeat)
+            sql = time_it(lambda: _query_logs(cursor, city, district), args.repeat)
+            rollup = time_it(lambda: _query_rollup(cursor, city, district), args.repeat)
+            print(f"{label:<8}{legacy:>12.1f}{sql:>12.1f}{rollup:>12.2f}")
+        cursor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# benchmarks/bench_vector_calculator.py
+"""
+逐筆計算 (calculator.py) 與 NumPy 向量化引擎 (vector_calculator.py) 的速度比較，
+並逐筆確認兩者的 total 與 breakdown 完全相同
+
+不需要資料庫，用法 (在專案根目錄執行)：
+  python -m benchmarks.bench_vector_calculator --rows 200000
+"""
+import argparse
+import random
+import time
+
+from generate_100_random import generate_detailed_data, OCCUPATIONS, TAIWAN_PLACES
+from services import vector_calculator
+from services.calculator import calculate_detailed_footprint, calculate_quick_footprint
+from services.carbon_data import DEFAULT_COEFFS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scalar vs vectorized calculator")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    records = [
+        generate_detailed_data({"city": random.choice(list(TAIWAN_PLACES)), "occupation": random.choice(OCCUPATIONS)})
+        for _ in range(args.rows)
+    ]
+    quick_records = [
+        {
+            "commute": random.choice(list(DEFAULT_COEFFS["transport"])),
+            "diet": random.choice(list(DEFAULT_COEFFS["diet"])),
+            "shopping": random.choice(list(DEFAULT_COEFFS["consumption"])),
+        }
+        for _ in range(args.rows)
+    ]
+
+    # --- 詳細分析 ---
+    start = time.perf_counter()
+    scalar = [calculate_detailed_footprint(d) for d in records]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns, transport_types = vector_calculator.detailed_records_to_columns(records)
+    convert_time = time.perf_counter() - start
+    start = time.perf_counter()
+    vector = vector_calculator.calculate_detailed_columns(columns, transport_types)
+    vector_time = time.perf_counter() - start
+
+    mismatches = sum(
+        1 for i, r in enumerate(scalar)
+        if vector_calculator.unpack_row(vector, i)[1:] != (r['total'], r['breakdown'])
+    )
+
+    print(f"detailed rows: {args.rows}")
+    print(f"  scalar        : {args.rows / scalar_time:12.0f} rows/s")
+    print(f"  vector        : {args.rows / vector_time:12.0f} rows/s  (x{scalar_time / vector_time:.0f}, 不含欄位轉換)")
+    print(f"  vector + 轉換 : {args.rows / (vector_time + convert_time):12.0f} rows/s")
+    print(f"  mismatches    : {mismatches}")
+
+    # --- 快速估算 ---
+    start = time.perf_counter()
+    scalar = [calculate_quick_footprint(d) for d in quick_records]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector = vector_calculator.calculate_quick_columns(
+        [d["commute"] for d in quick_records],
+        [d["diet"] for d in quick_records],
+        [d["shopping"] for d in quick_records],
+    )
+    vector_time = time.perf_counter() - start
+
+    mismatches = sum(
+        1 for i, r in enumerate(scalar)
+        if vector_calculator.unpack_row(vector, i)[1:] != (r['total'], r['breakdown'])
+    )
+
+    print(f"quick rows: {args.rows}")
+    print(f"  scalar        : {args.rows / scalar_time:12.0f} rows/s")
+    print(f"  vector        : {args.rows / vector_time:12.0f} rows/s  (x{scalar_time / vector_time:.0f})")
+    print(f"  mismatches    : {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/bench_write_behind.py
+"""
+POST /api/calculate/detailed 的請求延遲 (p50 / p99)：同步寫入 vs write-behind
+
+以多個 thread 透過 Flask test client 同時送出請求 (不經過網路)，
+write-behind 模式結束後會等佇列寫完，並列出寫入的批次數
+需要本機 MySQL 與一個已存在的使用者
+用法 (在專案根目錄執行)：
+  python -m benchmarks.bench_write_behind --user-id 1 --requests 2000 --threads 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from app import app
+from generate_100_random import generate_detailed_data, OCCUPATIONS, TAIWAN_PLACES
+from services import write_behind
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(payloads, user_id, threads):
+    """回傳 (每個請求的延遲秒數 list, 總耗時)"""
+    latencies = []
+    lock = threading.Lock()
+    chunks = [payloads[i::threads] for i in range(threads)]
+
+    def worker(chunk):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        local = []
+        for data in chunk:
+            start = time.perf_counter()
+            res = client.post('/api/calculate/detailed', json=data)
+            local.append(time.perf_counter() - start)
+            assert res.status_code == 200, res.get_data(as_text=True)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(c,)) for c in chunks]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sorted(latencies), time.perf_counter() - started
+
+
+def report(label, latencies, elapsed):
+    print(f"{label:14s}: p50 {percentile(latencies, 50) * 1000:7.2f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:7.2f} ms  "
+          f"{len(latencies) / elapsed:8.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark request latency with and without write-behind")
+    parser.add_argument("--user-id", type=int, required=True, help="紀錄要寫入的使用者 id")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=write_behind.WRITE_BEHIND_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    payloads = [
+        generate_detailed_data({"city": random.choice(list(TAIWAN_PLACES)), "occupation": random.choice(OCCUPATIONS)})
+        for _ in range(args.requests)
+    ]
+
+    latencies, elapsed = run(payloads, args.user_id, args.threads)
+    report("sync", latencies, elapsed)
+
+    spill_path = os.path.join(tempfile.mkdtemp(), "bench_spill.jsonl")
+    queue = write_behind.start(spill_path=spill_path, batch_size=args.batch_size)
+    latencies, elapsed = run(payloads, args.user_id, args.threads)
+    report("write-behind", latencies, elapsed)
+
+    start = time.perf_counter()
+    write_behind.shutdown()
+    stats = queue.stats()
+    print(f"drain         : {time.perf_counter() - start:.2f}s, "
+          f"written {stats['written']}, batches {stats['batches']}, rejected {stats['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
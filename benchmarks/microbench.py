@@ -0,0 +1,219 @@
+# benchmarks/microbench.py
+"""
+計算熱點的微基準與效能回歸檢查
+
+量測項目 (輸入為固定 seed 產生的合成資料，不需要資料庫與網路)：
+  calculate_quick_footprint (查表) / 快速估算即時計算 (quick_compute)
+  calculate_detailed_footprint / generate_smart_suggestion
+  get_latest_coeffs (快取命中) / parse_energy_csv (本機台電 CSV fixture)
+
+每個項目回報：
+  ns/call       - 多輪量測取最小值 (最不受其他程式干擾的數字)
+  peak B/call   - 單次呼叫期間的記憶體配置峰值 (tracemalloc)
+  retained B    - 呼叫結束後仍未釋放的記憶體 (正常應為 0)
+
+基準值與機器相關，請在同一台機器上先存基準再比較：
+  python -m benchmarks.microbench --save-baseline      # 寫入 benchmarks/microbench_baseline.json
+  python -m benchmarks.microbench                      # 與基準比較，退步超過門檻時 exit code 為 1
+  python -m benchmarks.microbench --threshold 1.5 --only detailed
+  python -m benchmarks.microbench --require-baseline --baseline /path/to/baseline.json   # CI 用
+
+基準檔不進版本控制 (.gitignore)，因為數字只對產生它的機器有意義：
+- 本機：留在 benchmarks/microbench_baseline.json
+- CI：在固定規格的 runner 上以 --save-baseline 產生一次，存在 CI 的 cache / artifact，
+  每次以 --baseline 指定路徑並加上 --require-baseline；找不到基準檔、或有項目沒有基準值時 exit code 為 2，
+  不會因為缺少基準而默默通過
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from generate_100_random import generate_detailed_data, OCCUPATIONS, TAIWAN_PLACES
+from services import calculator, carbon_data
+from services.calculator import calculate_detailed_footprint, calculate_quick_footprint, generate_smart_suggestion
+from services.carbon_data import DEFAULT_COEFFS, get_latest_coeffs, parse_energy_csv
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, "microbench_baseline.json")
+FIXTURE_CSV = os.path.join(BENCH_DIR, "fixtures", "taipower_energy.csv")
+
+SAMPLES = 256           # 每個項目輪流使用的輸入筆數
+TARGET_SECONDS = 0.2    # 每一輪量測的目標時間
+REPEAT = 5
+# peak 記憶體的容許誤差 (bytes)，避免小幅波動被判定為退步
+ALLOC_SLACK = 256
+
+
+def build_cases(seed):
+    """回傳 {名稱: (函式, [參數 tuple, ...])}"""
+    random.seed(seed)
+    quick_inputs = [
+        ({
+            "commute": random.choice(list(DEFAULT_COEFFS["transport"])),
+            "diet": random.choice(list(DEFAULT_COEFFS["diet"])),
+            "shopping": random.choice(list(DEFAULT_COEFFS["consumption"])),
+        },)
+        for _ in range(SAMPLES)
+    ]
+    detailed_inputs = [
+        (generate_detailed_data({"city": random.choice(list(TAIWAN_PLACES)), "occupation": random.choice(OCCUPATIONS)}),)
+        for _ in range(SAMPLES)
+    ]
+
+    suggestion_inputs = []
+    for (data,), mode, calculate in (
+        *((q, 'Quick', calculate_quick_footprint) for q in quick_inputs[:SAMPLES // 2]),
+        *((d, 'Detailed', calculate_detailed_footprint) for d in detailed_inputs[:SAMPLES // 2]),
+    ):
+        result = calculate(data)
+        suggestion_inputs.append((result['total'], result['breakdown'], data, mode))
+
+    with open(FIXTURE_CSV, encoding='utf-8-sig') as f:
+        csv_text = f.read()
+
+    compiled = carbon_data.get_compiled_coeffs()
+
+    return {
+        "quick": (calculate_quick_footprint, quick_inputs),
+        # 查表未命中時的即時計算路徑 (calculate_quick_footprint 命中結果表時不會走到)
+        "quick_compute": (calculator._calculate_quick_scalar, [(data, compiled) for (data,) in quick_inputs]),
+        "detailed": (calculate_detailed_footprint, detailed_inputs),
+        "suggestion": (generate_smart_suggestion, suggestion_inputs),
+        "coeffs_cache_hit": (get_latest_coeffs, [()]),
+        "parse_energy_csv": (parse_energy_csv, [(csv_text,)]),
+    }
+
+
+def measure_time(fn, inputs):
+    """自動決定迴圈次數，回傳多輪中最快的每次呼叫耗時 (ns)"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            for args in inputs:
+                fn(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= TARGET_SECONDS / 10:
+            break
+        loops *= 2
+    loops = max(1, int(loops * TARGET_SECONDS / elapsed))
+
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for args in inputs:
+                fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best / (loops * len(inputs)) * 1e9
+
+
+def measure_alloc(fn, inputs):
+    """回傳 (平均每次呼叫的配置峰值 bytes, 平均每次呼叫未釋放的 bytes)"""
+    peaks = retained = 0
+    tracemalloc.start()
+    try:
+        for args in inputs:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = fn(*args)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks += peak - before
+            del result
+            retained += tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return peaks / len(inputs), max(0.0, retained / len(inputs))
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "calc_engine": calculator.CALC_ENGINE,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks and regression check for calculator / carbon_data")
+    parser.add_argument("--save-baseline", action="store_true", help="將這次結果存為基準值")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="找不到基準檔或項目沒有基準值時視為失敗 (exit code 2)")
+    parser.add_argument("--threshold", type=float, default=1.25, help="耗時超過基準的倍數即視為退步")
+    parser.add_argument("--alloc-threshold", type=float, default=1.10, help="配置峰值超過基準的倍數即視為退步")
+    parser.add_argument("--only", nargs="*", help="只跑指定項目")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # 快取命中：直接放入預設係數的版本並標記為剛更新，避免量測期間觸發背景下載
+    carbon_data._cache = carbon_data._DEFAULT_COMPILED
+    carbon_data._last_update_time = time.time()
+
+    cases = build_cases(args.seed)
+    if args.only:
+        cases = {k: v for k, v in cases.items() if k in args.only}
+
+    results = {}
+    for name, (fn, inputs) in cases.items():
+        fn(*inputs[0])  # 暖身
+        ns = measure_time(fn, inputs)
+        peak, retained = measure_alloc(fn, inputs)
+        results[name] = {"ns_per_call": ns, "peak_bytes": peak, "retained_bytes": retained}
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("environment") != environment():
+            print(f"⚠️ 基準值來自不同的環境，比較結果僅供參考: {baseline.get('environment')}")
+
+    regressions = []
+    missing = []
+    print(f"{'case':18s} {'ns/call':>12s} {'peak B/call':>12s} {'retained B':>11s}  vs baseline")
+    for name, r in results.items():
+        line = f"{name:18s} {r['ns_per_call']:12.0f} {r['peak_bytes']:12.0f} {r['retained_bytes']:11.0f}"
+        base = (baseline or {}).get("results", {}).get(name)
+        if base:
+            time_ratio = r['ns_per_call'] / base['ns_per_call']
+            line += f"  time x{time_ratio:.2f}, peak {r['peak_bytes'] - base['peak_bytes']:+.0f} B"
+            if time_ratio > args.threshold:
+                regressions.append(f"{name}: 耗時為基準的 {time_ratio:.2f} 倍")
+            if r['peak_bytes'] > base['peak_bytes'] * args.alloc_threshold + ALLOC_SLACK:
+                regressions.append(f"{name}: 配置峰值 {r['peak_bytes']:.0f} B (基準 {base['peak_bytes']:.0f} B)")
+        elif baseline is not None:
+            missing.append(name)
+        print(line)
+
+    if args.save_baseline:
+        print(f"💾 基準值已寫入 {args.baseline}")
+    elif baseline is None:
+        if args.require_baseline:
+            print(f"❌ 找不到基準值 ({args.baseline})，請先在同一台機器上執行 --save-baseline")
+            sys.exit(2)
+        print(f"ℹ️ 找不到基準值 ({args.baseline})，請先執行 --save-baseline")
+    elif missing:
+        if args.require_baseline:
+            print(f"❌ 以下項目沒有基準值，請重新執行 --save-baseline: {', '.join(missing)}")
+            sys.exit(2)
+        print(f"ℹ️ 以下項目沒有基準值: {', '.join(missing)}")
+
+    if regressions:
+        print("❌ 效能退步：")
+        for message in regressions:
+            print(f"  - {message}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+-- 001_region_stats_rollup.sql
+-- 區域統計彙總表：每寫入一筆 carbon_logs 就同步累加，/api/stats/region 直接讀這張表
+--
+-- 一筆紀錄會更新三個層級 (以空字串代表「全部」)：
+--   (city, district)  行政區
+--   (city, '')        整個縣市
+--   ('', '')          全台灣
+-- 各類別總和為 NULL 代表該層級從未出現過此類別 (例如只有快速估算的資料不會有 energy / waste)
+--
+-- 建表後請執行一次 `flask --app app stats rebuild-rollup` 以既有的 carbon_logs 重建
+
+CREATE TABLE IF NOT EXISTS `region_stats_rollup` (
+  `city` varchar(20) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `district` varchar(20) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `log_type` enum('Quick','Detailed') COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `sample_count` int NOT NULL DEFAULT 0,
+  `sum_total` double NOT NULL DEFAULT 0,
+  `sum_energy` double DEFAULT NULL,
+  `sum_transport` double DEFAULT NULL,
+  `sum_diet` double DEFAULT NULL,
+  `sum_consumption` double DEFAULT NULL,
+  `sum_waste` double DEFAULT NULL,
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`city`, `district`, `log_type`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
@@ -0,0 +1,14 @@
+-- 002_breakdown_columns_and_region_index.sql
+-- 1. 將 breakdown JSON 的各類別拆成 STORED 生成欄位，讓統計可以直接在 SQL 端 SUM / AVG
+--    (沒有該類別時為 NULL，例如快速估算沒有 energy / waste)
+-- 2. users 加上 (city, district) 複合索引，區域篩選不再全表掃描
+
+ALTER TABLE `carbon_logs`
+  ADD COLUMN `bd_energy` double GENERATED ALWAYS AS (`breakdown` -> '$.energy') STORED,
+  ADD COLUMN `bd_transport` double GENERATED ALWAYS AS (`breakdown` -> '$.transport') STORED,
+  ADD COLUMN `bd_diet` double GENERATED ALWAYS AS (`breakdown` -> '$.diet') STORED,
+  ADD COLUMN `bd_consumption` double GENERATED ALWAYS AS (`breakdown` -> '$.consumption') STORED,
+  ADD COLUMN `bd_waste` double GENERATED ALWAYS AS (`breakdown` -> '$.waste') STORED;
+
+ALTER TABLE `users`
+  ADD INDEX `idx_users_city_district` (`city`, `district`);
@@ -0,0 +1,7 @@
+-- 003_history_keyset_index.sql
+-- 歷史紀錄以 (created_at, id) 做 keyset 分頁：
+-- WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+-- 複合索引讓查詢直接依索引順序讀取，不再需要 filesort
+
+ALTER TABLE `carbon_logs`
+  ADD INDEX `idx_logs_user_created` (`user_id`, `created_at`, `id`);
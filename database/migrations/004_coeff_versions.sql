@@ -0,0 +1,14 @@
+-- 004_coeff_versions.sql
+-- 係數版本：每一份係數內容對應一個不可變的版本 id (內容的 sha256 前 12 碼)
+-- carbon_logs.coeff_version 記錄產生該筆紀錄的係數版本，方便針對舊版本重算
+
+CREATE TABLE IF NOT EXISTS `coeff_versions` (
+  `id` char(12) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `coeffs` json NOT NULL,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+ALTER TABLE `carbon_logs`
+  ADD COLUMN `coeff_version` char(12) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL,
+  ADD INDEX `idx_logs_coeff_version` (`coeff_version`);
@@ -0,0 +1,16 @@
+-- 005_region_distribution.sql
+-- 區域分佈 sketch：各區域 total_carbon 與各類別碳排的對數分箱次數 (services/sketch.py)
+-- 與 region_stats_rollup 相同，每寫入一筆 carbon_logs 就同步累加 行政區 / 縣市 / 全台 三個層級
+-- 分位數 (p50 / p90 / p99) 與直方圖由箱子次數算出；每個 (區域, 指標) 最多 721 列 (負值如回收減碳使用鏡像的負箱號)
+-- metric 為 total 或 breakdown 的類別名稱 (energy / transport / diet / consumption / waste)
+--
+-- 建表後請執行一次 `flask --app app stats rebuild-rollup` 以既有的 carbon_logs 重建
+
+CREATE TABLE IF NOT EXISTS `region_distribution` (
+  `city` varchar(20) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `district` varchar(20) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `metric` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `bucket` smallint NOT NULL,
+  `sample_count` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`city`, `district`, `metric`, `bucket`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
@@ -0,0 +1,39 @@
+-- 006_trend_rollups.sql
+-- 趨勢彙總表：依 月 / 週 累加每位使用者與各區域的紀錄數、總碳排與各類別總和
+-- 每寫入一筆 carbon_logs 就同步累加 (與 region_stats_rollup 同一個交易)，趨勢 API 只需讀主鍵範圍內的少數幾列
+--
+-- period: 'month' (bucket_start 為當月 1 日) 或 'week' (bucket_start 為當週星期一)
+-- 區域表與 region_stats_rollup 相同，以空字串代表「全部」：(city, district) / (city, '') / ('', '')
+-- 各類別總和為 NULL 代表該期間沒有出現過此類別
+--
+-- 建表後請執行一次 `flask --app app stats rebuild-rollup` 以既有的 carbon_logs 重建
+
+CREATE TABLE IF NOT EXISTS `user_trend_rollup` (
+  `user_id` int NOT NULL,
+  `period` enum('month','week') COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `bucket_start` date NOT NULL,
+  `sample_count` int NOT NULL DEFAULT 0,
+  `sum_total` double NOT NULL DEFAULT 0,
+  `sum_energy` double DEFAULT NULL,
+  `sum_transport` double DEFAULT NULL,
+  `sum_diet` double DEFAULT NULL,
+  `sum_consumption` double DEFAULT NULL,
+  `sum_waste` double DEFAULT NULL,
+  PRIMARY KEY (`user_id`, `period`, `bucket_start`),
+  CONSTRAINT `user_trend_rollup_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE IF NOT EXISTS `region_trend_rollup` (
+  `city` varchar(20) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `district` varchar(20) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `period` enum('month','week') COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `bucket_start` date NOT NULL,
+  `sample_count` int NOT NULL DEFAULT 0,
+  `sum_total` double NOT NULL DEFAULT 0,
+  `sum_energy` double DEFAULT NULL,
+  `sum_transport` double DEFAULT NULL,
+  `sum_diet` double DEFAULT NULL,
+  `sum_consumption` double DEFAULT NULL,
+  `sum_waste` double DEFAULT NULL,
+  PRIMARY KEY (`city`, `district`, `period`, `bucket_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
@@ -0,0 +1,11 @@
+-- 007_write_behind_batches.sql
+-- write-behind 已 commit 的批次：每批紀錄寫入 carbon_logs 時，在同一個交易內記下該批的 token
+-- 程序在 commit 之後、spill 檔記下 ack 之前崩潰時，重啟後以此表判斷哪些批次其實已寫入，重放時略過，不會重複寫入
+-- 每批 (最多 WRITE_BEHIND_BATCH_SIZE 筆紀錄) 只有一列，超過 WRITE_BEHIND_LEDGER_DAYS 天的列會自動清除
+
+CREATE TABLE IF NOT EXISTS `write_behind_batches` (
+  `token` char(32) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`token`),
+  KEY `idx_write_behind_batches_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
@@ -1,20 +1,290 @@
 # db_manager.py
 import mysql.connector
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+from services.metrics import phase
+from services.query_stats import query_stats
+
 load_dotenv()
 
+# ==========================================
+# 連線池設定 (可由 .env 調整)
+# ==========================================
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))                    # 連線池大小
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))             # 借用連線最長等待秒數
+DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30")) # 閒置超過幾秒才做健康檢查
+
+
+def _connect(**options):
+    """建立一條新的實體連線 (options 會直接傳給 mysql.connector.connect，例如 allow_local_infile)"""
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        **options
+    )
+
+
+class TimedCursor:
+    """
+    cursor 包裝：
+    - execute / executemany / fetch* 的時間記入目前請求的 db 階段 (services/metrics.py)
+    - execute / executemany 依語句彙總耗時，慢查詢另外記錄並抽樣 EXPLAIN (services/query_stats.py)
+    其餘屬性 (rowcount、lastrowid...) 直接轉給原本的 cursor
+    """
+
+    def __init__(self, raw_cursor):
+        self._raw = raw_cursor
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        error = True
+        try:
+            with phase('db'):
+                result = self._raw.execute(operation, params, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            query_stats.record(operation, params, time.perf_counter() - start, error=error)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        error = True
+        try:
+            with phase('db'):
+                result = self._raw.executemany(operation, seq_params, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            query_stats.record(operation, seq_params, time.perf_counter() - start, error=error, many=True)
+
+    def fetchone(self):
+        with phase('db'):
+            return self._raw.fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with phase('db'):
+            return self._raw.fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with phase('db'):
+            return self._raw.fetchall()
+
+
+class PooledConnection:
+    """
+    連線池借出的連線包裝：
+    - 其餘屬性與方法全部轉給真正的 MySQL 連線
+    - close() 不會真的斷線，而是歸還到連線池
+    因此舊程式碼的 conn.close() 寫法不需修改
+    """
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._raw = raw_conn
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._raw.cursor(*args, **kwargs))
+
+    def commit(self):
+        with phase('db'):
+            self._raw.commit()
+
+    def rollback(self):
+        with phase('db'):
+            self._raw.rollback()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pool._release(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    執行緒安全的 MySQL 連線池
+    - 借用時若池子已滿，會排隊等待 (backpressure)，超過 timeout 才放棄
+    - 閒置太久的連線借出前先 ping，壞掉就重建
+    - 記錄借用次數、等待時間、使用中/閒置數量
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, ping_interval=DB_POOL_PING_INTERVAL):
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle = queue.LifoQueue()         # (raw_conn, 歸還時間)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "created": 0,
+            "discarded": 0,
+        }
+
+    def _is_healthy(self, raw_conn, idle_since):
+        """pre-ping：只有閒置超過 ping_interval 的連線才檢查，避免每次借用都多一次來回"""
+        if time.monotonic() - idle_since < self.ping_interval:
+            return True
+        try:
+            raw_conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw_conn):
+        with self._lock:
+            self._stats["discarded"] += 1
+        try:
+            raw_conn.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """借出一條連線；等待超時回傳 None"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            print(f"⚠️ DB pool exhausted: waited {timeout}s for a connection")
+            return None
+        waited = time.monotonic() - start
+
+        try:
+            raw_conn = None
+            while raw_conn is None:
+                try:
+                    candidate, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    raw_conn = _connect()
+                    with self._lock:
+                        self._stats["created"] += 1
+                    break
+                if self._is_healthy(candidate, idle_since):
+                    raw_conn = candidate
+                else:
+                    self._discard(candidate)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        return PooledConnection(self, raw_conn)
+
+    def _release(self, raw_conn):
+        try:
+            # 歸還前先把未提交的交易回滾，避免下一個借用者接手髒狀態
+            if raw_conn.in_transaction:
+                raw_conn.rollback()
+            self._idle.put((raw_conn, time.monotonic()))
+        except Exception:
+            self._discard(raw_conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["in_use"] = self._in_use
+        data["size"] = self.size
+        data["idle"] = self._idle.qsize()
+        data["avg_wait_time"] = (data["wait_time_total"] / data["checkouts"]) if data["checkouts"] else 0.0
+        return data
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """取得全域連線池 (第一次呼叫時才建立)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
 def get_db_connection():
-    """建立並回傳資料庫連線物件"""
+    """從連線池借出資料庫連線物件；呼叫 conn.close() 即歸還"""
     try:
-        conn = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME")
-        )
-        return conn
+        # 排隊等連線的時間也算在 db 階段
+        with phase('db'):
+            return get_pool().acquire()
     except Exception as e:
         print(f"Database connection error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+@contextmanager
+def db_connection():
+    """
+    連線池的 context manager 用法：
+        with db_connection() as conn:
+            ...
+    借不到連線時 conn 為 None，離開區塊自動歸還
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        if conn:
+            conn.close()
+
+
+@contextmanager
+def db_cursor(dictionary=False):
+    """
+    同時借出連線與 cursor：
+        with db_cursor(dictionary=True) as (conn, cursor):
+            ...
+    借不到連線時 conn 與 cursor 皆為 None
+    """
+    with db_connection() as conn:
+        if not conn:
+            yield None, None
+            return
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            yield conn, cursor
+        finally:
+            cursor.close()
+
+
+def get_pool_stats():
+    """回傳連線池統計：借用次數、等待時間、使用中與閒置數量"""
+    return get_pool().stats()
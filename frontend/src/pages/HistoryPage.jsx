@@ -11,16 +11,27 @@ const HistoryPage = () => {
   const [logs, setLogs] = useState([]);
   const [loading, setLoading] = useState(true);
   const [selectedLog, setSelectedLog] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const toggleLanguage = () => {
     const newLang = i18n.language.startsWith('zh') ? 'en' : 'zh';
     i18n.changeLanguage(newLang);
   };
 
+  // 列表頁只需要摘要欄位，完整內容點開時再向後端取得
+  const LIST_FIELDS = 'id,log_type,total_carbon,created_at';
+
+  const fetchPage = (cursor) => axios.get('/api/calculate/history', {
+    params: { fields: LIST_FIELDS, ...(cursor ? { cursor } : {}) },
+    withCredentials: true
+  });
+
   useEffect(() => {
     const fetchHistory = async () => {
       try {
-        const res = await axios.get('/api/calculate/history', { withCredentials: true });
-        setLogs(res.data);
+        const res = await fetchPage(null);
+        setLogs(res.data.items);
+        setNextCursor(res.data.next_cursor);
       } catch (error) {
         console.error("無法取得紀錄", error);
         alert("請先登入"); // 這裡可以考慮用 t('auth.login_required') 但先維持原樣
@@ -32,6 +43,29 @@ const HistoryPage = () => {
     fetchHistory();
   }, [navigate]);
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const res = await fetchPage(nextCursor);
+      setLogs((prev) => [...prev, ...res.data.items]);
+      setNextCursor(res.data.next_cursor);
+    } catch (error) {
+      console.error("無法取得紀錄", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const openLog = async (log) => {
+    try {
+      const res = await axios.get(`/api/calculate/history/${log.id}`, { withCredentials: true });
+      setSelectedLog(res.data);
+    } catch (error) {
+      console.error("無法取得紀錄", error);
+    }
+  };
+
   const formatDate = (dateString) => {
     const options = { year: 'numeric', month: 'long', day: 'numeric', hour: '2-digit', minute: '2-digit' };
     // 使用瀏覽器語系自動格式化日期
@@ -76,7 +110,7 @@ const HistoryPage = () => {
                         initial={{ opacity: 0, y: 20 }}
                         animate={{ opacity: 1, y: 0 }}
                         whileHover={{ scale: 1.01 }}
-                        onClick={() => setSelectedLog(log)}
+                        onClick={() => openLog(log)}
                         className="bg-white p-6 rounded-2xl shadow-sm border border-slate-100 cursor-pointer hover:shadow-md transition flex justify-between items-center"
                     >
                         <div>
@@ -96,6 +130,15 @@ const HistoryPage = () => {
                         </div>
                     </motion.div>
                 ))}
+                {nextCursor && (
+                    <button
+                        onClick={loadMore}
+                        disabled={loadingMore}
+                        className="py-3 text-emerald-600 font-bold hover:underline disabled:text-slate-400"
+                    >
+                        {loadingMore ? t('history.loading') : t('history.btn_load_more')}
+                    </button>
+                )}
             </div>
         )}
 
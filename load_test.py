@@ -0,0 +1,302 @@
+"""
+API 壓力測試工具 (由 generate_100_random.py 擴充而來，沿用其中的隨機資料產生函式)
+
+- N 個虛擬使用者 (virtual user)，各自註冊 / 登入並持有自己的 requests.Session
+- 依權重混合情境：register / login / quick / detailed / history / region
+- 兩種節奏：
+    closed - 每個虛擬使用者送完一個請求 (加上 think time) 才送下一個
+    open   - 依固定到達率 (--rate，Poisson 分布) 送出請求，延遲從「預定送出時間」起算，
+             伺服器變慢時排隊的時間也會算進延遲 (避免 coordinated omission)
+- 依 endpoint 統計 p50 / p95 / p99 延遲、吞吐量與錯誤率，並輸出 JSON 方便比較不同次的結果
+
+用法 (先啟動本機的 Flask server 與 MySQL)：
+  python load_test.py --users 20 --duration 60
+  python load_test.py --mode open --rate 100 --users 50 --mix quick=4,detailed=4,history=1,region=1
+  python load_test.py --output results/after.json --compare results/before.json
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from generate_100_random import BASE_URL, TAIWAN_PLACES, generate_detailed_data, generate_random_user
+
+DEFAULT_MIX = "register=1,login=2,quick=25,detailed=25,history=27,region=20"
+
+QUICK_OPTIONS = {
+    "commute": ["scooter_gas", "scooter_electric", "car_gas", "car_electric", "public", "bike", "mrt", "bus"],
+    "diet": ["meat_heavy", "balanced", "convenience", "vegetarian"],
+    "shopping": ["low", "medium", "high"],
+}
+
+REQUEST_TIMEOUT = 30
+
+
+class Recorder:
+    """依 endpoint 收集延遲與錯誤 (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def record(self, name, seconds, status):
+        ok = status is not None and status < 400
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            self.errors[name] = self.errors.get(name, 0) + (0 if ok else 1)
+            codes = self.statuses.setdefault(name, {})
+            key = str(status) if status is not None else "conn_error"
+            codes[key] = codes.get(key, 0) + 1
+
+    def summary(self, elapsed):
+        result = {}
+        with self._lock:
+            for name, values in sorted(self.latencies.items()):
+                values = sorted(values)
+                count = len(values)
+                result[name] = {
+                    "count": count,
+                    "throughput": count / elapsed if elapsed else 0.0,
+                    "error_rate": self.errors[name] / count,
+                    "p50_ms": percentile(values, 50) * 1000,
+                    "p95_ms": percentile(values, 95) * 1000,
+                    "p99_ms": percentile(values, 99) * 1000,
+                    "mean_ms": sum(values) / count * 1000,
+                    "max_ms": values[-1] * 1000,
+                    "statuses": self.statuses[name],
+                }
+        return result
+
+
+def percentile(sorted_values, p):
+    """nearest-rank 百分位數"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+def parse_mix(text):
+    """'quick=3,detailed=1' -> ([情境], [權重])"""
+    names, weights = [], []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"未知的情境: {name} (可用: {', '.join(SCENARIOS)})")
+        if float(weight or 1) > 0:
+            names.append(name)
+            weights.append(float(weight or 1))
+    if not names:
+        raise SystemExit("情境權重不可全部為 0")
+    return names, weights
+
+
+class VirtualUser:
+    """一個虛擬使用者：自己的 Session 與帳號"""
+
+    _counter = itertools.count(1)
+
+    def __init__(self, base_url, run_id):
+        self.base_url = base_url
+        self.run_id = run_id
+        self.session = requests.Session()
+        self.profile = None
+
+    def new_profile(self):
+        index = next(VirtualUser._counter)
+        profile = generate_random_user(index)
+        # 確保同一次 (以及不同次) 執行之間帳號不重複
+        profile['username'] = f"load_{self.run_id}_{index}"
+        profile['email'] = f"load_{self.run_id}_{index}@load.local"
+        return profile
+
+    def call(self, recorder, name, method, path, scheduled=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            res = self.session.request(method, f"{self.base_url}{path}", timeout=REQUEST_TIMEOUT, **kwargs)
+            status = res.status_code
+        except requests.RequestException:
+            res, status = None, None
+        recorder.record(name, time.perf_counter() - (scheduled or start), status)
+        return res
+
+    def setup(self, recorder):
+        """註冊並登入 (計入 register / login 的統計)"""
+        self.profile = self.new_profile()
+        self.call(recorder, "register", "POST", "/register", json=self.profile)
+        self.login(recorder)
+
+    # --- 情境 ---
+
+    def register(self, recorder, scheduled=None):
+        """註冊一個新帳號 (不影響目前的登入狀態)"""
+        self.call(recorder, "register", "POST", "/register", scheduled, json=self.new_profile())
+
+    def login(self, recorder, scheduled=None):
+        credentials = {"username": self.profile['username'], "password": self.profile['password']}
+        self.call(recorder, "login", "POST", "/login", scheduled, json=credentials)
+
+    def quick(self, recorder, scheduled=None):
+        data = {k: random.choice(v) for k, v in QUICK_OPTIONS.items()}
+        self.call(recorder, "quick", "POST", "/calculate/quick", scheduled, json=data)
+
+    def detailed(self, recorder, scheduled=None):
+        self.call(recorder, "detailed", "POST", "/calculate/detailed", scheduled,
+                  json=generate_detailed_data(self.profile))
+
+    def history(self, recorder, scheduled=None):
+        self.call(recorder, "history", "GET", "/calculate/history", scheduled, params={"limit": 20})
+
+    def region(self, recorder, scheduled=None):
+        # 一半查自己的行政區，一半隨機查其他縣市
+        if random.random() < 0.5:
+            params = {"city": self.profile['city'], "district": self.profile['district']}
+        else:
+            params = {"city": random.choice(list(TAIWAN_PLACES))}
+        self.call(recorder, "region", "GET", "/stats/region", scheduled, params=params)
+
+
+SCENARIOS = {
+    "register": VirtualUser.register,
+    "login": VirtualUser.login,
+    "quick": VirtualUser.quick,
+    "detailed": VirtualUser.detailed,
+    "history": VirtualUser.history,
+    "region": VirtualUser.region,
+}
+
+
+def run_closed(users, names, weights, duration, think_time, recorder):
+    """closed-loop：每個虛擬使用者一個 thread，送完一個才送下一個"""
+    deadline = time.perf_counter() + duration
+
+    def loop(vu):
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            SCENARIOS[name](vu, recorder)
+            if think_time:
+                time.sleep(random.expovariate(1 / think_time))
+
+    threads = [threading.Thread(target=loop, args=(vu,), daemon=True) for vu in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open(users, names, weights, duration, rate, recorder):
+    """
+    open-loop：依到達率排程請求，不管前一個請求是否已回應
+    同時進行中的請求最多 len(users) 個 (每個虛擬使用者同時只處理一個)，超過時在本機排隊
+    """
+    idle = queue.Queue()
+    for vu in users:
+        idle.put(vu)
+
+    def task(name, scheduled):
+        vu = idle.get()
+        try:
+            SCENARIOS[name](vu, recorder, scheduled)
+        finally:
+            idle.put(vu)
+
+    started = time.perf_counter()
+    next_at = started
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        while next_at < started + duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, random.choices(names, weights)[0], next_at)
+            next_at += random.expovariate(rate)
+
+
+def print_summary(summary, elapsed, baseline=None):
+    print(f"\n⏱️ 測試時間 {elapsed:.1f}s")
+    print(f"{'endpoint':10s} {'count':>7s} {'req/s':>8s} {'err%':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}")
+    for name, s in summary.items():
+        line = (f"{name:10s} {s['count']:7d} {s['throughput']:8.1f} {s['error_rate'] * 100:6.2f} "
+                f"{s['p50_ms']:7.1f}ms {s['p95_ms']:7.1f}ms {s['p99_ms']:7.1f}ms {s['max_ms']:7.1f}ms")
+        if baseline and name in baseline:
+            before = baseline[name]['p99_ms']
+            change = (s['p99_ms'] - before) / before * 100 if before else 0.0
+            line += f"  (p99 {change:+.1f}% vs baseline)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load generator for the carbon footprint API")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--users", type=int, default=10, help="虛擬使用者數 (open 模式下為最大同時請求數)")
+    parser.add_argument("--duration", type=float, default=30.0, help="測試秒數 (不含帳號準備)")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--rate", type=float, default=50.0, help="open 模式的每秒請求數")
+    parser.add_argument("--think-time", type=float, default=0.0, help="closed 模式每個請求後的平均等待秒數")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"情境權重 (預設 {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="結果 JSON 輸出路徑")
+    parser.add_argument("--compare", help="與先前輸出的結果 JSON 比較 p99")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    names, weights = parse_mix(args.mix)
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    # 1. 準備虛擬使用者 (註冊 + 登入)
+    print(f"🚀 準備 {args.users} 個虛擬使用者...")
+    setup_recorder = Recorder()
+    users = [VirtualUser(args.base_url, run_id) for _ in range(args.users)]
+    with ThreadPoolExecutor(max_workers=min(args.users, 16)) as pool:
+        list(pool.map(lambda vu: vu.setup(setup_recorder), users))
+    failed = setup_recorder.errors.get("login", 0)
+    if failed == len(users):
+        raise SystemExit("❌ 所有虛擬使用者都登入失敗，請確認 server 與資料庫是否正常")
+    if failed:
+        print(f"⚠️ {failed} 個虛擬使用者登入失敗")
+
+    # 2. 壓測
+    print(f"🔥 {args.mode}-loop 壓測 {args.duration:.0f}s，情境: {dict(zip(names, weights))}")
+    recorder = Recorder()
+    started = time.perf_counter()
+    if args.mode == "closed":
+        run_closed(users, names, weights, args.duration, args.think_time, recorder)
+    else:
+        run_open(users, names, weights, args.duration, args.rate, recorder)
+    elapsed = time.perf_counter() - started
+
+    # 3. 報告
+    summary = recorder.summary(elapsed)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['endpoints']
+    print_summary(summary, elapsed, baseline)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "run_id": run_id,
+                "config": vars(args),
+                "elapsed": elapsed,
+                "endpoints": summary,
+                "setup": setup_recorder.summary(elapsed),
+            }, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from flask import Blueprint, Response, request, jsonify
+from functools import wraps
+from db_manager import get_pool_stats
+from services.export import Export, ExportBusy, build_query, parse_export_args
+from services.query_stats import query_stats
+import hmac
+import os
+
+admin_bp = Blueprint('admin', __name__)
+
+# 管理用 API 的 token (請求需帶 X-Admin-Token 或 Authorization: Bearer <token>)
+# 未設定時所有管理 API 一律關閉
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "管理 API 未啟用"}), 404
+        token = request.headers.get('X-Admin-Token', '')
+        auth = request.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            token = auth[len('Bearer '):]
+        if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({"error": "權限不足"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@admin_bp.route('/queries', methods=['GET'])
+@admin_required
+def get_query_stats():
+    """
+    SQL 執行統計
+    參數: sort=total|count|max|avg (預設 total), limit (預設 50)
+    回傳各語句的次數 / 耗時、最近的慢查詢與抽樣的 EXPLAIN 結果
+    """
+    sort = request.args.get('sort', 'total')
+    limit = request.args.get('limit', 50, type=int)
+    data = query_stats.snapshot(sort=sort, limit=max(1, min(limit, 1000)))
+    data["pool"] = get_pool_stats()
+    return jsonify(data), 200
+
+
+@admin_bp.route('/queries/reset', methods=['POST'])
+@admin_required
+def reset_query_stats():
+    """清除 SQL 執行統計"""
+    query_stats.reset()
+    return jsonify({"message": "已清除"}), 200
+
+
+# 管理者匯出的欄位 (比使用者自己的歷史多了 user_id 與係數版本)
+EXPORT_LOG_COLUMNS = ('id', 'user_id', 'log_type', 'input_data', 'total_carbon', 'breakdown',
+                      'suggestions', 'coeff_version', 'created_at')
+
+
+@admin_bp.route('/logs/export', methods=['GET'])
+@admin_required
+def export_logs():
+    """
+    串流匯出 carbon_logs (依 id 排序)
+    參數: format=ndjson|csv、start / end 日期範圍、user_id (只匯出單一使用者)、gzip=1
+    """
+    try:
+        fmt, start, end, gzip = parse_export_args(request.args)
+        user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+    except ValueError:
+        return jsonify({"error": "匯出參數錯誤"}), 400
+
+    sql, params = build_query(EXPORT_LOG_COLUMNS, user_id=user_id, start=start, end=end)
+    try:
+        export = Export(EXPORT_LOG_COLUMNS, sql, params, fmt=fmt, gzip=gzip)
+    except ExportBusy:
+        response = jsonify({"error": "匯出請求過多，請稍後再試"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        print(f"❌ Export Error: {e}")
+        return jsonify({"error": "無法匯出紀錄"}), 500
+
+    return Response(export, headers=export.headers("carbon_logs"))
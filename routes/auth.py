@@ -1,65 +1,108 @@
 from flask import Blueprint, request, jsonify, session
-from werkzeug.security import generate_password_hash, check_password_hash
-from db_manager import get_db_connection
-import re # ✨ 新增：用於驗證 Email 格式
+from mysql.connector import IntegrityError
+from db_manager import db_cursor
+from services.cache import TTLCache
+from services.metrics import register_collector
+from services.password_hasher import HasherBusy, hash_password, verify_password
+from services.user_import import run_import, validate_registration
+import click
+import os
 
 # 定義藍圖，名稱為 'auth'
 auth_bp = Blueprint('auth', __name__)
 
+# /api/me 的身分快取：key 為 user_id，value 為 {"username", "fullName"}
+# 前端每次載入頁面都會呼叫 /api/me，命中時不需要查資料庫
+# 快取只存在於各自的程序內，IDENTITY_CACHE_TTL 是跨程序唯一的一致性上限：
+# - 在伺服器程序內修改使用者名稱 / 姓名或刪除帳號的程式碼 (目前沒有這類 API) 需呼叫 invalidate_identity()，
+#   但也只會清掉該 worker 自己的快取，其他 worker 最多 TTL 秒後才看到新資料
+# - 在伺服器以外直接改資料庫 (例如 seed_data.py --cleanup、手動 SQL) 無法清除快取，
+#   被刪除的帳號在 TTL 秒內 /api/me 仍可能回傳登入中；需要立即生效時請重啟服務或調低 TTL
+identity_cache = TTLCache(
+    maxsize=int(os.getenv("IDENTITY_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("IDENTITY_CACHE_TTL", "300"))
+)
+
+def invalidate_identity(*user_ids):
+    """使用者名稱 / 姓名變更或帳號刪除後清掉本程序的快取 (其他 worker 程序依 TTL 過期)"""
+    identity_cache.invalidate(*user_ids)
+
+@register_collector
+def _identity_cache_metrics():
+    stats = identity_cache.stats()
+    return [
+        ("identity_cache_requests_total", "counter", "/api/me identity cache lookups by result",
+         [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+        ("identity_cache_entries", "gauge", "Entries in the /api/me identity cache", [({}, stats["size"])]),
+    ]
+
+def _busy_response():
+    """密碼雜湊工作已滿：立刻回 503，請前端稍後重試"""
+    response = jsonify({"error": "伺服器忙碌中，請稍後再試"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.json
     
-    required_fields = ['username', 'email', 'password', 'fullName', 'gender', 'city', 'district', 'birthdate', 'occupation']
-    if not all(k in data for k in required_fields):
-        return jsonify({"error": "缺少必填欄位"}), 400
-
-    # ✨ 新增：驗證 Email 格式
-    email_regex = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
-    if not re.match(email_regex, data['email']):
-        return jsonify({"error": "Email 格式不正確"}), 400
-
-    # ✨ 新增：驗證密碼長度 (建議至少 6 碼)
-    if len(data['password']) < 6:
-        return jsonify({"error": "密碼長度至少需 6 個字元"}), 400
+    # 必填欄位、Email 格式、密碼長度 (與大量匯入共用同一套規則)
+    error = validate_registration(data)
+    if error:
+        return jsonify({"error": error}), 400
 
     gender_val = data['gender']
     gender_other_val = data.get('genderOther', None) if gender_val == 'Other' else None
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+        try:
+            cursor.execute("SELECT username FROM users WHERE username = %s", (data['username'],))
+            if cursor.fetchone():
+                return jsonify({"error": "此帳號已被註冊"}), 409
+
+            cursor.execute("SELECT email FROM users WHERE email = %s", (data['email'],))
+            if cursor.fetchone():
+                return jsonify({"error": "此 Email 已被註冊"}), 409
+        except Exception as e:
+            print(f"Register Error: {e}")
+            return jsonify({"error": "伺服器錯誤，請稍後再試"}), 500
+
+    # 雜湊交給 worker process，計算期間不佔用資料庫連線
     try:
-        cursor.execute("SELECT username FROM users WHERE username = %s", (data['username'],))
-        if cursor.fetchone():
-            return jsonify({"error": "此帳號已被註冊"}), 409
-
-        cursor.execute("SELECT email FROM users WHERE email = %s", (data['email'],))
-        if cursor.fetchone():
-            return jsonify({"error": "此 Email 已被註冊"}), 409
-
-        hashed_password = generate_password_hash(data['password'])
-        
-        sql = """
-            INSERT INTO users (username, email, password_hash, full_name, gender, gender_other, city, district, birthdate, occupation)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        val = (
-            data['username'], data['email'], hashed_password, 
-            data['fullName'], gender_val, gender_other_val,
-            data['city'], data['district'], data['birthdate'], data['occupation']
-        )
-        cursor.execute(sql, val)
-        conn.commit()
-        
-        return jsonify({"message": "註冊成功！請登入"}), 201
-
+        hashed_password = hash_password(data['password'])
+    except HasherBusy:
+        return _busy_response()
     except Exception as e:
+        # 例如 worker process 異常結束 (BrokenProcessPool)
         print(f"Register Error: {e}")
         return jsonify({"error": "伺服器錯誤，請稍後再試"}), 500
-    finally:
-        cursor.close()
-        conn.close()
+
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+        try:
+            sql = """
+                INSERT INTO users (username, email, password_hash, full_name, gender, gender_other, city, district, birthdate, occupation)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            val = (
+                data['username'], data['email'], hashed_password, 
+                data['fullName'], gender_val, gender_other_val,
+                data['city'], data['district'], data['birthdate'], data['occupation']
+            )
+            cursor.execute(sql, val)
+            conn.commit()
+        
+            return jsonify({"message": "註冊成功！請登入"}), 201
+
+        except IntegrityError:
+            # 雜湊期間被其他請求搶先註冊了同一個帳號 / Email
+            return jsonify({"error": "此帳號或 Email 已被註冊"}), 409
+        except Exception as e:
+            print(f"Register Error: {e}")
+            return jsonify({"error": "伺服器錯誤，請稍後再試"}), 500
 
 @auth_bp.route('/login', methods=['POST'])
 def login():
@@ -67,60 +110,89 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+        try:
+            cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+            user = cursor.fetchone()
+        except Exception as e:
+            print(f"Login Error: {e}")
+            return jsonify({"error": str(e)}), 500
 
+    # 驗證交給 worker process，計算期間不佔用資料庫連線
     try:
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-
-        if user and check_password_hash(user['password_hash'], password):
-            # 登入成功，寫入 Session
-            session.clear()
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            session.permanent = True
-            
-            print(f"✅ Login Success: User {username} logged in, session ID: {session.get('user_id')}")
-            
-            return jsonify({
-                "message": "登入成功",
-                "user": {"username": user['username'], "fullName": user['full_name']}
-            }), 200
-        else:
-            return jsonify({"error": "帳號或密碼錯誤"}), 401
-
+        ok, upgraded_hash = verify_password(user['password_hash'], password) if user else (False, None)
+    except HasherBusy:
+        return _busy_response()
     except Exception as e:
         print(f"Login Error: {e}")
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        return jsonify({"error": "伺服器錯誤，請稍後再試"}), 500
+
+    if upgraded_hash:
+        # 舊的雜湊強度與目前設定不同：登入成功時順便換成新雜湊 (失敗不影響登入)
+        with db_cursor() as (conn, cursor):
+            try:
+                if conn:
+                    cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                                   (upgraded_hash, user['id'], user['password_hash']))
+                    conn.commit()
+            except Exception as e:
+                print(f"⚠️ Password hash upgrade failed: {e}")
+
+    if ok:
+        # 登入成功，寫入 Session
+        session.clear()
+        session['user_id'] = user['id']
+        session['username'] = user['username']
+        session.permanent = True
+        # 登入時已讀到最新資料，順便放進快取，接下來的 /api/me 不必再查資料庫
+        identity_cache.set(user['id'], {"username": user['username'], "fullName": user['full_name']})
+    
+        print(f"✅ Login Success: User {username} logged in, session ID: {session.get('user_id')}")
+    
+        return jsonify({
+            "message": "登入成功",
+            "user": {"username": user['username'], "fullName": user['full_name']}
+        }), 200
+    else:
+        return jsonify({"error": "帳號或密碼錯誤"}), 401
 
 @auth_bp.route('/me', methods=['GET'])
 def get_current_user():
-    """檢查使用者是否已登入"""
-    print(f"🔍 Session Check: {session}")
-    
-    if 'user_id' in session:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        try:
-            cursor.execute("SELECT username, full_name FROM users WHERE id = %s", (session['user_id'],))
+    """檢查使用者是否已登入 (先查身分快取，未命中才讀資料庫)"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return jsonify({"is_logged_in": False}), 401
+
+    identity = identity_cache.get(user_id)
+    if identity is None:
+        with db_cursor(dictionary=True) as (conn, cursor):
+            if not conn:
+                return jsonify({"error": "資料庫連線失敗"}), 500
+            cursor.execute("SELECT username, full_name FROM users WHERE id = %s", (user_id,))
             user = cursor.fetchone()
-            if user:
-                return jsonify({
-                    "is_logged_in": True,
-                    "user": {"username": user['username'], "fullName": user['full_name']}
-                }), 200
-        finally:
-            cursor.close()
-            conn.close()
-    
-    return jsonify({"is_logged_in": False}), 401
+        if not user:
+            return jsonify({"is_logged_in": False}), 401
+        identity = {"username": user['username'], "fullName": user['full_name']}
+        identity_cache.set(user_id, identity)
+
+    return jsonify({"is_logged_in": True, "user": identity}), 200
 
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
     session.clear()
     print("✅ User logged out")
-    return jsonify({"message": "已登出"}), 200
\ No newline at end of file
+    return jsonify({"message": "已登出"}), 200
+
+@auth_bp.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None, help='檔案格式 (預設依副檔名判斷)')
+@click.option('--reject-file', default='import_rejects.ndjson', show_default=True, help='驗證失敗 / 重複的資料寫入此檔')
+@click.option('--batch-size', default=1000, show_default=True, help='每個多列 INSERT 的筆數')
+@click.option('--workers', default=None, type=int, help='平行雜湊的 process 數 (預設 CPU 核心數，0 = 不開 process)')
+def import_users_command(path, fmt, reject_file, batch_size, workers):
+    """從 CSV / NDJSON 大量匯入使用者帳號 (flask --app app auth import-users users.csv)"""
+    stats = run_import(path, fmt=fmt, reject_path=reject_file, batch_size=batch_size, workers=workers)
+    print(f"✅ 匯入完成: 讀取 {stats['read']} 筆，成功 {stats['imported']} 筆，拒絕 {stats['rejected']} 筆 "
+          f"({reject_file})，{stats['seconds']:.1f}s，{stats['rows_per_second']:.0f} rows/s")
@@ -1,12 +1,31 @@
-from flask import Blueprint, request, jsonify, session
-from db_manager import get_db_connection
+from flask import Blueprint, Response, request, jsonify, session
+import click
+from db_manager import db_cursor, db_connection
 # 引入計算服務
-from services.calculator import calculate_quick_footprint, calculate_detailed_footprint
+from services.calculator import calculate_quick_footprint, calculate_detailed_footprint, get_quick_table, get_quick_table_stats
+from services.carbon_data import get_compiled_coeffs, refresh_now
+from services.backfill import run_backfill
+from services.export import Export, ExportBusy, build_query, parse_export_args
+from services.trends import parse_trend_args, query_user_trend
+from services.log_store import save_log, save_logs, rebuild_rollup
+from services import write_behind
+from services.metrics import phase, register_collector
+import base64
 import json
+import os
 
 # 定義藍圖，名稱為 'calculation'
 calc_bp = Blueprint('calculation', __name__)
 
+# 批次計算單次最多筆數
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "500"))
+
+# 批次項目的 type 對應到計算函式與 log_type
+BATCH_CALCULATORS = {
+    "quick": (calculate_quick_footprint, 'Quick'),
+    "detailed": (calculate_detailed_footprint, 'Detailed'),
+}
+
 @calc_bp.route('/quick', methods=['POST'])
 def quick_calculation():
     """快速估算 API - 需要登入"""
@@ -18,30 +37,19 @@ def quick_calculation():
     
     try:
         # 2. 呼叫快速計算邏輯 (來自 services/calculator.py)
-        result = calculate_quick_footprint(data)
-        
-        # 3. 寫入資料庫
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "資料庫連線失敗"}), 500
-            
-        cursor = conn.cursor()
+        with phase('calc'):
+            result = calculate_quick_footprint(data)
         
-        sql = """
-            INSERT INTO carbon_logs (user_id, log_type, input_data, total_carbon, breakdown, suggestions)
-            VALUES (%s, 'Quick', %s, %s, %s, %s)
-        """
-        val = (
-            session['user_id'],
-            json.dumps(data),
-            result['total'],
-            json.dumps(result['breakdown']),
-            result['suggestion']
-        )
-        cursor.execute(sql, val)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # 3. 寫入資料庫 (開啟 write-behind 時交給背景 writer，佇列滿才同步寫入)
+        if write_behind.submit((session['user_id'], 'Quick', data, result)):
+            return jsonify(result), 200
+
+        with db_cursor() as (conn, cursor):
+            if not conn:
+                return jsonify({"error": "資料庫連線失敗"}), 500
+
+            # 寫入紀錄並同步更新區域彙總，log_type 設為 'Quick' (同一個交易)
+            save_log(conn, cursor, session['user_id'], 'Quick', data, result)
 
         # 4. 回傳結果給前端 (這行最重要，之前就是少了回傳)
         return jsonify(result), 200
@@ -63,30 +71,18 @@ def detailed_calculation():
 
     try:
         # 呼叫詳細計算邏輯
-        result = calculate_detailed_footprint(data)
+        with phase('calc'):
+            result = calculate_detailed_footprint(data)
         
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "資料庫連線失敗"}), 500
+        if write_behind.submit((session['user_id'], 'Detailed', data, result)):
+            return jsonify(result), 200
 
-        cursor = conn.cursor()
-        
-        # 寫入資料庫，log_type 設為 'Detailed'
-        sql = """
-            INSERT INTO carbon_logs (user_id, log_type, input_data, total_carbon, breakdown, suggestions)
-            VALUES (%s, 'Detailed', %s, %s, %s, %s)
-        """
-        val = (
-            session['user_id'],
-            json.dumps(data),
-            result['total'],
-            json.dumps(result['breakdown']),
-            result['suggestion']
-        )
-        cursor.execute(sql, val)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db_cursor() as (conn, cursor):
+            if not conn:
+                return jsonify({"error": "資料庫連線失敗"}), 500
+
+            # 寫入紀錄並同步更新區域彙總，log_type 設為 'Detailed' (同一個交易)
+            save_log(conn, cursor, session['user_id'], 'Detailed', data, result)
 
         return jsonify(result), 200
 
@@ -94,29 +90,260 @@ def detailed_calculation():
         print(f"❌ Detailed Calc Error: {e}")
         return jsonify({"error": "計算失敗"}), 500
 
+@calc_bp.route('/batch', methods=['POST'])
+def batch_calculation():
+    """
+    批次估算 API - 需要登入
+    body: [{"type": "quick" | "detailed", "data": {...}}, ...]
+    所有成功的項目以單一 executemany 在同一個交易內寫入
+    回傳每一筆的結果或錯誤訊息 (順序與輸入相同)
+    """
+    if 'user_id' not in session:
+        return jsonify({"error": "請先登入"}), 401
+
+    items = request.json
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "請提供估算項目陣列"}), 400
+    if len(items) > BATCH_MAX_SIZE:
+        return jsonify({"error": f"單次最多 {BATCH_MAX_SIZE} 筆"}), 413
+
+    results = []
+    records = []
+    for index, item in enumerate(items):
+        try:
+            kind, data = item['type'], item['data']
+        except KeyError as e:
+            results.append({"index": index, "ok": False, "error": f"缺少欄位: {e.args[0]}"})
+            continue
+        except TypeError:
+            results.append({"index": index, "ok": False, "error": "項目格式錯誤"})
+            continue
+        if not isinstance(kind, str) or kind not in BATCH_CALCULATORS:
+            results.append({"index": index, "ok": False, "error": f"不支援的類型: {kind}"})
+            continue
+        calculate, log_type = BATCH_CALCULATORS[kind]
+        try:
+            with phase('calc'):
+                result = calculate(data)
+        except KeyError as e:
+            results.append({"index": index, "ok": False, "error": f"缺少欄位: {e.args[0]}"})
+            continue
+        except Exception as e:
+            results.append({"index": index, "ok": False, "error": f"計算失敗: {e}"})
+            continue
+        results.append({"index": index, "ok": True, "result": result})
+        records.append((session['user_id'], log_type, data, result))
+
+    if records:
+        with db_cursor() as (conn, cursor):
+            if not conn:
+                return jsonify({"error": "資料庫連線失敗"}), 500
+            try:
+                save_logs(conn, cursor, records)
+            except Exception as e:
+                print(f"❌ Batch Calc Error: {e}")
+                return jsonify({"error": "寫入失敗"}), 500
+
+    return jsonify({"saved": len(records), "results": results}), 200
+
+# 歷史紀錄可選的欄位 (id 與 created_at 一定會帶，用來產生下一頁 cursor)
+HISTORY_FIELDS = ('id', 'log_type', 'input_data', 'total_carbon', 'breakdown', 'suggestions', 'created_at')
+HISTORY_DEFAULT_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+
+def _encode_cursor(row):
+    """以最後一筆的 (created_at, id) 產生下一頁的 cursor"""
+    created_at = row['created_at'].isoformat(sep=' ') if row['created_at'] else ''
+    raw = json.dumps([created_at, row['id']])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor_str):
+    created_at, log_id = json.loads(base64.urlsafe_b64decode(cursor_str.encode('ascii')))
+    return created_at, int(log_id)
+
 # ✨ 新增：取得歷史紀錄 API
 @calc_bp.route('/history', methods=['GET'])
 def get_history():
-    """取得使用者歷史紀錄"""
+    """
+    取得使用者歷史紀錄 (以 (created_at, id) 做 keyset 分頁)
+    query string:
+      limit  - 每頁筆數 (預設 20，最多 100)
+      cursor - 上一頁回傳的 next_cursor
+      fields - 要回傳的欄位，以逗號分隔 (例如列表頁不需要 input_data)
+    回傳: {"items": [...], "next_cursor": "..." 或 null}
+    """
     if 'user_id' not in session:
         return jsonify({"error": "請先登入"}), 401
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "資料庫連線失敗"}), 500
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), 1), HISTORY_MAX_LIMIT)
+        cursor_arg = request.args.get('cursor')
+        after = _decode_cursor(cursor_arg) if cursor_arg else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "分頁參數錯誤"}), 400
+
+    fields_arg = request.args.get('fields')
+    if fields_arg:
+        fields = [f.strip() for f in fields_arg.split(',') if f.strip()]
+        if any(f not in HISTORY_FIELDS for f in fields):
+            return jsonify({"error": "不支援的欄位"}), 400
+        columns = ['id', 'created_at'] + [f for f in fields if f not in ('id', 'created_at')]
+    else:
+        columns = list(HISTORY_FIELDS)
+
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+
+        try:
+            # 依照時間倒序排列 (最新的在最上面)，走 (user_id, created_at, id) 索引，不需額外排序
+            sql = f"SELECT {', '.join(columns)} FROM carbon_logs WHERE user_id = %s"
+            params = [session['user_id']]
+            if after:
+                sql += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+                params += [after[0], after[0], after[1]]
+            sql += " ORDER BY created_at DESC, id DESC LIMIT %s"
+            params.append(limit + 1)
+
+            cursor.execute(sql, tuple(params))
+            logs = cursor.fetchall()
+
+            # 多抓一筆判斷是否還有下一頁
+            next_cursor = _encode_cursor(logs[limit - 1]) if len(logs) > limit else None
+            items = logs[:limit]
+            if fields_arg:
+                items = [{k: v for k, v in log.items() if k in fields} for log in items]
+
+            return jsonify({"items": items, "next_cursor": next_cursor}), 200
+
+        except Exception as e:
+            print(f"❌ History Error: {e}")
+            return jsonify({"error": "無法取得紀錄"}), 500
+
+@calc_bp.route('/history/export', methods=['GET'])
+def export_history():
+    """
+    下載自己的完整歷史紀錄 (串流輸出，筆數再多記憶體用量也固定)
+    query string:
+      format - ndjson (預設) 或 csv
+      start / end - 日期範圍 (ISO 格式，例如 2025-01-01；只有日期的 end 包含當天)
+      gzip - 1 表示以 gzip 壓縮
+    """
+    if 'user_id' not in session:
+        return jsonify({"error": "請先登入"}), 401
 
     try:
-        cursor = conn.cursor(dictionary=True)
-        # 依照時間倒序排列 (最新的在最上面)
-        sql = "SELECT * FROM carbon_logs WHERE user_id = %s ORDER BY created_at DESC"
-        cursor.execute(sql, (session['user_id'],))
-        logs = cursor.fetchall()
-        
-        return jsonify(logs), 200
+        fmt, start, end, gzip = parse_export_args(request.args)
+    except ValueError:
+        return jsonify({"error": "匯出參數錯誤"}), 400
 
+    columns = list(HISTORY_FIELDS)
+    sql, params = build_query(columns, user_id=session['user_id'], start=start, end=end)
+    try:
+        export = Export(columns, sql, params, fmt=fmt, gzip=gzip)
+    except ExportBusy:
+        response = jsonify({"error": "匯出請求過多，請稍後再試"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
     except Exception as e:
-        print(f"❌ History Error: {e}")
-        return jsonify({"error": "無法取得紀錄"}), 500
-    finally:
-        if 'cursor' in locals(): cursor.close()
-        if 'conn' in locals(): conn.close()
\ No newline at end of file
+        print(f"❌ Export Error: {e}")
+        return jsonify({"error": "無法匯出紀錄"}), 500
+
+    return Response(export, headers=export.headers("carbon_history"))
+
+@calc_bp.route('/history/trend', methods=['GET'])
+def get_history_trend():
+    """
+    自己的碳排趨勢 (讀趨勢彙總表，不掃描 carbon_logs)
+    query string: period=month (預設，24 點) | week (26 點)、points (最多 120)
+    回傳: {"period", "series": [{"bucket", "count", "avg_total", "breakdown_avg"}, ...]}
+    """
+    if 'user_id' not in session:
+        return jsonify({"error": "請先登入"}), 401
+
+    try:
+        period, points = parse_trend_args(request.args)
+    except (ValueError, TypeError):
+        return jsonify({"error": "趨勢參數錯誤"}), 400
+
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+        try:
+            series = query_user_trend(cursor, session['user_id'], period, points)
+        except Exception as e:
+            print(f"❌ Trend Error: {e}")
+            return jsonify({"error": "無法取得趨勢"}), 500
+
+    return jsonify({"period": period, "series": series}), 200
+
+@calc_bp.route('/history/<int:log_id>', methods=['GET'])
+def get_history_detail(log_id):
+    """取得單筆完整紀錄 (只能讀取自己的紀錄)"""
+    if 'user_id' not in session:
+        return jsonify({"error": "請先登入"}), 401
+
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+
+        try:
+            cursor.execute(
+                f"SELECT {', '.join(HISTORY_FIELDS)} FROM carbon_logs WHERE id = %s AND user_id = %s",
+                (log_id, session['user_id'])
+            )
+            log = cursor.fetchone()
+            if not log:
+                return jsonify({"error": "找不到紀錄"}), 404
+            return jsonify(log), 200
+
+        except Exception as e:
+            print(f"❌ History Error: {e}")
+            return jsonify({"error": "無法取得紀錄"}), 500
+
+@calc_bp.cli.command('backfill')
+@click.option('--workers', default=1, show_default=True, help='平行處理的 process 數')
+@click.option('--chunk-size', default=1000, show_default=True, help='每次讀取 / 寫回的筆數')
+@click.option('--checkpoint-dir', default='backfill_checkpoints', show_default=True, help='checkpoint 存放目錄')
+@click.option('--stale-only', is_flag=True, help='只重算係數版本不是最新的紀錄')
+def backfill_command(workers, chunk_size, checkpoint_dir, stale_only):
+    """以最新係數重算所有歷史紀錄 (flask --app app calculation backfill)"""
+    refresh_now()
+    compiled = get_compiled_coeffs()
+    print(f"📐 使用係數版本 {compiled.version}: {dict(compiled.coeffs['energy'])}")
+
+    stats = run_backfill(workers=workers, chunk_size=chunk_size, checkpoint_dir=checkpoint_dir,
+                         skip_version=compiled.version if stale_only else None)
+    print(f"✅ 重算完成: {stats['processed']} 筆 (更新 {stats['updated']}，失敗 {stats['failed']})，"
+          f"{stats['seconds']:.1f}s，{stats['rows_per_second']:.0f} rows/s")
+
+    # 紀錄數值已變更，重建區域彙總表
+    with db_connection() as conn:
+        if conn:
+            rebuild_rollup(conn)
+            print("✅ 區域彙總表已重建")
+
+@calc_bp.cli.command('verify-quick-table')
+def verify_quick_table_command():
+    """比對快速估算結果表與即時計算的結果 (flask --app app calculation verify-quick-table)"""
+    compiled = get_compiled_coeffs()
+    table = get_quick_table(compiled)
+    if table is None:
+        print("❌ 結果表無法建立或與即時計算不一致，已停用查表")
+        raise SystemExit(1)
+    mismatched = table.verify()
+    if mismatched:
+        print(f"❌ {len(mismatched)} 組不一致: {mismatched[:5]}")
+        raise SystemExit(1)
+    print(f"✅ 版本 {compiled.version} 的 {len(table.results)} 組結果與即時計算一致")
+
+@register_collector
+def _quick_table_metrics():
+    stats = get_quick_table_stats()
+    if not stats:
+        return []
+    return [
+        ("quick_table_lookups_total", "counter", "Quick-estimate result table lookups by result",
+         [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+        ("quick_table_entries", "gauge", "Precomputed quick-estimate combinations", [({}, stats["size"])]),
+    ]
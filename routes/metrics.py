@@ -0,0 +1,80 @@
+from flask import Blueprint, Response, g, request
+from db_manager import get_pool_stats
+from services import metrics, password_hasher, write_behind
+import time
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def init_request_metrics(app):
+    """
+    在 app 上掛上請求計時 (於 app.py 呼叫)
+    每個請求記錄路由的延遲、狀態碼與 db / coeffs / calc / other 各階段時間
+    路由以 URL 規則 (例如 /api/calculate/history/<int:log_id>) 為 label，避免 label 數量爆增
+    """
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_status = 500   # 沒有走到 after_request (例外) 時視為 500
+        metrics.begin_request()
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _observe(exc):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(
+            request.method, route, g.pop('metrics_status', 500),
+            time.perf_counter() - start, metrics.end_request()
+        )
+
+
+@metrics.register_collector
+def _pool_metrics():
+    """資料庫連線池的即時狀態"""
+    stats = get_pool_stats()
+    return [
+        ("db_pool_connections", "gauge", "DB pool connections by state",
+         [({"state": "in_use"}, stats["in_use"]), ({"state": "idle"}, stats["idle"]), ({"state": "size"}, stats["size"])]),
+        ("db_pool_checkouts_total", "counter", "DB pool checkouts", [({}, stats["checkouts"])]),
+        ("db_pool_timeouts_total", "counter", "DB pool checkout timeouts", [({}, stats["timeouts"])]),
+        ("db_pool_wait_seconds_total", "counter", "Total time spent waiting for a DB connection",
+         [({}, stats["wait_time_total"])]),
+    ]
+
+
+@metrics.register_collector
+def _write_behind_metrics():
+    stats = write_behind.get_stats()
+    if not stats:
+        return []
+    return [
+        ("write_behind_queue_depth", "gauge", "Records waiting in the write-behind queue", [({}, stats["queued"])]),
+        ("write_behind_records_total", "counter", "Write-behind records by outcome",
+         [({"outcome": k}, stats[k]) for k in ("submitted", "rejected", "written", "dropped")]),
+    ]
+
+
+@metrics.register_collector
+def _password_hasher_metrics():
+    stats = password_hasher.get_stats()
+    if not stats:
+        return []
+    return [
+        ("password_hash_pending", "gauge", "Password hash jobs queued or running", [({}, stats["pending"])]),
+        ("password_hash_jobs_total", "counter", "Password hash jobs by outcome",
+         [({"outcome": k}, stats[k]) for k in ("completed", "failed", "rejected", "timed_out", "upgraded")]),
+    ]
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文字格式的效能指標"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
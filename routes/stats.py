@@ -1,9 +1,191 @@
-from flask import Blueprint, request, jsonify
-from db_manager import get_db_connection
+from flask import Blueprint, Response, request, jsonify, session
+from db_manager import db_cursor, db_connection
+from services.cache import TTLCache
+from services.log_store import BREAKDOWN_KEYS, DISTRIBUTION_METRICS, rebuild_rollup, register_commit_listener
+from services.metrics import register_collector
+from services.rank_index import rank_index, start as start_rank_index
+from services.sketch import bucket_sql, summarize
+from services.trends import parse_trend_args, query_region_trend
+import hashlib
 import json
+import os
 
 stats_bp = Blueprint('stats', __name__)
 
+# 統計來源：rollup (預設，讀區域彙總表) 或 sql (直接對 carbon_logs 做 SQL 聚合)
+STATS_SOURCE = os.getenv("STATS_SOURCE", "rollup")
+
+# 統計結果快取：key 為 (city, district)，寫入新紀錄時只清掉受影響的 key
+stats_cache = TTLCache(
+    maxsize=int(os.getenv("STATS_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("STATS_CACHE_TTL", "60"))
+)
+
+SOURCE_MAP = {
+    "transport": "交通", "diet": "飲食", "energy": "能源",
+    "consumption": "消費", "waste": "廢棄物"
+}
+
+def _query_rollup(cursor, city, district):
+    """
+    從 region_stats_rollup 取出指定範圍的加總
+    彙總表已預先累加好 行政區 / 縣市 / 全台 三個層級，只需讀取少數幾列 (依 log_type)
+    """
+    sums = ", ".join(f"SUM(sum_{k}) AS sum_{k}" for k in BREAKDOWN_KEYS)
+    query = f"""
+        SELECT SUM(sample_count) AS sample_count, SUM(sum_total) AS sum_total, {sums}
+        FROM region_stats_rollup
+    """
+    if city:
+        # 有縣市：直接讀 (city, district) 或 (city, '') 那一層
+        query += " WHERE city = %s AND district = %s"
+        params = (city, district or '')
+    elif district:
+        # 只有行政區 (不同縣市可能同名)：合併各縣市的該行政區
+        query += " WHERE city <> '' AND district = %s"
+        params = (district,)
+    else:
+        # 全台灣
+        query += " WHERE city = '' AND district = ''"
+        params = ()
+
+    cursor.execute(query, params)
+    return cursor.fetchone()
+
+def _query_logs(cursor, city, district):
+    """
+    直接對 carbon_logs 做單一聚合查詢，只回傳一列
+    類別加總使用 bd_* 生成欄位；users 的 (city, district) 索引負責篩選
+    回傳格式與 _query_rollup 相同
+    """
+    sums = ", ".join(f"SUM(l.bd_{k}) AS sum_{k}" for k in BREAKDOWN_KEYS)
+    # WHERE 1=1 是一個常用的技巧，方便後面動態串接 AND
+    query = f"""
+        SELECT COUNT(*) AS sample_count, SUM(l.total_carbon) AS sum_total, {sums}
+        FROM carbon_logs l
+        JOIN users u ON l.user_id = u.id
+        WHERE 1=1
+    """
+    params = []
+
+    # 如果有指定城市，才加入篩選條件
+    if city:
+        query += " AND u.city = %s"
+        params.append(city)
+
+    # 如果有指定行政區，才加入篩選條件
+    if district:
+        query += " AND u.district = %s"
+        params.append(district)
+
+    cursor.execute(query, tuple(params))
+    return cursor.fetchone()
+
+def _region_filter(city, district):
+    """分佈 sketch 的 WHERE 條件 (與 _query_rollup 相同的層級選擇)"""
+    if city:
+        return " WHERE city = %s AND district = %s", (city, district or '')
+    if district:
+        return " WHERE city <> '' AND district = %s", (district,)
+    return " WHERE city = '' AND district = ''", ()
+
+def _query_distribution(cursor, city, district):
+    """
+    從 region_distribution 取出指定範圍的分佈 sketch：{metric: {bucket: 次數}}
+    只指定行政區時，各縣市同名行政區的 sketch 直接相加合併
+    """
+    where, params = _region_filter(city, district)
+    cursor.execute(
+        f"SELECT metric, bucket, SUM(sample_count) AS n FROM region_distribution{where} GROUP BY metric, bucket",
+        params
+    )
+    sketches = {}
+    for row in cursor.fetchall():
+        sketches.setdefault(row['metric'], {})[row['bucket']] = int(row['n'])
+    return sketches
+
+def _query_distribution_logs(cursor, city, district):
+    """直接對 carbon_logs 分箱 (STATS_SOURCE=sql)，回傳格式與 _query_distribution 相同"""
+    conditions = []
+    params = []
+    if city:
+        conditions.append("u.city = %s")
+        params.append(city)
+    if district:
+        conditions.append("u.district = %s")
+        params.append(district)
+    where = "".join(f" AND {c}" for c in conditions)
+
+    selects = []
+    for metric in DISTRIBUTION_METRICS:
+        column = "l.total_carbon" if metric == "total" else f"l.bd_{metric}"
+        selects.append(f"""
+            SELECT '{metric}' AS metric, {bucket_sql(column)} AS bucket, COUNT(*) AS n
+            FROM carbon_logs l
+            JOIN users u ON l.user_id = u.id
+            WHERE {column} IS NOT NULL{where}
+            GROUP BY bucket
+        """)
+    cursor.execute(" UNION ALL ".join(selects), tuple(params) * len(selects))
+    sketches = {}
+    for row in cursor.fetchall():
+        sketches.setdefault(row['metric'], {})[row['bucket']] = int(row['n'])
+    return sketches
+
+def _build_distribution(sketches):
+    """各指標的 p50 / p90 / p99 與直方圖 (平均值容易被少數高排放者拉高)"""
+    return {metric: summarize(sketches[metric]) for metric in DISTRIBUTION_METRICS if sketches.get(metric)}
+
+def _build_stats(row):
+    """將加總列換算成回傳給前端的統計結果"""
+    valid_count = int(row['sample_count'] or 0) if row else 0
+
+    # 如果沒數據，回傳空結果
+    if not valid_count:
+        return {
+            "sample_count": 0,
+            "avg_total": 0,
+            "breakdown_avg": {},
+            "top_source": "無資料"
+        }
+
+    # 由加總換算平均 (類別加總為 NULL 代表沒有這個類別)
+    avg_total = round(float(row['sum_total']) / valid_count, 1)
+    avg_breakdown = {
+        k: round(float(row[f'sum_{k}']) / valid_count, 1)
+        for k in BREAKDOWN_KEYS
+        if row[f'sum_{k}'] is not None
+    }
+
+    top_source_key = max(avg_breakdown, key=avg_breakdown.get) if avg_breakdown else "無"
+    top_source_zh = SOURCE_MAP.get(top_source_key, top_source_key)
+
+    chart_data = [
+        {"name": SOURCE_MAP.get(k, k), "value": v}
+        for k, v in avg_breakdown.items()
+    ]
+
+    return {
+        "sample_count": valid_count,
+        "avg_total": avg_total,
+        "breakdown_avg": avg_breakdown,
+        "top_source": top_source_zh,
+        "chart_data": chart_data
+    }
+
+@register_commit_listener
+def _invalidate_stats_cache(entries):
+    """新紀錄寫入後，只清掉受影響的 行政區 / 縣市 / 全台 快取"""
+    keys = set()
+    for e in entries:
+        keys.update({
+            (e['city'], e['district']),
+            (e['city'], ''),
+            ('', e['district']),
+            ('', ''),
+        })
+    stats_cache.invalidate(*keys)
+
 @stats_bp.route('/region', methods=['GET'])
 def get_regional_stats():
     city = request.args.get('city')
@@ -12,88 +194,133 @@ def get_regional_stats():
     # ✨ 修改 1：不再強制檢查 city
     # if not city: return jsonify({"error": "請選擇縣市"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    # 快取 key 以正規化後的篩選條件為準 (未指定視為空字串)
+    cache_key = ((city or '').strip(), (district or '').strip())
+    cached = stats_cache.get(cache_key)
+
+    if cached is None:
+        with db_cursor(dictionary=True) as (conn, cursor):
+            if not conn:
+                return jsonify({"error": "資料庫連線失敗"}), 500
 
-    try:
-        # ✨ 修改 2：使用動態 SQL 組裝
-        # WHERE 1=1 是一個常用的技巧，方便後面動態串接 AND
-        query = """
-            SELECT l.total_carbon, l.breakdown, l.log_type
-            FROM carbon_logs l
-            JOIN users u ON l.user_id = u.id
-            WHERE 1=1
-        """
-        params = []
-
-        # 如果有指定城市，才加入篩選條件
-        if city:
-            query += " AND u.city = %s"
-            params.append(city)
-
-        # 如果有指定行政區，才加入篩選條件
-        if district:
-            query += " AND u.district = %s"
-            params.append(district)
-
-        cursor.execute(query, tuple(params))
-        logs = cursor.fetchall()
-
-        # 2. 如果沒數據，回傳空結果
-        if not logs:
-            return jsonify({
-                "sample_count": 0,
-                "avg_total": 0,
-                "breakdown_avg": {},
-                "top_source": "無資料"
-            })
-
-        # 3. Python 端計算統計數據 (邏輯保持不變)
-        total_sum = 0
-        breakdown_sums = {}
-        valid_count = 0
-
-        for log in logs:
-            total_sum += log['total_carbon']
-            valid_count += 1
-            
             try:
-                bd = log['breakdown']
-                if isinstance(bd, str):
-                    bd = json.loads(bd)
-                
-                for key, val in bd.items():
-                    breakdown_sums[key] = breakdown_sums.get(key, 0) + val
-            except:
-                continue
-
-        avg_total = round(total_sum / valid_count, 1)
-        avg_breakdown = {k: round(v / valid_count, 1) for k, v in breakdown_sums.items()}
-
-        source_map = {
-            "transport": "交通", "diet": "飲食", "energy": "能源", 
-            "consumption": "消費", "waste": "廢棄物"
-        }
-        
-        top_source_key = max(avg_breakdown, key=avg_breakdown.get) if avg_breakdown else "無"
-        top_source_zh = source_map.get(top_source_key, top_source_key)
-
-        chart_data = [
-            {"name": source_map.get(k, k), "value": v} 
-            for k, v in avg_breakdown.items()
-        ]
-
-        return jsonify({
-            "sample_count": valid_count,
-            "avg_total": avg_total,
-            "breakdown_avg": avg_breakdown,
-            "top_source": top_source_zh,
-            "chart_data": chart_data
-        })
+                # ✨ 修改 2：改讀區域彙總表 (或 SQL 端聚合)，不再逐筆撈出 carbon_logs 計算
+                if STATS_SOURCE == 'sql':
+                    row = _query_logs(cursor, *cache_key)
+                    sketches = _query_distribution_logs(cursor, *cache_key)
+                else:
+                    row = _query_rollup(cursor, *cache_key)
+                    sketches = _query_distribution(cursor, *cache_key)
+                payload = _build_stats(row)
+                payload["distribution"] = _build_distribution(sketches)
+            except Exception as e:
+                print(f"Stats Error: {e}")
+                return jsonify({"error": "統計失敗"}), 500
+
+        body = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        cached = (payload, hashlib.sha1(body.encode('utf-8')).hexdigest())
+        stats_cache.set(cache_key, cached)
+
+    payload, etag = cached
+
+    # ✨ 內容沒變就回 304，不傳 body
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    return response
+
+@stats_bp.route('/trend', methods=['GET'])
+def get_regional_trend():
+    """
+    區域的碳排趨勢 (city / district 可省略，與 /region 相同)
+    query string: period=month (預設，24 點) | week (26 點)、points (最多 120)
+    """
+    city = (request.args.get('city') or '').strip()
+    district = (request.args.get('district') or '').strip()
+    try:
+        period, points = parse_trend_args(request.args)
+    except (ValueError, TypeError):
+        return jsonify({"error": "趨勢參數錯誤"}), 400
+
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+        try:
+            series = query_region_trend(cursor, city, district, period, points)
+        except Exception as e:
+            print(f"Trend Error: {e}")
+            return jsonify({"error": "趨勢查詢失敗"}), 500
+
+    return jsonify({"period": period, "series": series}), 200
+
+@stats_bp.route('/rank', methods=['GET'])
+def get_my_rank():
+    """
+    我的最新一筆結果在 行政區 / 縣市 / 全台 的排名 (需要登入)
+    rank 1 為碳排最低；percentile 為碳排比我低的紀錄比例 (%)，由記憶體內的排名索引回答，不需掃描 carbon_logs
+    比較對象是該範圍內的所有計算紀錄 (不是每位使用者的最新一筆)，回應中以 basis: "records" 標明
+    """
+    if 'user_id' not in session:
+        return jsonify({"error": "請先登入"}), 401
+    # 第一次查詢排名時才在背景載入索引 (flask CLI 指令等不需要排名的程序不會啟動載入執行緒)
+    start_rank_index()
+    if rank_index.loaded_at is None:
+        response = jsonify({"error": "排名資料載入中，請稍後再試"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    with db_cursor(dictionary=True) as (conn, cursor):
+        if not conn:
+            return jsonify({"error": "資料庫連線失敗"}), 500
+        try:
+            # 走 (user_id, created_at, id) 索引，只讀一列
+            cursor.execute("""
+                SELECT u.city, u.district, l.total_carbon
+                FROM users u
+                JOIN carbon_logs l ON l.user_id = u.id
+                WHERE u.id = %s
+                ORDER BY l.created_at DESC, l.id DESC
+                LIMIT 1
+            """, (session['user_id'],))
+            latest = cursor.fetchone()
+        except Exception as e:
+            print(f"Rank Error: {e}")
+            return jsonify({"error": "排名查詢失敗"}), 500
+
+    if not latest:
+        return jsonify({"error": "尚無計算紀錄"}), 404
+
+    city, district, total = latest['city'], latest['district'], float(latest['total_carbon'])
+    return jsonify({
+        "total_carbon": total,
+        "basis": "records",
+        "district": dict(name=district, **(rank_index.rank(city, district, total) or {})),
+        "city": dict(name=city, **(rank_index.rank(city, '', total) or {})),
+        "national": rank_index.rank('', '', total) or {},
+    }), 200
+
+@stats_bp.route('/cache', methods=['GET'])
+def get_stats_cache_info():
+    """統計快取的命中 / 未命中次數"""
+    return jsonify(stats_cache.stats())
+
+@register_collector
+def _stats_cache_metrics():
+    stats = stats_cache.stats()
+    return [
+        ("stats_cache_requests_total", "counter", "Regional stats cache lookups by result",
+         [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+        ("stats_cache_entries", "gauge", "Entries in the regional stats cache", [({}, stats["size"])]),
+    ]
 
-    except Exception as e:
-        print(f"Stats Error: {e}")
-        return jsonify({"error": "統計失敗"}), 500
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+@stats_bp.cli.command('rebuild-rollup')
+def rebuild_rollup_command():
+    """以 carbon_logs 重建區域彙總表 (flask --app app stats rebuild-rollup)"""
+    with db_connection() as conn:
+        if not conn:
+            print("❌ 資料庫連線失敗")
+            return
+        rows = rebuild_rollup(conn)
+        print(f"✅ 區域彙總表重建完成，共 {rows} 列")
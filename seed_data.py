@@ -0,0 +1,223 @@
+"""
+大量測試資料直接寫入 MySQL (不經過 HTTP API)
+
+generate_100_random.py 透過 API 註冊 / 登入 / 計算，每個使用者都要做一次密碼雜湊加上三次來回，
+每秒只能產生幾筆；這裡沿用同一組隨機產生函式，但直接寫進資料庫：
+- 所有測試帳號共用同一個預先算好的密碼雜湊 (密碼皆為 password123，可直接登入)
+- 計算結果走 services/calculator 的批次 (向量化) 版本，與 API 算出的結果完全相同
+- carbon_logs 以多列 INSERT (executemany) 或 LOAD DATA LOCAL INFILE (--method csv) 寫入
+- 多個 process 平行產生 / 寫入，--seed 與 --workers 相同時產生的資料相同
+- 完成後重建區域彙總表 (region_stats_rollup)
+
+用法 (在專案根目錄執行)：
+  python seed_data.py --logs 1000000 --users 50000 --workers 4
+  python seed_data.py --logs 1000000 --method csv      # 需要 MySQL 開啟 local_infile
+  python seed_data.py --cleanup                        # 刪除 seed_ 開頭的測試帳號 (紀錄會一併刪除)
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from db_manager import _connect
+from generate_100_random import generate_detailed_data, generate_random_user
+from services.calculator import calculate_detailed_batch, calculate_quick_batch
+from services.carbon_data import DEFAULT_COEFFS
+from services.log_store import ensure_versions, log_row, mark_versions_persisted, rebuild_rollup
+
+SEED_PREFIX = "seed_"
+SEED_PASSWORD = "password123"
+
+LOG_COLUMNS = ("user_id", "log_type", "input_data", "total_carbon", "breakdown",
+               "suggestions", "coeff_version", "created_at")
+
+INSERT_SEED_LOG_SQL = f"""
+    INSERT INTO carbon_logs ({", ".join(LOG_COLUMNS)})
+    VALUES ({", ".join(["%s"] * len(LOG_COLUMNS))})
+"""
+
+INSERT_USER_SQL = """
+    INSERT IGNORE INTO users (username, email, password_hash, full_name, gender, gender_other, city, district, birthdate, occupation)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# 欄位以逗號分隔、雙引號包住 (內含的雙引號重複兩次)，不使用跳脫字元，JSON 內的反斜線原樣寫入
+LOAD_DATA_SQL = f"""
+    LOAD DATA LOCAL INFILE %s INTO TABLE carbon_logs
+    CHARACTER SET utf8mb4
+    FIELDS TERMINATED BY ',' ENCLOSED BY '"' ESCAPED BY ''
+    LINES TERMINATED BY '\\n'
+    ({", ".join(LOG_COLUMNS)})
+"""
+
+QUICK_OPTIONS = {
+    "commute": sorted(DEFAULT_COEFFS["transport"]),
+    "diet": sorted(DEFAULT_COEFFS["diet"]),
+    "shopping": sorted(DEFAULT_COEFFS["consumption"]),
+}
+
+
+def seed_users(conn, n_users, chunk_size):
+    """以多列 INSERT 建立測試帳號，回傳 [(id, city, occupation), ...]"""
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    cursor = conn.cursor()
+    batch = []
+    for i in range(n_users):
+        u = generate_random_user(i)
+        batch.append((
+            f"{SEED_PREFIX}{i}", f"{SEED_PREFIX}{i}@seed.local", password_hash, u['fullName'],
+            u['gender'], None, u['city'], u['district'], u['birthdate'], u['occupation']
+        ))
+        if len(batch) >= chunk_size:
+            cursor.executemany(INSERT_USER_SQL, batch)
+            conn.commit()
+            batch.clear()
+    if batch:
+        cursor.executemany(INSERT_USER_SQL, batch)
+        conn.commit()
+
+    cursor.execute("SELECT id, city, occupation FROM users WHERE username LIKE %s ORDER BY id",
+                   (f"{SEED_PREFIX}%",))
+    profiles = cursor.fetchall()
+    cursor.close()
+    return profiles
+
+
+def build_rows(profiles, size, quick_ratio, days, now):
+    """產生一個 chunk 的 carbon_logs 資料列 (結果以批次計算)"""
+    detailed, quick = [], []
+    for _ in range(size):
+        user_id, city, occupation = random.choice(profiles)
+        created_at = (now - timedelta(seconds=random.randint(0, days * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+        if random.random() < quick_ratio:
+            quick.append((user_id, created_at, {k: random.choice(v) for k, v in QUICK_OPTIONS.items()}))
+        else:
+            detailed.append((user_id, created_at, generate_detailed_data({"city": city, "occupation": occupation})))
+
+    rows = []
+    for items, log_type, calculate in ((detailed, 'Detailed', calculate_detailed_batch),
+                                       (quick, 'Quick', calculate_quick_batch)):
+        if not items:
+            continue
+        results = calculate([data for _, _, data in items])
+        for (user_id, created_at, data), result in zip(items, results):
+            rows.append(log_row(user_id, log_type, data, result) + (created_at,))
+    return rows
+
+
+def _load_csv(cursor, rows):
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', newline='', delete=False) as f:
+        csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n').writerows(rows)
+        path = f.name
+    try:
+        cursor.execute(LOAD_DATA_SQL, (path,))
+    finally:
+        os.remove(path)
+
+
+def seed_worker(worker, n_logs, profiles, options):
+    """
+    單一 process 產生並寫入 n_logs 筆紀錄 (spawn 出來的子 process 各自建立連線)
+    回傳寫入筆數
+    """
+    random.seed(options['seed'] * 1000 + worker)
+    now = datetime.fromisoformat(options['now'])
+    conn = _connect(allow_local_infile=options['method'] == 'csv')
+    cursor = conn.cursor()
+    # 使用者 id 都來自剛查出的 users，這個連線內略過外鍵檢查以加快寫入
+    cursor.execute("SET foreign_key_checks = 0")
+    written = 0
+    try:
+        while written < n_logs:
+            rows = build_rows(profiles, min(options['chunk_size'], n_logs - written),
+                              options['quick_ratio'], options['days'], now)
+            # 紀錄引用的係數版本也要寫入 coeff_versions (每個 process 每個版本只寫一次)
+            versions = {row[6] for row in rows}
+            ensure_versions(cursor, versions)
+            if options['method'] == 'csv':
+                _load_csv(cursor, rows)
+            else:
+                # mysql-connector 會把 INSERT 的 executemany 改寫成單一多列 INSERT
+                cursor.executemany(INSERT_SEED_LOG_SQL, rows)
+            conn.commit()
+            mark_versions_persisted(versions)
+            written += len(rows)
+            print(f"  [worker {worker}] {written}/{n_logs}", end="\r")
+    finally:
+        cursor.close()
+        conn.close()
+    return written
+
+
+def cleanup(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM users WHERE username LIKE %s", (f"{SEED_PREFIX}%",))
+    deleted = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    rebuild_rollup(conn)
+    print(f"🧹 已刪除 {deleted} 個測試帳號與其紀錄")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed users and carbon logs directly into MySQL")
+    parser.add_argument("--logs", type=int, default=100000, help="要產生的紀錄筆數")
+    parser.add_argument("--users", type=int, default=None, help="測試帳號數 (預設為紀錄數的 1/20)")
+    parser.add_argument("--workers", type=int, default=1, help="平行寫入的 process 數")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="每次寫入的筆數")
+    parser.add_argument("--method", choices=("insert", "csv"), default="insert",
+                        help="insert = 多列 INSERT；csv = 產生 CSV 後 LOAD DATA LOCAL INFILE")
+    parser.add_argument("--quick-ratio", type=float, default=0.2, help="快速估算紀錄的比例")
+    parser.add_argument("--days", type=int, default=365, help="紀錄時間分布在最近幾天內")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cleanup", action="store_true", help=f"刪除 {SEED_PREFIX} 開頭的測試帳號")
+    args = parser.parse_args()
+
+    conn = _connect()
+    try:
+        if args.cleanup:
+            cleanup(conn)
+            return
+
+        random.seed(args.seed)
+        n_users = args.users or max(1, args.logs // 20)
+        start = time.perf_counter()
+        profiles = seed_users(conn, n_users, args.chunk_size)
+        print(f"👥 {len(profiles)} 個測試帳號 ({time.perf_counter() - start:.1f}s)")
+
+        options = {
+            "seed": args.seed, "method": args.method, "chunk_size": args.chunk_size,
+            "quick_ratio": args.quick_ratio, "days": args.days,
+            "now": datetime.now().replace(microsecond=0).isoformat(),
+        }
+        shares = [args.logs // args.workers + (1 if i < args.logs % args.workers else 0)
+                  for i in range(args.workers)]
+
+        start = time.perf_counter()
+        if args.workers <= 1:
+            written = seed_worker(0, args.logs, profiles, options)
+        else:
+            # spawn：子 process 不繼承父 process 的資料庫連線
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx) as pool:
+                futures = [pool.submit(seed_worker, i, n, profiles, options) for i, n in enumerate(shares) if n]
+                written = sum(f.result() for f in futures)
+        elapsed = time.perf_counter() - start
+        print(f"\n🌱 寫入 {written} 筆紀錄，{elapsed:.1f}s，{written / elapsed:.0f} rows/s")
+
+        start = time.perf_counter()
+        rows = rebuild_rollup(conn)
+        print(f"📊 區域彙總表重建完成 ({rows} 列，{time.perf_counter() - start:.1f}s)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
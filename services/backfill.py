@@ -0,0 +1,209 @@
+# services/backfill.py
+"""
+係數更新後重算歷史紀錄 (carbon_logs.total_carbon / breakdown)
+
+- 以 id 排序、用 unbuffered (server-side) cursor 串流讀取，每次只在記憶體保留一個 chunk
+- 每個 chunk 以向量化引擎重算，再以 executemany 批次寫回並 commit
+- 每次 commit 後寫入 checkpoint，中斷後重跑會從上次的 id 繼續
+- 可將 id 範圍切成多段，以多個 process 平行處理
+重算完成後請重建區域彙總表 (backfill 指令會自動執行)
+"""
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from db_manager import db_connection
+from services.calculator import calculate_detailed_batch, calculate_quick_batch
+from services.log_store import ensure_versions, mark_versions_persisted
+
+UPDATE_SQL = "UPDATE carbon_logs SET total_carbon = %s, breakdown = %s, coeff_version = %s WHERE id = %s"
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_checkpoint(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _parse_input(raw):
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode('utf-8')
+    return json.loads(raw) if isinstance(raw, str) else raw
+
+
+def recompute_chunk(rows):
+    """
+    重算一個 chunk：rows 為 [(id, log_type, input_data), ...]
+    回傳 (UPDATE 參數 list, 失敗筆數)
+    """
+    groups = {'Quick': [], 'Detailed': []}
+    failed = 0
+    for log_id, log_type, raw in rows:
+        try:
+            groups[log_type].append((log_id, _parse_input(raw)))
+        except Exception:
+            failed += 1
+
+    updates = []
+    for log_type, calculate in (('Quick', calculate_quick_batch), ('Detailed', calculate_detailed_batch)):
+        items = groups[log_type]
+        if not items:
+            continue
+        try:
+            results = calculate([data for _, data in items])
+        except Exception:
+            # 整批有資料格式錯誤時退回逐筆，找出壞掉的那幾筆
+            results = []
+            for _, data in items:
+                try:
+                    results.append(calculate([data])[0])
+                except Exception:
+                    results.append(None)
+        for (log_id, _), result in zip(items, results):
+            if result is None:
+                failed += 1
+                continue
+            updates.append((result['total'], json.dumps(result['breakdown']), result['coeff_version'], log_id))
+    return updates, failed
+
+
+def backfill_range(start_id, end_id, chunk_size=1000, checkpoint_dir='.', label=None, skip_version=None):
+    """
+    重算 start_id < id <= end_id 的紀錄
+    skip_version: 指定時略過已是此係數版本的紀錄 (只重算舊版本)
+    回傳統計 {"processed", "updated", "failed", "seconds"}
+    """
+    label = label or f"{start_id}-{end_id}"
+    checkpoint_path = os.path.join(checkpoint_dir, f"backfill_{start_id}_{end_id}.json")
+    checkpoint = _load_checkpoint(checkpoint_path) or {}
+    if checkpoint.get('done'):
+        print(f"⏭️ [{label}] 已完成，略過")
+        return {"processed": 0, "updated": 0, "failed": 0, "seconds": 0.0}
+
+    last_id = checkpoint.get('last_id', start_id)
+    processed = updated = failed = 0
+    started = time.perf_counter()
+
+    with db_connection() as read_conn, db_connection() as write_conn:
+        if not read_conn or not write_conn:
+            raise RuntimeError("資料庫連線失敗")
+
+        # unbuffered cursor：資料留在伺服器端，fetchmany 一次只拉一個 chunk
+        read_cursor = read_conn.cursor(buffered=False)
+        write_cursor = write_conn.cursor()
+        try:
+            sql = "SELECT id, log_type, input_data FROM carbon_logs WHERE id > %s AND id <= %s"
+            params = [last_id, end_id]
+            if skip_version:
+                sql += " AND (coeff_version IS NULL OR coeff_version <> %s)"
+                params.append(skip_version)
+            read_cursor.execute(sql + " ORDER BY id", tuple(params))
+            while True:
+                rows = read_cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+
+                updates, chunk_failed = recompute_chunk(rows)
+                versions = {u[2] for u in updates}
+                if updates:
+                    ensure_versions(write_cursor, versions)
+                    write_cursor.executemany(UPDATE_SQL, updates)
+                write_conn.commit()
+                mark_versions_persisted(versions)
+
+                last_id = rows[-1][0]
+                processed += len(rows)
+                updated += len(updates)
+                failed += chunk_failed
+                _save_checkpoint(checkpoint_path, {
+                    "start_id": start_id, "end_id": end_id, "last_id": last_id,
+                    "processed": checkpoint.get('processed', 0) + processed,
+                })
+
+                elapsed = time.perf_counter() - started
+                print(f"🔁 [{label}] id <= {last_id}: {processed} rows, {processed / elapsed:.0f} rows/s")
+        finally:
+            read_cursor.close()
+            write_cursor.close()
+
+    _save_checkpoint(checkpoint_path, {
+        "start_id": start_id, "end_id": end_id, "last_id": last_id,
+        "processed": checkpoint.get('processed', 0) + processed, "done": True,
+    })
+    return {"processed": processed, "updated": updated, "failed": failed,
+            "seconds": time.perf_counter() - started}
+
+
+def _id_bounds():
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("資料庫連線失敗")
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MIN(id), 1) - 1, COALESCE(MAX(id), 0) FROM carbon_logs")
+        low, high = cursor.fetchone()
+        cursor.close()
+    return int(low), int(high)
+
+
+def split_ranges(low, high, parts):
+    """將 (low, high] 切成 parts 段連續的 id 範圍"""
+    parts = max(1, min(parts, high - low)) if high > low else 1
+    step = (high - low + parts - 1) // parts if high > low else 0
+    ranges = []
+    start = low
+    while start < high:
+        end = min(start + step, high)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def run_backfill(workers=1, chunk_size=1000, checkpoint_dir='.', skip_version=None):
+    """
+    以 workers 個 process 平行重算全部紀錄
+    id 範圍在第一次執行時決定並寫入 checkpoint 目錄，中斷後重跑會沿用同一組範圍續跑；
+    全部完成後 checkpoint 會被刪除
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    plan_path = os.path.join(checkpoint_dir, "backfill_plan.json")
+    plan = _load_checkpoint(plan_path)
+    if plan is None:
+        low, high = _id_bounds()
+        plan = {"ranges": split_ranges(low, high, workers)}
+        _save_checkpoint(plan_path, plan)
+    ranges = [tuple(r) for r in plan['ranges']]
+
+    started = time.perf_counter()
+    if len(ranges) <= 1 or workers <= 1:
+        stats = [backfill_range(s, e, chunk_size, checkpoint_dir, skip_version=skip_version) for s, e in ranges]
+    else:
+        # spawn：子 process 不繼承父 process 的資料庫連線
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [
+                pool.submit(backfill_range, s, e, chunk_size, checkpoint_dir, skip_version=skip_version)
+                for s, e in ranges
+            ]
+            stats = [f.result() for f in futures]
+
+    # 全部範圍完成才清掉 checkpoint，下次執行會重新規劃
+    for s, e in ranges:
+        os.remove(os.path.join(checkpoint_dir, f"backfill_{s}_{e}.json"))
+    os.remove(plan_path)
+
+    elapsed = time.perf_counter() - started
+    total = {k: sum(s[k] for s in stats) for k in ("processed", "updated", "failed")}
+    total["seconds"] = elapsed
+    total["rows_per_second"] = total["processed"] / elapsed if elapsed else 0.0
+    return total
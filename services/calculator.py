@@ -1,5 +1,19 @@
 # services/calculator.py
-from .carbon_data import get_latest_coeffs
+import itertools
+import os
+import threading
+from .carbon_data import get_compiled_coeffs, register_refresh_listener
+from . import vector_calculator
+
+# 計算引擎：scalar (預設，逐筆計算) 或 vector (委派給 NumPy 向量化引擎，結果相同)
+CALC_ENGINE = os.getenv("CALC_ENGINE", "scalar")
+
+# 快速估算查表 (預設開啟，QUICK_TABLE=0 關閉)
+QUICK_TABLE_ENABLED = os.getenv("QUICK_TABLE", "1") == "1"
+
+# 快速估算的月消費金額 (依 shopping 選項)
+SHOPPING_SPEND = {"low": 10000, "medium": 20000, "high": 40000}
+DEFAULT_MONTHLY_SPEND = 20000
 
 def generate_smart_suggestion(total, breakdown, data, mode):
     """
@@ -74,25 +88,68 @@ def generate_smart_suggestion(total, breakdown, data, mode):
 
     return f"{prefix} {suggestion}"
 
+def _result_from_vector(result, i, data, mode):
+    """將向量化結果的第 i 筆組成與逐筆計算相同格式的回傳值"""
+    raw_total, total, breakdown = vector_calculator.unpack_row(result, i)
+    return {
+        "total": total,
+        "breakdown": breakdown,
+        "suggestion": generate_smart_suggestion(raw_total, breakdown, data, mode=mode),
+        "coeff_version": result['coeff_version']
+    }
+
+def calculate_quick_batch(records):
+    """多筆快速估算一次向量化計算，回傳與 calculate_quick_footprint 相同格式的 list"""
+    result = vector_calculator.calculate_quick_columns(
+        [d.get("commute") for d in records],
+        [d.get("diet") for d in records],
+        [d.get("shopping") for d in records],
+    )
+    return [_result_from_vector(result, i, data, 'Quick') for i, data in enumerate(records)]
+
+def calculate_detailed_batch(records):
+    """多筆詳細分析一次向量化計算，回傳與 calculate_detailed_footprint 相同格式的 list"""
+    columns, transport_types = vector_calculator.detailed_records_to_columns(records)
+    result = vector_calculator.calculate_detailed_columns(columns, transport_types)
+    return [_result_from_vector(result, i, data, 'Detailed') for i, data in enumerate(records)]
+
 def calculate_quick_footprint(data):
     """
     快速估算邏輯
+    輸入只有三個選項，先查預先算好的結果表；表中沒有的值 (未知選項) 才實際計算
     """
-    TAIWAN_COEFFS = get_latest_coeffs()
+    C = get_compiled_coeffs()
+
+    if QUICK_TABLE_ENABLED:
+        table = get_quick_table(C)
+        if table is not None:
+            try:
+                hit = table.results.get((data.get("commute"), data.get("diet"), data.get("shopping")))
+            except TypeError:   # 選項不是字串 (例如 list)，無法當 key
+                hit = None
+            table.count(hit is not None)
+            if hit is not None:
+                # 回傳副本，呼叫端修改結果不會影響表
+                return {**hit, "breakdown": dict(hit["breakdown"])}
 
+    if CALC_ENGINE == 'vector':
+        return calculate_quick_batch([data])[0]
+    return _calculate_quick_scalar(data, C)
+
+def _calculate_quick_scalar(data, C):
+    """快速估算的逐筆計算 (C 為 CompiledCoeffs)"""
     # 1. 交通計算
     AVG_COMMUTE_KM_YEAR = 20 * 250 
-    transport_coeff = TAIWAN_COEFFS["transport"].get(data.get("commute"), 0.046)
+    transport_coeff = C.transport.lookup.get(data.get("commute"), C.transport.default)
     transport_total = transport_coeff * AVG_COMMUTE_KM_YEAR
 
     # 2. 飲食計算
-    diet_coeff = TAIWAN_COEFFS["diet"].get(data.get("diet"), 3.8)
+    diet_coeff = C.diet.lookup.get(data.get("diet"), C.diet.default)
     diet_total = diet_coeff * 365
 
     # 3. 消費計算
-    shopping_map = {"low": 10000, "medium": 20000, "high": 40000}
-    monthly_spend = shopping_map.get(data.get("shopping"), 20000)
-    consumption_coeff = TAIWAN_COEFFS["consumption"].get(data.get("shopping"), 0.6)
+    monthly_spend = SHOPPING_SPEND.get(data.get("shopping"), DEFAULT_MONTHLY_SPEND)
+    consumption_coeff = C.consumption.lookup.get(data.get("shopping"), C.consumption.default)
     consumption_total = (monthly_spend * 12) * (consumption_coeff / 1000)
 
     # 4. 彙整
@@ -109,44 +166,141 @@ def calculate_quick_footprint(data):
     return {
         "total": round(total, 1),
         "breakdown": breakdown,
-        "suggestion": suggestion
+        "suggestion": suggestion,
+        "coeff_version": C.version
     }
 
+class QuickTable:
+    """
+    一個係數版本的快速估算結果表：{(commute, diet, shopping): 結果}
+    涵蓋所有已知選項的組合 (交通 x 飲食 x 消費，約數百種)，建議文字也一併算好
+    """
+
+    def __init__(self, C):
+        self.version = C.version
+        commutes = list(C.transport.lookup)
+        diets = list(C.diet.lookup)
+        shoppings = sorted(set(C.consumption.lookup) | set(SHOPPING_SPEND))
+        self.results = {
+            combo: _calculate_quick_scalar(dict(zip(("commute", "diet", "shopping"), combo)), C)
+            for combo in itertools.product(commutes, diets, shoppings)
+        }
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, hit):
+        # 只是統計用，不加鎖 (偶爾少算一次不影響)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def verify(self):
+        """
+        以向量化引擎重算所有組合並與表比對 (兩條獨立的計算路徑)
+        回傳不一致的組合 list，空 list 代表一致
+        """
+        combos = list(self.results)
+        records = [dict(zip(("commute", "diet", "shopping"), combo)) for combo in combos]
+        live = calculate_quick_batch(records)
+        return [
+            combo for combo, result in zip(combos, live)
+            if {k: result[k] for k in ("total", "breakdown", "suggestion")}
+            != {k: self.results[combo][k] for k in ("total", "breakdown", "suggestion")}
+        ]
+
+    def stats(self):
+        return {"version": self.version, "size": len(self.results), "hits": self.hits, "misses": self.misses}
+
+# 目前的結果表 (只保留最新的係數版本)：(係數版本, QuickTable 或 None)
+# 表為 None 代表該版本建立失敗或比對不一致，同一版本不再重建 (維持即時計算)；整個為 None 代表尚未建立
+_quick_table = None
+_quick_table_lock = threading.Lock()
+
+def build_quick_table(C):
+    """
+    建立並替換 C 版本的結果表
+    建立失敗或與向量化引擎比對不一致時不採用，記下該版本改用即時計算，回傳 None
+    """
+    global _quick_table
+    try:
+        table = QuickTable(C)
+        mismatched = table.verify()
+    except Exception as e:
+        print(f"⚠️ 快速估算結果表建立失敗 (版本 {C.version}): {e}，改用即時計算")
+        _quick_table = (C.version, None)
+        return None
+    if mismatched:
+        print(f"⚠️ 快速估算結果表與即時計算不一致 ({len(mismatched)} 組，例如 {mismatched[0]})，改用即時計算")
+        _quick_table = (C.version, None)
+        return None
+    _quick_table = (C.version, table)
+    print(f"📋 快速估算結果表已建立 (版本 {C.version}，{len(table.results)} 組)")
+    return table
+
+def get_quick_table(C):
+    """取得 C 版本的結果表，版本不同 (係數剛更新) 時重建；該版本無法使用查表時回傳 None"""
+    current = _quick_table
+    if current is not None and current[0] == C.version:
+        return current[1]
+    with _quick_table_lock:
+        current = _quick_table
+        if current is not None and current[0] == C.version:
+            return current[1]
+        return build_quick_table(C)
+
+def get_quick_table_stats():
+    current = _quick_table
+    return current[1].stats() if current and current[1] else None
+
+@register_refresh_listener
+def _rebuild_quick_table(compiled):
+    """
+    係數更新後在背景執行緒先建好新表，請求不必等待
+    每次 refresh 都會通知 (包含內容未變的 304)；同一版本已建好或已確定不採用時不重建
+    """
+    if not QUICK_TABLE_ENABLED:
+        return
+    with _quick_table_lock:
+        current = _quick_table
+        if current is not None and current[0] == compiled.version:
+            return
+        build_quick_table(compiled)
+
 def calculate_detailed_footprint(data):
     """
     詳細分析邏輯
     """
-    TAIWAN_COEFFS = get_latest_coeffs()
+    if CALC_ENGINE == 'vector':
+        return calculate_detailed_batch([data])[0]
+
+    C = get_compiled_coeffs()
     
     # 1. 能源 (Module A)
-    elec_coeff = TAIWAN_COEFFS['energy'].get('electricity', 0.495)
-    water_coeff = TAIWAN_COEFFS['energy'].get('water', 0.15)
-    gas_coeff = TAIWAN_COEFFS['energy'].get('gas', 2.1)
-    
-    elec_total = float(data['energy']['electricity']) * 12 * elec_coeff
-    water_total = float(data['energy']['water']) * 12 * water_coeff
-    gas_total = float(data['energy']['gas']) * 12 * gas_coeff
+    elec_total = float(data['energy']['electricity']) * 12 * C.elec
+    water_total = float(data['energy']['water']) * 12 * C.water
+    gas_total = float(data['energy']['gas']) * 12 * C.gas
     energy_sum = elec_total + water_total + gas_total
 
     # 2. 交通 (Module B)
     trans_type = data['transport']['type']
-    trans_coeff = TAIWAN_COEFFS["transport"].get(trans_type, 0.046)
+    trans_coeff = C.transport.lookup.get(trans_type, C.transport.default)
     trans_sum = float(data['transport']['km']) * 12 * trans_coeff
 
     # 3. 飲食 (Module C)
-    meat_sum = float(data['diet']['meat']) * 52 * 1.5
-    veg_sum = float(data['diet']['veg']) * 52 * 0.3
-    grain_sum = float(data['diet']['grain']) * 52 * 0.5
+    meat_sum = float(data['diet']['meat']) * 52 * C.meat
+    veg_sum = float(data['diet']['veg']) * 52 * C.veg
+    grain_sum = float(data['diet']['grain']) * 52 * C.grain
     diet_sum = meat_sum + veg_sum + grain_sum
 
     # 4. 消費 (Module D)
-    clothes_sum = (float(data['consumption']['clothes']) * 12 / 1000) * 0.5
-    elec_goods_sum = (float(data['consumption']['electronics']) * 12 / 1000) * 1.0
+    clothes_sum = (float(data['consumption']['clothes']) * 12 / 1000) * C.clothes
+    elec_goods_sum = (float(data['consumption']['electronics']) * 12 / 1000) * C.electronics
     cons_sum = clothes_sum + elec_goods_sum
 
     # 5. 廢棄物 (Module E)
-    trash_sum = float(data['waste']['bags']) * 52 * 0.8
-    recycle_sum = float(data['waste']['recycle']) * 52 * (-0.5)
+    trash_sum = float(data['waste']['bags']) * 52 * C.trash
+    recycle_sum = float(data['waste']['recycle']) * 52 * C.recycle
     waste_sum = trash_sum + recycle_sum
 
     # 彙整
@@ -165,5 +319,6 @@ def calculate_detailed_footprint(data):
     return {
         "total": round(total, 1),
         "breakdown": breakdown,
-        "suggestion": suggestion
+        "suggestion": suggestion,
+        "coeff_version": C.version
     }
\ No newline at end of file
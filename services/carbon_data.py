@@ -1,21 +1,39 @@
 # services/carbon_data.py
 import requests
+import copy
 import csv
 import io
+import json
+import os
+import threading
 import time
+from types import MappingProxyType
+from dotenv import load_dotenv
+
+from .coeff_versions import CompiledCoeffs
+from .metrics import COEFFS_REFRESH, phase
+
+load_dotenv()
 
 # ==========================================
 # 設定區
 # ==========================================
 # 請將此網址換成你放在網路上的 JSON Raw URL
 # 範例：GitHub Gist 的 Raw 連結
-DATA_SOURCE_URL = "https://gist.githubusercontent.com/rasafugi/341375417c0ac852a67959f388b53b14/raw/carbon_data.json"
+# 兩個網址都可以用環境變數覆寫 (例如測試時指向本機的 HTTP stub)
+DATA_SOURCE_URL = os.getenv("DATA_SOURCE_URL", "https://gist.githubusercontent.com/rasafugi/341375417c0ac852a67959f388b53b14/raw/carbon_data.json")
 
-ENERGY_CSV_URL = "https://service.taipower.com.tw/data/opendata/apply/file/d061001/001.csv"
+ENERGY_CSV_URL = os.getenv("ENERGY_CSV_URL", "https://service.taipower.com.tw/data/opendata/apply/file/d061001/001.csv")
 
 # 更新頻率 (秒) - 這裡設定為 1 小時 (3600秒) 更新一次
 UPDATE_INTERVAL = 3600 
 
+# 本機快照檔：保存最後一次成功取得的係數與 ETag/Last-Modified，重啟時直接載入
+SNAPSHOT_PATH = os.getenv(
+    "COEFFS_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database", "coeffs_snapshot.json")
+)
+
 # ==========================================
 # 預設備用資料 (Fallback Data)
 # 當網路斷線或 API 掛掉時，使用這份資料以免程式崩潰
@@ -49,101 +67,301 @@ DEFAULT_COEFFS = {
         "electricity": 0.495,
         "water": 0.150,       # ✨ 新增：自來水係數 (台水 2024)
         "gas": 2.63
+    },
+    # 詳細分析使用的固定係數 (原本直接寫在 calculator.py 裡)
+    "meal": {                 # 每餐
+        "meat": 1.5,
+        "veg": 0.3,
+        "grain": 0.5
+    },
+    "goods": {                # 每千元消費
+        "clothes": 0.5,
+        "electronics": 1.0
+    },
+    "waste": {                # 每袋垃圾 / 每次回收
+        "trash": 0.8,
+        "recycle": -0.5
     }
 }
 
 # ==========================================
 # 快取機制 (In-Memory Cache)
 # ==========================================
+# _cache 永遠指向一份已編譯的係數版本 (CompiledCoeffs，內含唯讀快照與版本 id)，
+# 背景更新完成後直接整份替換參考，讀取端不需要加鎖
 _cache = None           # 儲存下載下來的資料
 _last_update_time = 0   # 上次更新的時間戳記
+_refresh_lock = threading.Lock()
+_refreshing = False     # single-flight：同一時間只允許一個背景更新
+
+# 由遠端更新的欄位 (其餘係數以程式內的 DEFAULT_COEFFS 為準)
+_remote = {}            # 例如 {"electricity": 0.474, "water": 0.152}
+_validators = {}        # 例如 {"energy": {"etag": ..., "last_modified": ...}, "gist": {...}}
+
+# fetch 回傳此值代表伺服器回 304，內容未變更
+NOT_MODIFIED = object()
+
+
+def _freeze(data):
+    """將巢狀 dict 轉成唯讀快照，避免呼叫端誤改到共用的係數"""
+    return MappingProxyType({
+        k: _freeze(v) if isinstance(v, dict) else v
+        for k, v in data.items()
+    })
+
+
+def _compose(remote):
+    """以預設值為底，套上遠端取得的能源係數"""
+    data = copy.deepcopy(DEFAULT_COEFFS)
+    data['energy'].update(remote)
+    return data
+
+
+# 尚未完成第一次更新前，直接回傳預設值的快照
+_DEFAULT_COMPILED = CompiledCoeffs(_freeze(DEFAULT_COEFFS))
+
+def _conditional_get(url, validators, timeout):
+    """帶上 If-None-Match / If-Modified-Since 的 GET"""
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return requests.get(url, headers=headers, timeout=timeout)
+
+def _response_validators(response):
+    return {
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified'),
+    }
 
-def fetch_energy_coefficient():
+def parse_energy_csv(text):
+    """
+    解析台電 CSV，找出最新年份的電力係數
+    回傳: (民國年, 係數)
+    """
+    # 使用 csv 模組解析文字內容
+    csv_data = csv.reader(io.StringIO(text))
+
+    # 跳過標題列 (通常第一行是欄位名稱)
+    header = next(csv_data, None)
+
+    # 尋找最新年份的數據
+    latest_year = 0
+    latest_coeff = 0.495 # 預設值
+
+    for row in csv_data:
+        # 假設 CSV 格式為：[年度, 國家電力排放係數, 台電公司排放係數]
+        # 例如: ['111', '0.495', '0.495']
+        if len(row) >= 2:
+            try:
+                year = int(row[0]) # 民國年
+                coeff = float(row[1])
+
+                # 如果這一行的年份比較新，就更新
+                if year > latest_year:
+                    latest_year = year
+                    latest_coeff = coeff
+            except ValueError:
+                continue # 跳過無法轉換的行 (例如備註)
+
+    return latest_year, latest_coeff
+
+def fetch_energy_coefficient(validators=None):
     """
     從台電 Open Data 抓取最新的電力排碳係數
-    回傳: float (例如 0.495)
+    validators: 上次回應的 {"etag", "last_modified"}，有的話送出條件式請求
+    回傳: (係數, 新的 validators)
+      - 係數為 float (例如 0.495)
+      - 伺服器回 304 時為 NOT_MODIFIED (不重新解析 CSV)
+      - 失敗時為 None
     """
+    validators = validators or {}
     try:
         print(f"⚡ 正在下載能源數據: {ENERGY_CSV_URL} ...")
-        response = requests.get(ENERGY_CSV_URL, timeout=10)
+        response = _conditional_get(ENERGY_CSV_URL, validators, timeout=10)
+        if response.status_code == 304:
+            print("✅ 能源數據未變更 (304)")
+            return NOT_MODIFIED, validators
         response.raise_for_status()
-        
+
         # 處理編碼 (台灣政府資料常見 big5 或 utf-8-sig)
         response.encoding = 'utf-8-sig' 
-        
-        # 使用 csv 模組解析文字內容
-        csv_data = csv.reader(io.StringIO(response.text))
-        
-        # 跳過標題列 (通常第一行是欄位名稱)
-        header = next(csv_data, None)
-        
-        # 尋找最新年份的數據
-        latest_year = 0
-        latest_coeff = 0.495 # 預設值
-        
-        for row in csv_data:
-            # 假設 CSV 格式為：[年度, 國家電力排放係數, 台電公司排放係數]
-            # 例如: ['111', '0.495', '0.495']
-            if len(row) >= 2:
-                try:
-                    year = int(row[0]) # 民國年
-                    coeff = float(row[1])
-                    
-                    # 如果這一行的年份比較新，就更新
-                    if year > latest_year:
-                        latest_year = year
-                        latest_coeff = coeff
-                except ValueError:
-                    continue # 跳過無法轉換的行 (例如備註)
-                    
+
+        latest_year, latest_coeff = parse_energy_csv(response.text)
+
         print(f"✅ 成功取得 {latest_year} 年電力係數: {latest_coeff}")
-        return latest_coeff
+        return latest_coeff, _response_validators(response)
 
     except Exception as e:
         print(f"⚠️ 能源數據更新失敗: {e}")
-        return None # 回傳 None 代表失敗，讓主程式決定用備用值
+        return None, validators # 回傳 None 代表失敗，讓主程式決定用備用值
 
-def get_latest_coeffs():
+def fetch_remote_params(validators=None):
     """
-    智慧取得係數函式：
-    1. 檢查快取是否存在且未過期 -> 回傳快取 (速度快)
-    2. 若過期 -> 上網下載 -> 更新快取 -> 回傳 (資料新)
-    3. 若下載失敗 -> 回傳預設值 (系統穩)
+    從 Gist 抓取水與瓦斯係數
+    你的 Gist JSON 應該包含 {"energy": {"water": 0.152, "gas": 2.1}}
+    回傳: (dict / NOT_MODIFIED / None, 新的 validators)
     """
-    global _cache, _last_update_time
-    current_time = time.time()
-    
-    if _cache is None or (current_time - _last_update_time > UPDATE_INTERVAL):
-        print("🔄 開始更新碳排係數...")
-        new_data = DEFAULT_COEFFS.copy()
-        
-        # 1. 更新電力 (Live Data)
-        elec_val = fetch_energy_coefficient()
-        if elec_val:
-            new_data['energy']['electricity'] = elec_val
-            
-        # 2. 更新水與瓦斯 (如果有 Gist API 則從那邊抓，否則維持預設)
-        # 實作概念：你的 Gist JSON 應該包含 {"energy": {"water": 0.152, "gas": 2.1}}
+    validators = validators or {}
+    try:
+        resp = _conditional_get(DATA_SOURCE_URL, validators, timeout=3)
+        if resp.status_code == 304:
+            return NOT_MODIFIED, validators
+        if resp.status_code != 200:
+            return None, validators
+
+        remote_data = resp.json()
+        # 智慧合併：只更新有的欄位
+        params = {}
+        if 'energy' in remote_data:
+            if 'water' in remote_data['energy']:
+                params['water'] = remote_data['energy']['water']
+            if 'gas' in remote_data['energy']:
+                params['gas'] = remote_data['energy']['gas']
+        return params, _response_validators(resp)
+    except Exception as e:
+        print(f"⚠️ 雲端參數更新失敗: {e}")
+        return None, validators
+
+def _build_remote(prev_remote, prev_validators):
+    """
+    下載最新的遠端係數 (會連網，只在背景執行緒呼叫)
+    304 或下載失敗時沿用上一份成功的數值
+    回傳: (remote, validators)
+    """
+    remote = dict(prev_remote)
+    validators = dict(prev_validators)
+
+    # 1. 更新電力 (Live Data)
+    elec_val, validators['energy'] = fetch_energy_coefficient(prev_validators.get('energy'))
+    if elec_val is not NOT_MODIFIED and elec_val:
+        remote['electricity'] = elec_val
+
+    # 2. 更新水與瓦斯 (如果有 Gist API 則從那邊抓，否則維持預設)
+    params, validators['gist'] = fetch_remote_params(prev_validators.get('gist'))
+    if params is not NOT_MODIFIED and params:
+        remote.update(params)
+
+    return remote, validators
+
+def _load_snapshot():
+    """程式啟動時載入本機快照，冷啟動不需要任何網路請求"""
+    global _cache, _last_update_time, _remote, _validators
+    try:
+        with open(SNAPSHOT_PATH, encoding='utf-8') as f:
+            saved = json.load(f)
+        _remote = dict(saved.get('remote', {}))
+        _validators = dict(saved.get('validators', {}))
+        _cache = CompiledCoeffs(_freeze(_compose(_remote)))
+        _last_update_time = float(saved.get('saved_at', 0))
+        print(f"📦 已載入係數快照: {SNAPSHOT_PATH}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"⚠️ 係數快照載入失敗: {e}")
+
+def _save_snapshot(remote, validators, saved_at):
+    """先寫暫存檔再 rename，避免寫到一半的檔案被讀到"""
+    tmp_path = f"{SNAPSHOT_PATH}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"saved_at": saved_at, "remote": remote, "validators": validators}, f)
+        os.replace(tmp_path, SNAPSHOT_PATH)
+    except Exception as e:
+        print(f"⚠️ 係數快照寫入失敗: {e}")
+
+# 係數版本更新後要通知的 callback，簽名為 fn(compiled)，在背景更新執行緒內執行
+_refresh_listeners = []
+
+def register_refresh_listener(fn):
+    """註冊係數更新後的 callback (例如重建預先計算的結果表)"""
+    _refresh_listeners.append(fn)
+    return fn
+
+def _notify_refreshed(compiled):
+    for fn in _refresh_listeners:
         try:
-            # 只有當你有真的 Gist URL 時才打開這段
-            resp = requests.get(DATA_SOURCE_URL, timeout=3)
-            if resp.status_code == 200:
-                 remote_data = resp.json()
-                 # 智慧合併：只更新有的欄位
-                 if 'energy' in remote_data:
-                     if 'water' in remote_data['energy']:
-                         new_data['energy']['water'] = remote_data['energy']['water']
-                     if 'gas' in remote_data['energy']:
-                         new_data['energy']['gas'] = remote_data['energy']['gas']
-            pass # 暫時跳過
+            fn(compiled)
         except Exception as e:
-            print(f"⚠️ 雲端參數更新失敗: {e}")
+            print(f"⚠️ Coeffs listener error ({fn.__name__}): {e}")
+
+def _refresh_worker():
+    """背景更新執行緒：下載完成後一次性替換快照，並寫回本機快照檔"""
+    global _cache, _last_update_time, _remote, _validators, _refreshing
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        print("🔄 開始更新碳排係數...")
+        remote, validators = _build_remote(_remote, _validators)
+        compiled = CompiledCoeffs(_freeze(_compose(remote)))
+        now = time.time()
+        _remote, _validators = remote, validators
+        _cache = compiled   # 原子性的參考替換
+        _last_update_time = now
+        _save_snapshot(remote, validators, now)
+        print(f"✅ 係數更新完成 (版本 {compiled.version})")
+        _notify_refreshed(compiled)
+        outcome = "ok"
+    except Exception as e:
+        print(f"⚠️ 係數更新失敗: {e}")
+    finally:
+        COEFFS_REFRESH.observe(time.perf_counter() - started, outcome)
+        with _refresh_lock:
+            _refreshing = False
+
+def trigger_refresh():
+    """
+    啟動背景更新 (single-flight)
+    已經有更新在跑時直接略過，回傳 False
+    """
+    global _refreshing
+    with _refresh_lock:
+        if _refreshing:
+            return False
+        _refreshing = True
+    threading.Thread(target=_refresh_worker, name="coeffs-refresher", daemon=True).start()
+    return True
+
+def refresh_now():
+    """
+    同步更新係數並回傳新快照 (會連網，僅供離線工作使用，例如 backfill)
+    若已有背景更新在跑，會等它結束後再執行
+    """
+    global _refreshing
+    while True:
+        with _refresh_lock:
+            if not _refreshing:
+                _refreshing = True
+                break
+        time.sleep(0.1)
+    _refresh_worker()
+    return get_latest_coeffs()
+
+def get_compiled_coeffs():
+    """
+    取得目前的已編譯係數版本 (stale-while-revalidate)：
+    1. 永遠立即回傳目前的版本，請求本身不會等待任何下載
+    2. 若快取不存在或已過期 -> 觸發單一背景更新，下一個請求就會拿到新資料
+    3. 第一次更新完成前 -> 回傳預設值的版本 (系統穩)
+    """
+    compiled = _cache
+    if compiled is None or (time.time() - _last_update_time > UPDATE_INTERVAL):
+        # 只有需要觸發更新時才計時 (快取命中只是一次參考讀取，不值得計時)
+        with phase('coeffs'):
+            trigger_refresh()
+
+    return compiled if compiled is not None else _DEFAULT_COMPILED
+
+def get_latest_coeffs():
+    """
+    智慧取得係數函式：回傳目前版本的唯讀係數快照 (巢狀 dict 結構)
+    更新策略同 get_compiled_coeffs()，回傳的快照請勿修改
+    """
+    return get_compiled_coeffs().coeffs
 
-        _cache = new_data
-        _last_update_time = current_time
-        print("✅ 係數更新完成")
-    
-    return _cache
+# 啟動時先載入本機快照 (沒有快照就等第一次背景更新)
+_load_snapshot()
 
 # 建議資料庫維持靜態即可，通常不需頻繁更新，若要更新邏輯同上
 SUGGESTIONS_DB = {
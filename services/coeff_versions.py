@@ -0,0 +1,98 @@
+# services/coeff_versions.py
+"""
+係數版本與預先編譯的查表結構
+
+每一份係數快照依內容算出版本 id (內容相同 -> id 相同)，並只編譯一次成扁平的查表結構：
+- 類別係數 (交通 / 飲食 / 消費) -> 扁平 dict + 類別索引 + 係數向量 (供向量化引擎使用)
+- 詳細分析的固定係數 -> 直接存成屬性，計算時不必再走多層 .get()
+每筆 carbon_logs 會記錄產生它的版本 id (coeff_version)
+"""
+import hashlib
+import json
+
+import numpy as np
+
+# 找不到類別時的預設係數 (與原本 .get() 的預設值相同)
+DEFAULT_TRANSPORT = 0.046
+DEFAULT_DIET = 3.8
+DEFAULT_CONSUMPTION = 0.6
+
+# 本程序內編譯過的所有版本 {版本 id: CompiledCoeffs}
+# 係數只有在內容改變時才會產生新版本，數量很少
+_registry = {}
+
+
+def _thaw(data):
+    """唯讀快照 -> 一般 dict (計算版本 id 與存入資料庫用)"""
+    return {k: _thaw(v) if hasattr(v, 'items') else v for k, v in data.items()}
+
+
+def version_id(coeffs):
+    """依係數內容產生版本 id (12 碼 sha256)"""
+    canonical = json.dumps(_thaw(coeffs), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:12]
+
+
+class Categorical:
+    """
+    類別係數的查表結構
+    lookup: {類別: 係數}；index: {類別: 位置}；vector: 係數向量，最後一格為未知類別的預設值
+    """
+    __slots__ = ('lookup', 'index', 'vector', 'default')
+
+    def __init__(self, table, default):
+        names = sorted(table)
+        self.lookup = {name: table[name] for name in names}
+        self.index = {name: i for i, name in enumerate(names)}
+        self.vector = np.array([table[name] for name in names] + [default], dtype=np.float64)
+        self.default = default
+
+    def indices(self, values):
+        """類別陣列 -> 索引陣列 (未知類別指向最後一格的預設值)"""
+        unknown = len(self.vector) - 1
+        return np.fromiter((self.index.get(v, unknown) for v in values), dtype=np.intp, count=len(values))
+
+
+class CompiledCoeffs:
+    """一個版本的係數，編譯後不可再修改"""
+    __slots__ = (
+        'version', 'coeffs',
+        'transport', 'diet', 'consumption',
+        'elec', 'water', 'gas',
+        'meat', 'veg', 'grain',
+        'clothes', 'electronics',
+        'trash', 'recycle',
+    )
+
+    def __init__(self, coeffs):
+        self.coeffs = coeffs
+        self.version = version_id(coeffs)
+
+        self.transport = Categorical(coeffs['transport'], DEFAULT_TRANSPORT)
+        self.diet = Categorical(coeffs['diet'], DEFAULT_DIET)
+        self.consumption = Categorical(coeffs['consumption'], DEFAULT_CONSUMPTION)
+
+        energy = coeffs['energy']
+        self.elec = energy.get('electricity', 0.495)
+        self.water = energy.get('water', 0.15)
+        self.gas = energy.get('gas', 2.1)
+
+        self.meat = coeffs['meal']['meat']
+        self.veg = coeffs['meal']['veg']
+        self.grain = coeffs['meal']['grain']
+
+        self.clothes = coeffs['goods']['clothes']
+        self.electronics = coeffs['goods']['electronics']
+
+        self.trash = coeffs['waste']['trash']
+        self.recycle = coeffs['waste']['recycle']
+
+        _registry.setdefault(self.version, self)
+
+    def to_json(self):
+        return json.dumps(_thaw(self.coeffs), sort_keys=True)
+
+
+def get_version(version):
+    """依版本 id 取得本程序內編譯過的係數版本，找不到時回傳 None"""
+    return _registry.get(version)
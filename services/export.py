@@ -0,0 +1,203 @@
+# services/export.py
+"""
+carbon_logs 的串流匯出 (NDJSON / CSV，可選 gzip)
+
+get_history 用 fetchall() + jsonify()，整份結果會在記憶體裡存兩次；匯出改成 generator：
+- 以 unbuffered (server-side) cursor 執行查詢，fetchmany 一次只拉 EXPORT_FETCH_SIZE 筆
+- 每列直接轉成一行文字，累積到 EXPORT_FLUSH_BYTES 就 yield 給 Flask 送出 (chunked transfer)
+- JSON 欄位 (input_data / breakdown) 在 NDJSON 中原樣嵌入，不做 parse 再 dump
+- gzip 以 zlib 串流壓縮，同樣逐塊輸出
+記憶體用量只與 fetch / flush 大小有關，與匯出筆數無關
+
+匯出可能持續數分鐘，因此使用獨立連線 (不佔用連線池)，同時進行的匯出數由 EXPORT_MAX_CONCURRENT 限制
+"""
+import csv
+import io
+import json
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from db_manager import _connect
+
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+EXPORT_FLUSH_BYTES = int(os.getenv("EXPORT_FLUSH_BYTES", str(64 * 1024)))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "4"))
+# 用戶端下載較慢時，MySQL 送出 unbuffered 結果最多可以等多久 (秒)
+EXPORT_NET_WRITE_TIMEOUT = int(os.getenv("EXPORT_NET_WRITE_TIMEOUT", "600"))
+
+# 存放 JSON 的欄位 (NDJSON 原樣嵌入)
+JSON_COLUMNS = frozenset(('input_data', 'breakdown'))
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+class ExportBusy(Exception):
+    """同時進行的匯出數已達上限，呼叫端應回 503"""
+
+
+def parse_date_range(start, end):
+    """
+    start / end 為 ISO 日期或時間字串 (例如 2025-01-01、2025-01-01T08:00:00)，皆可省略
+    只有日期的 end 視為包含當天，回傳 (start, end) 供 created_at >= start AND created_at < end 使用
+    格式錯誤時丟出 ValueError
+    """
+    start_dt = datetime.fromisoformat(start) if start else None
+    end_dt = None
+    if end:
+        end_dt = datetime.fromisoformat(end)
+        if len(end) == 10:
+            end_dt += timedelta(days=1)
+    return start_dt, end_dt
+
+
+def parse_export_args(args):
+    """
+    解析匯出 API 的 query string：format=ndjson|csv、start、end、gzip=1
+    回傳 (fmt, start, end, gzip)，參數錯誤時丟出 ValueError
+    """
+    fmt = args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的格式: {fmt}")
+    start, end = parse_date_range(args.get('start'), args.get('end'))
+    return fmt, start, end, args.get('gzip') in ('1', 'true')
+
+
+def build_query(columns, user_id=None, start=None, end=None):
+    """組出匯出用的 SELECT (有 user_id 時走 (user_id, created_at, id) 索引依時間排序，否則依 id 排序)"""
+    sql = f"SELECT {', '.join(columns)} FROM carbon_logs WHERE 1=1"
+    params = []
+    if user_id is not None:
+        sql += " AND user_id = %s"
+        params.append(user_id)
+    if start:
+        sql += " AND created_at >= %s"
+        params.append(start)
+    if end:
+        sql += " AND created_at < %s"
+        params.append(end)
+    sql += " ORDER BY created_at, id" if user_id is not None else " ORDER BY id"
+    return sql, tuple(params)
+
+
+def _text(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def _ndjson_line(columns, row):
+    parts = []
+    for name, value in zip(columns, row):
+        value = _text(value)
+        if name in JSON_COLUMNS and value is not None:
+            encoded = value   # 資料庫 JSON 型別，必定是合法 JSON
+        else:
+            encoded = json.dumps(value, ensure_ascii=False)
+        parts.append(f'"{name}":{encoded}')
+    return "{" + ",".join(parts) + "}\n"
+
+
+class _CsvLines:
+    """把 csv.writer 的輸出收集成字串"""
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+
+    def line(self, values):
+        self._writer.writerow(values)
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
+
+
+class Export:
+    """
+    匯出的輸出 iterable (交給 flask.Response)：逐塊產生 bytes
+    WSGI server 在回應結束 (含用戶端中斷) 時會呼叫 close()，釋放連線與匯出名額
+    """
+
+    def __init__(self, columns, sql, params, fmt="ndjson", gzip=False):
+        if not _slots.acquire(blocking=False):
+            raise ExportBusy()
+        self.columns = columns
+        self.fmt = fmt
+        self.gzip = gzip
+        self._conn = self._cursor = None
+        self._closed = False
+        try:
+            # 在回應開始前就連線並執行查詢，失敗時呼叫端還能回 500
+            self._conn = _connect()
+            self._cursor = self._conn.cursor(buffered=False)
+            self._cursor.execute("SET SESSION net_write_timeout = %s", (EXPORT_NET_WRITE_TIMEOUT,))
+            self._cursor.execute(sql, params)
+        except Exception:
+            self.close()
+            raise
+
+    def headers(self, filename):
+        """下載用的 response headers (filename 不含副檔名)"""
+        filename = f"{filename}.{self.fmt}" + (".gz" if self.gzip else "")
+        return {
+            "Content-Type": "application/gzip" if self.gzip else f"{FORMATS[self.fmt]}; charset=utf-8",
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            # 請反向代理不要緩衝，逐塊送給用戶端
+            "X-Accel-Buffering": "no",
+        }
+
+    def __iter__(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if self.gzip else None   # wbits=31：gzip 格式
+        chunks = []
+        size = 0
+        csv_lines = None
+        if self.fmt == "csv":
+            csv_lines = _CsvLines()
+            chunks.append(csv_lines.line(self.columns))
+
+        while True:
+            rows = self._cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                if csv_lines:
+                    line = csv_lines.line([_text(v) for v in row])
+                else:
+                    line = _ndjson_line(self.columns, row)
+                chunks.append(line)
+                size += len(line)
+            if size >= EXPORT_FLUSH_BYTES:
+                data = "".join(chunks).encode('utf-8')
+                chunks, size = [], 0
+                if compressor:
+                    # SYNC_FLUSH：每塊壓縮後立刻送出，用戶端可以邊下載邊解壓
+                    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                yield data
+
+        data = "".join(chunks).encode('utf-8')
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # 用戶端中斷時結果還沒讀完，cursor / 連線關閉可能報錯，直接斷線丟棄即可
+        for resource in (self._cursor, self._conn):
+            if resource is not None:
+                try:
+                    resource.close()
+                except Exception:
+                    pass
+        _slots.release()
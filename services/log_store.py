@@ -0,0 +1,360 @@
+# services/log_store.py
+"""
+carbon_logs 寫入與各彙總表的維護：
+區域彙總 (region_stats_rollup)、區域分佈 sketch (region_distribution)、
+月 / 週趨勢 (user_trend_rollup、region_trend_rollup)
+寫入紀錄與更新彙總使用同一個 cursor，確保兩者在同一個交易內完成
+commit 之後會通知已註冊的 listener (例如清除統計快取)
+"""
+import json
+
+from services.coeff_versions import get_version
+from services.sketch import bucket_of, bucket_sql
+
+# 碳排拆解的類別 (對應 breakdown JSON 的 key 與彙總表的 sum_* 欄位)
+BREAKDOWN_KEYS = ("energy", "transport", "diet", "consumption", "waste")
+
+INSERT_LOG_SQL = """
+    INSERT INTO carbon_logs (user_id, log_type, input_data, total_carbon, breakdown, suggestions, coeff_version)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+# 已確認存在於 coeff_versions 表的版本 id
+_persisted_versions = set()
+
+_SUM_COLUMNS = ", ".join(f"sum_{k}" for k in BREAKDOWN_KEYS)
+
+# 類別欄位為 NULL 代表「沒有這個類別」，累加時要保留 NULL 語意
+_NULLABLE_SUM_UPDATES = ",\n        ".join(
+    f"sum_{k} = IF(VALUES(sum_{k}) IS NULL, sum_{k}, COALESCE(sum_{k}, 0) + VALUES(sum_{k}))"
+    for k in BREAKDOWN_KEYS
+)
+
+UPSERT_ROLLUP_SQL = f"""
+    INSERT INTO region_stats_rollup (city, district, log_type, sample_count, sum_total, {_SUM_COLUMNS})
+    VALUES (%s, %s, %s, %s, %s, {", ".join(["%s"] * len(BREAKDOWN_KEYS))})
+    ON DUPLICATE KEY UPDATE
+        sample_count = sample_count + VALUES(sample_count),
+        sum_total = sum_total + VALUES(sum_total),
+        {_NULLABLE_SUM_UPDATES}
+"""
+
+# 分佈 sketch 的指標：total_carbon 加上各類別
+DISTRIBUTION_METRICS = ("total",) + BREAKDOWN_KEYS
+
+UPSERT_DISTRIBUTION_SQL = """
+    INSERT INTO region_distribution (city, district, metric, bucket, sample_count)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE sample_count = sample_count + VALUES(sample_count)
+"""
+
+# 趨勢彙總的期間與起始日運算式 (月：當月 1 日；週：當週星期一)
+TREND_PERIODS = ("month", "week")
+
+
+def trend_bucket_sql(expr, period):
+    """日期運算式 -> 所屬期間的起始日 (SQL)"""
+    if period == "week":
+        return f"(DATE({expr}) - INTERVAL WEEKDAY({expr}) DAY)"
+    return f"(DATE({expr}) - INTERVAL (DAYOFMONTH({expr}) - 1) DAY)"
+
+
+def _upsert_trend_sql(table, key_columns, period):
+    """
+    趨勢表的 upsert (每個期間一條)：參數為 key 欄位 + 次數、總碳排、各類別
+    寫入當下的期間以資料庫的 CURDATE() 計算，與 carbon_logs.created_at 的預設值使用同一個時鐘與時區
+    """
+    return f"""
+    INSERT INTO {table} ({", ".join(key_columns)}, period, bucket_start, sample_count, sum_total, {_SUM_COLUMNS})
+    VALUES ({", ".join(["%s"] * len(key_columns))}, '{period}', {trend_bucket_sql('CURDATE()', period)}, %s, %s, {", ".join(["%s"] * len(BREAKDOWN_KEYS))})
+    ON DUPLICATE KEY UPDATE
+        sample_count = sample_count + VALUES(sample_count),
+        sum_total = sum_total + VALUES(sum_total),
+        {_NULLABLE_SUM_UPDATES}
+"""
+
+
+# 期間 -> upsert SQL
+UPSERT_USER_TREND_SQL = {period: _upsert_trend_sql("user_trend_rollup", ("user_id",), period) for period in TREND_PERIODS}
+UPSERT_REGION_TREND_SQL = {period: _upsert_trend_sql("region_trend_rollup", ("city", "district"), period) for period in TREND_PERIODS}
+
+
+def get_user_regions(cursor, user_ids):
+    """一次查出多位使用者的 {user_id: (city, district)}"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    cursor.execute(f"SELECT id, city, district FROM users WHERE id IN ({placeholders})", tuple(user_ids))
+    regions = {}
+    for row in cursor.fetchall():
+        if isinstance(row, dict):
+            regions[row['id']] = (row['city'], row['district'])
+        else:
+            regions[row[0]] = (row[1], row[2])
+    return regions
+
+
+# commit 後要通知的 callback，簽名為 fn(entries)
+_commit_listeners = []
+
+
+def register_commit_listener(fn):
+    """註冊 commit 後的 callback，entries 為 make_entry() 產生的 dict list"""
+    _commit_listeners.append(fn)
+    return fn
+
+
+def notify_committed(entries):
+    """紀錄 commit 後呼叫；listener 出錯不影響主流程"""
+    if not entries:
+        return
+    for fn in _commit_listeners:
+        try:
+            fn(entries)
+        except Exception as e:
+            print(f"⚠️ Log listener error ({fn.__name__}): {e}")
+
+
+def make_entry(user_id, city, district, log_type, result):
+    """一筆紀錄的摘要，供彙總表與 listener 使用"""
+    return {
+        "user_id": user_id,
+        "city": city,
+        "district": district,
+        "log_type": log_type,
+        "total": result['total'],
+        "breakdown": result['breakdown'],
+    }
+
+
+def _add_sums(deltas, key, e):
+    """deltas[key] = [次數, 總碳排, 各類別...] 累加一筆紀錄 (沒有的類別維持 None)"""
+    delta = deltas.get(key)
+    if delta is None:
+        delta = deltas[key] = [0, 0.0] + [None] * len(BREAKDOWN_KEYS)
+    delta[0] += 1
+    delta[1] += e['total']
+    for i, k in enumerate(BREAKDOWN_KEYS):
+        if k in e['breakdown']:
+            delta[2 + i] = (delta[2 + i] or 0) + e['breakdown'][k]
+
+
+def _sum_rows(deltas):
+    """依 key 排序輸出 key + 累加值，讓並行的交易以相同順序上鎖，避免死結"""
+    return [key + tuple(delta) for key, delta in sorted(deltas.items())]
+
+
+def _rollup_rows(entries):
+    """
+    將紀錄摘要彙整成要 upsert 的資料列
+    每筆紀錄會累加到 行政區 / 縣市 / 全台 三個層級，同一個 key 先在 Python 端合併
+    """
+    deltas = {}
+    for e in entries:
+        city, district, log_type = e['city'], e['district'], e['log_type']
+        for key in ((city, district, log_type), (city, '', log_type), ('', '', log_type)):
+            _add_sums(deltas, key, e)
+    return _sum_rows(deltas)
+
+
+def _distribution_rows(entries):
+    """
+    將紀錄摘要彙整成分佈 sketch 要累加的 (city, district, metric, bucket, 次數)
+    與彙總表相同，累加到 行政區 / 縣市 / 全台 三個層級；紀錄中沒有的類別不計入
+    """
+    deltas = {}
+    for e in entries:
+        values = [("total", e['total'])] + [(k, e['breakdown'][k]) for k in BREAKDOWN_KEYS if k in e['breakdown']]
+        buckets = [(metric, bucket_of(value)) for metric, value in values]
+        for city, district in ((e['city'], e['district']), (e['city'], ''), ('', '')):
+            for metric, bucket in buckets:
+                key = (city, district, metric, bucket)
+                deltas[key] = deltas.get(key, 0) + 1
+    return [key + (count,) for key, count in sorted(deltas.items())]
+
+
+def _trend_rows(entries):
+    """
+    將紀錄摘要彙整成趨勢表要累加的資料列 (期間與起始日由各期間的 upsert SQL 決定，月 / 週共用同一組列)
+    回傳 (使用者的列, 區域的列)；區域累加到 行政區 / 縣市 / 全台 三個層級
+    """
+    user_deltas = {}
+    region_deltas = {}
+    for e in entries:
+        _add_sums(user_deltas, (e['user_id'],), e)
+        for key in ((e['city'], e['district']), (e['city'], ''), ('', '')):
+            _add_sums(region_deltas, key, e)
+    return _sum_rows(user_deltas), _sum_rows(region_deltas)
+
+
+def apply_to_rollup(cursor, entries):
+    """
+    把新紀錄累加到區域彙總表、分佈 sketch 與趨勢表
+    各表固定依 彙總 -> sketch -> 使用者趨勢 -> 區域趨勢 的順序更新，表內依 key 排序上鎖
+    """
+    rows = _rollup_rows(entries)
+    if rows:
+        cursor.executemany(UPSERT_ROLLUP_SQL, rows)
+    rows = _distribution_rows(entries)
+    if rows:
+        cursor.executemany(UPSERT_DISTRIBUTION_SQL, rows)
+    user_rows, region_rows = _trend_rows(entries)
+    if user_rows:
+        for period in TREND_PERIODS:
+            cursor.executemany(UPSERT_USER_TREND_SQL[period], user_rows)
+    if region_rows:
+        for period in TREND_PERIODS:
+            cursor.executemany(UPSERT_REGION_TREND_SQL[period], region_rows)
+
+
+def log_row(user_id, log_type, data, result):
+    """carbon_logs 一列的 INSERT 參數"""
+    return (
+        user_id,
+        log_type,
+        json.dumps(data),
+        result['total'],
+        json.dumps(result['breakdown']),
+        result['suggestion'],
+        result.get('coeff_version')
+    )
+
+
+def ensure_versions(cursor, versions):
+    """
+    確保紀錄引用的係數版本已寫入 coeff_versions 表 (不 commit)
+    每個版本在本程序內只會寫一次；回傳這次新寫入的版本 id
+    """
+    new_versions = {v for v in versions if v and v not in _persisted_versions}
+    for version in sorted(new_versions):
+        compiled = get_version(version)
+        if compiled:
+            cursor.execute(
+                "INSERT IGNORE INTO coeff_versions (id, coeffs) VALUES (%s, %s)",
+                (version, compiled.to_json())
+            )
+    return new_versions
+
+
+def mark_versions_persisted(versions):
+    """交易 commit 成功後呼叫，之後同一版本就不再重複寫入"""
+    _persisted_versions.update(versions)
+
+
+def insert_logs(cursor, records):
+    """
+    以單一 executemany 寫入多筆計算紀錄並同步更新區域彙總 (不 commit)
+    records: [(user_id, log_type, data, result), ...]
+    回傳紀錄摘要 list (使用者不存在的紀錄不會出現在摘要中)
+    """
+    if not records:
+        return []
+    cursor.executemany(INSERT_LOG_SQL, [log_row(*r) for r in records])
+    ensure_versions(cursor, {r[3].get('coeff_version') for r in records})
+
+    regions = get_user_regions(cursor, [r[0] for r in records])
+    entries = [
+        make_entry(user_id, *regions[user_id], log_type, result)
+        for user_id, log_type, data, result in records
+        if user_id in regions
+    ]
+    apply_to_rollup(cursor, entries)
+    return entries
+
+
+def insert_log(cursor, user_id, log_type, data, result):
+    """
+    寫入一筆計算紀錄並同步更新區域彙總 (不 commit)
+    回傳紀錄摘要 (使用者不存在時為 None)
+    """
+    entries = insert_logs(cursor, [(user_id, log_type, data, result)])
+    return entries[0] if entries else None
+
+
+def save_logs(conn, cursor, records):
+    """寫入多筆紀錄 + 更新彙總 + 單次 commit，成功後通知 listener"""
+    entries = insert_logs(cursor, records)
+    conn.commit()
+    mark_versions_persisted({r[3].get('coeff_version') for r in records})
+    notify_committed(entries)
+    return entries
+
+
+def save_log(conn, cursor, user_id, log_type, data, result):
+    """寫入紀錄 + 更新彙總 + commit，成功後通知 listener"""
+    entries = save_logs(conn, cursor, [(user_id, log_type, data, result)])
+    return entries[0] if entries else None
+
+
+def rebuild_rollup(conn):
+    """
+    以 carbon_logs 全量重建區域彙總表、分佈 sketch 與趨勢表 (在單一交易內 DELETE + INSERT ... SELECT)
+    類別加總與分箱直接使用 bd_* 生成欄位，不需在 SQL 端逐筆解析 JSON
+    回傳重建後的彙總表資料列數
+    """
+    sums = ", ".join(f"SUM(l.bd_{k})" for k in BREAKDOWN_KEYS)
+    # (city, district, 分組欄位)：各表再自行加上 log_type / 分箱 / 期間的運算式
+    levels = [
+        ("u.city", "u.district", ("u.city", "u.district")),
+        ("u.city", "''", ("u.city",)),
+        ("''", "''", ()),
+    ]
+
+    def group_by(columns, expr):
+        return ", ".join(columns + (expr,))
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM region_stats_rollup")
+        for city_expr, district_expr, columns in levels:
+            cursor.execute(f"""
+                INSERT INTO region_stats_rollup (city, district, log_type, sample_count, sum_total, {_SUM_COLUMNS})
+                SELECT {city_expr}, {district_expr}, l.log_type, COUNT(*), SUM(l.total_carbon), {sums}
+                FROM carbon_logs l
+                JOIN users u ON l.user_id = u.id
+                GROUP BY {group_by(columns, "l.log_type")}
+            """)
+
+        cursor.execute("DELETE FROM region_distribution")
+        for metric in DISTRIBUTION_METRICS:
+            column = "l.total_carbon" if metric == "total" else f"l.bd_{metric}"
+            bucket = bucket_sql(column)
+            for city_expr, district_expr, columns in levels:
+                cursor.execute(f"""
+                    INSERT INTO region_distribution (city, district, metric, bucket, sample_count)
+                    SELECT {city_expr}, {district_expr}, %s, {bucket}, COUNT(*)
+                    FROM carbon_logs l
+                    JOIN users u ON l.user_id = u.id
+                    WHERE {column} IS NOT NULL
+                    GROUP BY {group_by(columns, bucket)}
+                """, (metric,))
+
+        cursor.execute("DELETE FROM user_trend_rollup")
+        cursor.execute("DELETE FROM region_trend_rollup")
+        for period in TREND_PERIODS:
+            bucket = trend_bucket_sql("l.created_at", period)
+            cursor.execute(f"""
+                INSERT INTO user_trend_rollup (user_id, period, bucket_start, sample_count, sum_total, {_SUM_COLUMNS})
+                SELECT l.user_id, %s, {bucket}, COUNT(*), SUM(l.total_carbon), {sums}
+                FROM carbon_logs l
+                WHERE l.created_at IS NOT NULL
+                GROUP BY {group_by(("l.user_id",), bucket)}
+            """, (period,))
+            for city_expr, district_expr, columns in levels:
+                cursor.execute(f"""
+                    INSERT INTO region_trend_rollup (city, district, period, bucket_start, sample_count, sum_total, {_SUM_COLUMNS})
+                    SELECT {city_expr}, {district_expr}, %s, {bucket}, COUNT(*), SUM(l.total_carbon), {sums}
+                    FROM carbon_logs l
+                    JOIN users u ON l.user_id = u.id
+                    WHERE l.created_at IS NOT NULL
+                    GROUP BY {group_by(columns, bucket)}
+                """, (period,))
+        conn.commit()
+        cursor.execute("SELECT COUNT(*) FROM region_stats_rollup")
+        return cursor.fetchone()[0]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,196 @@
+# services/metrics.py
+"""
+程序內的效能指標 (Prometheus 文字格式輸出)
+
+- Counter / Histogram：以 label 區分，各自一把鎖，多執行緒下可安全累加
+- 請求階段計時：一個請求的時間拆成 db / coeffs / calc / other，
+  以 with phase('db'): ... 包住要計時的區塊；巢狀時只算「自己」的時間 (扣掉內層)，不會重複計算
+- register_collector(fn)：輸出時才呼叫 fn 取得即時數值 (例如連線池、快取統計)
+"""
+import bisect
+import threading
+import time
+
+# 請求延遲的 bucket 上限 (秒)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_PHASES = ("db", "coeffs", "calc", "other")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label_values -> [各 bucket 計數..., +Inf 計數, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+REQUEST_COUNT = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_PHASE = Histogram(
+    "http_request_phase_seconds", "Time spent per request in db / coeffs / calc / other", ("route", "phase"))
+COEFFS_REFRESH = Histogram(
+    "coeffs_refresh_duration_seconds", "Background coefficient refresh duration", ("result",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+_metrics = [REQUEST_LATENCY, REQUEST_COUNT, REQUEST_PHASE, COEFFS_REFRESH]
+
+# 輸出時才取值的 collector，fn() 回傳 [(name, type, help, [(labels dict, value), ...]), ...]
+_collectors = []
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+# --- 請求階段計時 ---
+
+_local = threading.local()
+
+
+def begin_request():
+    """請求開始時呼叫，之後同一執行緒內的 phase() 會累加到這個請求"""
+    _local.phases = {}
+    _local.stack = []
+
+
+def end_request():
+    """請求結束時呼叫，回傳 {階段: 秒數} 並清除狀態"""
+    phases = getattr(_local, 'phases', None)
+    _local.phases = None
+    _local.stack = None
+    return phases or {}
+
+
+class phase:
+    """
+    with phase('db'): ...
+    將區塊的執行時間記到目前請求的 name 階段 (不在請求中時幾乎沒有成本)
+    巢狀時外層只記自己的時間，例如 calc 內觸發係數更新的時間只算在 coeffs
+    (以 class 實作而非 @contextmanager，每次進出少建立一個 generator)
+    """
+    __slots__ = ('name', 'phases', 'start', 'inner')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.phases = getattr(_local, 'phases', None)
+        if self.phases is not None:
+            self.inner = 0.0    # 內層階段花掉的時間
+            _local.stack.append(self)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        phases = self.phases
+        if phases is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        phases[self.name] = phases.get(self.name, 0.0) + elapsed - self.inner
+        if stack:
+            stack[-1].inner += elapsed
+        return False
+
+
+def observe_request(method, route, status, seconds, phases):
+    """記錄一個請求：延遲、狀態碼，以及各階段時間 (沒有被計時到的部分算在 other)"""
+    REQUEST_LATENCY.observe(seconds, method, route)
+    REQUEST_COUNT.inc(method, route, str(status))
+    accounted = 0.0
+    for name in REQUEST_PHASES[:-1]:
+        value = phases.get(name, 0.0)
+        accounted += value
+        REQUEST_PHASE.observe(value, route, name)
+    REQUEST_PHASE.observe(max(0.0, seconds - accounted), route, "other")
+
+
+def render():
+    """所有指標的 Prometheus 文字格式"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for fn in _collectors:
+        try:
+            families = fn()
+        except Exception as e:
+            print(f"⚠️ Metrics collector error ({fn.__name__}): {e}")
+            continue
+        for name, metric_type, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = _format_labels(list(labels), list(labels.values())) if labels else ""
+                lines.append(f"{name}{label_text} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
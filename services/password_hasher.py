@@ -0,0 +1,160 @@
+# services/password_hasher.py
+"""
+密碼雜湊的 process pool
+
+generate_password_hash / check_password_hash 刻意設計成很吃 CPU，在請求執行緒裡直接跑會長時間佔住 GIL，
+一波登入就會拖慢所有 API；這裡改交給獨立的 process 執行：
+- PASSWORD_HASH_WORKERS 個 worker process (0 = 在請求執行緒內直接計算，即舊行為)
+- 同時排隊 + 執行中的工作最多 PASSWORD_HASH_MAX_PENDING 個，滿了立刻丟出 HasherBusy (API 回 503)
+- 雜湊強度由 PASSWORD_HASH_METHOD 設定 (werkzeug 格式，例如 scrypt:32768:8:1、pbkdf2:sha256:600000)
+- 登入驗證成功時，若資料庫中的雜湊不是目前設定的強度，會在同一個工作裡順便算出新雜湊供呼叫端更新
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 4 or 8)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+
+
+class HasherBusy(Exception):
+    """雜湊工作已達上限，呼叫端應回 503"""
+
+
+def _method_of(password_hash):
+    """'scrypt:32768:8:1$salt$hash' -> 'scrypt:32768:8:1'"""
+    return password_hash.split('$', 1)[0]
+
+
+def hash_with_method(password, method):
+    """以指定強度雜湊 (模組層級函式，可交給 process pool 執行)"""
+    return generate_password_hash(password, method)
+
+
+def _verify(password_hash, password, method, canonical_method):
+    """在 worker 內執行：驗證密碼，成功且強度不符時一併算出新雜湊"""
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if _method_of(password_hash) != canonical_method:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING,
+                 method=PASSWORD_HASH_METHOD, timeout=PASSWORD_HASH_TIMEOUT):
+        self.workers = workers
+        self.method = method
+        # werkzeug 會把簡寫 (例如 'scrypt') 展開成完整參數，以實際產生的雜湊為準
+        self.canonical_method = _method_of(generate_password_hash("", method))
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0, "upgraded": 0}
+        self._executor = None
+        if workers > 0:
+            # spawn：worker 不繼承 Flask 程序的執行緒與連線 (Windows 也只支援 spawn)
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise HasherBusy()
+        with self._lock:
+            self._pending += 1
+        if self._executor is None:
+            try:
+                result = fn(*args)
+            except Exception:
+                self._finish(False)
+                raise
+            self._finish(True)
+            return result
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._finish(False)
+            raise
+        # 名額在工作真正結束時才歸還：逾時的工作仍在 worker 裡執行，期間繼續佔用名額
+        future.add_done_callback(lambda f: self._finish(not f.cancelled() and f.exception() is None))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._stats["timed_out"] += 1
+            raise HasherBusy()
+
+    def _finish(self, ok):
+        with self._lock:
+            self._pending -= 1
+            self._stats["completed" if ok else "failed"] += 1
+        self._slots.release()
+
+    def hash(self, password):
+        return self._run(hash_with_method, password, self.method)
+
+    def verify(self, password_hash, password):
+        """回傳 (是否正確, 需要更新時的新雜湊或 None)"""
+        ok, upgraded = self._run(_verify, password_hash, password, self.method, self.canonical_method)
+        if upgraded:
+            with self._lock:
+                self._stats["upgraded"] += 1
+        return ok, upgraded
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["pending"] = self._pending
+        data["workers"] = self.workers
+        data["max_pending"] = self.max_pending
+        data["method"] = self.canonical_method
+        return data
+
+
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_hasher():
+    """取得全域的 hasher (第一次呼叫時才啟動 worker process)"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = PasswordHasher()
+    return _instance
+
+
+def configure(**options):
+    """以新設定重建全域 hasher (benchmark 切換模式用)"""
+    global _instance
+    with _instance_lock:
+        old, _instance = _instance, PasswordHasher(**options)
+    if old:
+        old.shutdown()
+    return _instance
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(password_hash, password):
+    return get_hasher().verify(password_hash, password)
+
+
+def get_stats():
+    return _instance.stats() if _instance else None
@@ -0,0 +1,211 @@
+# services/query_stats.py
+"""
+SQL 執行時間統計與慢查詢紀錄 (由 db_manager.TimedCursor 呼叫 record())
+
+- 依「正規化後的語句」彙總：常數、%s 參數、IN (...) 清單、多列 VALUES 都會被換成 ?，
+  同一種查詢不論參數為何都算在一起
+- 超過 SLOW_QUERY_MS 的語句記入慢查詢紀錄 (只保留最近 SLOW_QUERY_LOG_SIZE 筆)，
+  參數只記錄型別與長度，不記錄內容
+- 慢查詢會自動抽樣 EXPLAIN：同一種語句每 SLOW_QUERY_EXPLAIN_INTERVAL 秒最多一次，
+  由背景執行緒以獨立連線執行，不佔用請求時間與連線池
+- QUERY_STATS_DUMP_PATH 有設定時，程序結束前會把統計寫成 JSON (適合 backfill 等 CLI 工作)
+"""
+import atexit
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+QUERY_STATS_DUMP_PATH = os.getenv("QUERY_STATS_DUMP_PATH")
+
+# 最多追蹤的語句種類，超過的歸到 <other>，避免動態組出的 SQL 讓記憶體無限成長
+MAX_STATEMENTS = 1000
+
+# 可以 EXPLAIN 的語句 (INSERT ... VALUES 沒有執行計畫可看)
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE")
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%s|%\(\w+\)s")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_RE = re.compile(r"\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize(sql):
+    """SQL -> 彙總用的語句樣板 (同一個 SQL 字串只會正規化一次)"""
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8', 'replace')
+    text = _STRING_RE.sub("?", sql)
+    text = _PLACEHOLDER_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _SPACE_RE.sub(" ", text).strip()
+    text = _IN_LIST_RE.sub("IN (?+)", text)
+    text = _VALUES_RE.sub(r"VALUES \1+", text)
+    return text
+
+
+def redact(params):
+    """參數只保留型別 (字串與 bytes 再加上長度)，例如 ['int', 'str(12)']"""
+    if params is None:
+        return None
+    values = params.values() if isinstance(params, dict) else params
+    shapes = []
+    for value in values:
+        if isinstance(value, (str, bytes, bytearray)):
+            shapes.append(f"{type(value).__name__}({len(value)})")
+        else:
+            shapes.append(type(value).__name__)
+    return shapes
+
+
+def _jsonable(value):
+    return value if isinstance(value, (int, float, str, type(None))) else str(value)
+
+
+class QueryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = {}     # 樣板 -> {"count", "errors", "total", "max"}
+        self._slow = []           # 最近的慢查詢 (環狀，最多 SLOW_QUERY_LOG_SIZE 筆)
+        self._explains = {}       # 樣板 -> {"at", "plan"} 或 {"at", "error"}
+        self._explained_at = {}   # 樣板 -> 上次排入 EXPLAIN 的時間
+        self._explain_queue = queue.Queue(maxsize=32)
+        self._explain_thread = None
+        self.started_at = time.time()
+
+    def record(self, sql, params, seconds, error=False, many=False):
+        """記錄一次 execute / executemany"""
+        template = normalize(sql)
+        with self._lock:
+            key = template if template in self._statements or len(self._statements) < MAX_STATEMENTS else "<other>"
+            stat = self._statements.get(key)
+            if stat is None:
+                stat = self._statements[key] = {"count": 0, "errors": 0, "total": 0.0, "max": 0.0}
+            stat["count"] += 1
+            stat["total"] += seconds
+            if seconds > stat["max"]:
+                stat["max"] = seconds
+            if error:
+                stat["errors"] += 1
+
+        if seconds * 1000 < SLOW_QUERY_MS:
+            return
+
+        entry = {
+            "at": datetime.now().isoformat(timespec='seconds'),
+            "ms": round(seconds * 1000, 1),
+            "statement": template,
+            "params": f"executemany x{len(params) if hasattr(params, '__len__') else '?'}" if many else redact(params),
+        }
+        with self._lock:
+            self._slow.append(entry)
+            del self._slow[:-SLOW_QUERY_LOG_SIZE]
+        print(f"🐢 Slow query ({entry['ms']} ms): {template[:200]}")
+
+        if not many and not error and template.upper().startswith(_EXPLAINABLE):
+            self._maybe_explain(template, sql, params)
+
+    # --- EXPLAIN 抽樣 ---
+
+    def _maybe_explain(self, template, sql, params):
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained_at.get(template)
+            if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return
+            self._explained_at[template] = now
+            if self._explain_thread is None:
+                self._explain_thread = threading.Thread(target=self._explain_worker, name="query-explain", daemon=True)
+                self._explain_thread.start()
+        try:
+            # 原始參數只留在記憶體給 EXPLAIN 使用，不會寫進任何紀錄
+            self._explain_queue.put_nowait((template, sql, params))
+        except queue.Full:
+            pass
+
+    def _explain_worker(self):
+        # 延遲 import：db_manager 本身會 import 這個模組
+        from db_manager import _connect
+        conn = None
+        while True:
+            template, sql, params = self._explain_queue.get()
+            try:
+                if conn is None or not conn.is_connected():
+                    conn = _connect()
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    cursor.execute(f"EXPLAIN {sql}", params)
+                    plan = [{k: _jsonable(v) for k, v in row.items()} for row in cursor.fetchall()]
+                finally:
+                    cursor.close()
+                result = {"at": datetime.now().isoformat(timespec='seconds'), "plan": plan}
+                scans = [row.get('table') for row in plan if row.get('type') == 'ALL']
+                if scans:
+                    print(f"🔎 EXPLAIN: full table scan on {', '.join(map(str, scans))}: {template[:120]}")
+            except Exception as e:
+                result = {"at": datetime.now().isoformat(timespec='seconds'), "error": str(e)}
+            with self._lock:
+                self._explains[template] = result
+
+    # --- 讀取 ---
+
+    def snapshot(self, sort="total", limit=50):
+        """彙總結果 (依 total / count / max / avg 排序) + 慢查詢紀錄 + EXPLAIN 結果"""
+        with self._lock:
+            statements = [
+                {
+                    "statement": template,
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "total_ms": round(s["total"] * 1000, 2),
+                    "avg_ms": round(s["total"] / s["count"] * 1000, 3),
+                    "max_ms": round(s["max"] * 1000, 2),
+                }
+                for template, s in self._statements.items()
+            ]
+            slow = list(self._slow)
+            explains = dict(self._explains)
+
+        sort_key = {"total": "total_ms", "count": "count", "max": "max_ms", "avg": "avg_ms"}.get(sort, "total_ms")
+        statements.sort(key=lambda s: s[sort_key], reverse=True)
+        statements = statements[:limit]
+        for s in statements:
+            if s["statement"] in explains:
+                s["explain"] = explains[s["statement"]]
+        return {
+            "since": datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            "slow_query_ms": SLOW_QUERY_MS,
+            "statements": statements,
+            "slow_queries": slow[::-1],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+            self._explains.clear()
+            self._explained_at.clear()
+            self.started_at = time.time()
+
+
+query_stats = QueryStats()
+
+
+def dump(path, sort="total", limit=200):
+    """將目前的統計寫成 JSON 檔"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(query_stats.snapshot(sort=sort, limit=limit), f, ensure_ascii=False, indent=2)
+    print(f"💾 Query stats 已寫入 {path}")
+
+
+if QUERY_STATS_DUMP_PATH:
+    atexit.register(dump, QUERY_STATS_DUMP_PATH)
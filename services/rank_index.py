@@ -0,0 +1,178 @@
+# services/rank_index.py
+"""
+「我的排名」用的記憶體內順序統計索引
+
+每個區域 (行政區 / 縣市 / 全台，與 region_distribution 相同的三個層級) 一棵 Fenwick tree，
+索引為 services/sketch.py 的分箱 (含負值共 BUCKET_COUNT 個)，值為該箱的紀錄數：
+- 新增一筆紀錄 O(log B)；查詢「比 x 低的紀錄有幾筆」= 前綴和 O(log B)，箱內以對數尺度線性內插
+- 每個區域只佔 BUCKET_COUNT 個整數，與紀錄筆數無關
+- 第一次查詢排名時 (start()) 由 region_distribution (即 carbon_logs 的分箱彙總) 在背景載入，
+  之後由 log_store 的 commit listener 即時更新 (API 與 write-behind 寫入都會經過)
+- 每 RANK_INDEX_RELOAD_INTERVAL 秒重新載入一次，補上其他 worker 程序寫入的紀錄
+- 載入期間 commit 的紀錄先暫存，換上新索引後再補上 (否則 SELECT 之後才 commit 的紀錄會隨舊索引一起丟失)；
+  在 SELECT 開始前一刻 commit、但 listener 晚一步才收到的紀錄可能被算兩次，誤差只有幾筆，下次重新載入即修正
+- 統計單位是「紀錄」不是「使用者」：同一位使用者的每筆計算都各算一筆
+"""
+import math
+import os
+import threading
+import time
+
+from db_manager import db_cursor
+from services.log_store import register_commit_listener
+from services.sketch import BUCKET_COUNT, MIN_BUCKET, ZERO_BUCKET, bucket_bounds, bucket_of
+
+RANK_INDEX_RELOAD_INTERVAL = float(os.getenv("RANK_INDEX_RELOAD_INTERVAL", "300"))
+
+# 箱號 -> Fenwick 索引 (0 起算)：箱號與數值同向，MIN_BUCKET (最負的值) 在最前面
+_OFFSET = -MIN_BUCKET
+
+
+class Fenwick:
+    """固定大小的 Fenwick tree (binary indexed tree)，支援單點增加與前綴和"""
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.total = 0
+
+    def add(self, index, count=1):
+        self.total += count
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += count
+            i += i & -i
+
+    def prefix(self, index):
+        """索引 0..index (含) 的總和；index < 0 時為 0"""
+        result = 0
+        i = min(index, self.size - 1) + 1
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+
+
+def _log_scale(value):
+    """對數尺度的位置，正負值對稱 (隨 value 遞增)"""
+    return math.log(value) if value > 0 else -math.log(-value)
+
+
+def _fraction_below(bucket, value):
+    """value 在所屬箱內的位置 (0 ~ 1)；ZERO_BUCKET 線性內插，其餘以對數尺度內插"""
+    lower, upper = bucket_bounds(bucket)
+    value = min(max(value, lower), upper)
+    if bucket == ZERO_BUCKET:
+        return (value - lower) / (upper - lower)
+    return (_log_scale(value) - _log_scale(lower)) / (_log_scale(upper) - _log_scale(lower))
+
+
+class RankIndex:
+    def __init__(self):
+        self._trees = {}          # (city, district) -> Fenwick
+        self._lock = threading.Lock()
+        self._pending = None      # 載入期間 commit 的紀錄 (不在載入中時為 None)
+        self.loaded_at = None
+
+    def _tree(self, trees, key):
+        tree = trees.get(key)
+        if tree is None:
+            tree = trees[key] = Fenwick(BUCKET_COUNT)
+        return tree
+
+    def load(self, cursor):
+        """
+        由 region_distribution 重建所有區域的索引 (建好後一次替換)
+        開始查詢前起暫存 commit 的紀錄，替換後補到新索引
+        """
+        with self._lock:
+            self._pending = []
+        try:
+            cursor.execute("SELECT city, district, bucket, sample_count FROM region_distribution WHERE metric = 'total'")
+            trees = {}
+            for city, district, bucket, count in cursor.fetchall():
+                self._tree(trees, (city, district)).add(bucket + _OFFSET, int(count))
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._add_to(trees, self._pending)
+            self._pending = None
+            self._trees = trees
+            self.loaded_at = time.time()
+        return len(trees)
+
+    def _add_to(self, trees, entries):
+        for e in entries:
+            index = bucket_of(e['total']) + _OFFSET
+            for key in ((e['city'], e['district']), (e['city'], ''), ('', '')):
+                self._tree(trees, key).add(index)
+
+    def add(self, entries):
+        """新紀錄 commit 後累加到 行政區 / 縣市 / 全台"""
+        with self._lock:
+            self._add_to(self._trees, entries)
+            if self._pending is not None:
+                self._pending.extend(entries)
+
+    def rank(self, city, district, value):
+        """
+        value 在 (city, district) 範圍內的位置 (city / district 為空字串代表全部)
+        回傳 {"count", "rank", "percentile"}：count 為紀錄筆數，rank 1 為碳排最低，percentile 為碳排比 value 低的紀錄比例 (%)
+        該範圍沒有資料時回傳 None
+        """
+        bucket = bucket_of(value)
+        index = bucket + _OFFSET
+        with self._lock:
+            tree = self._trees.get((city, district))
+            if tree is None or not tree.total:
+                return None
+            below = tree.prefix(index - 1)
+            in_bucket = tree.prefix(index) - below
+            total = tree.total
+        below += in_bucket * _fraction_below(bucket, value)
+        return {
+            "count": total,
+            "rank": int(below) + 1,
+            "percentile": round(below / total * 100, 1),
+        }
+
+
+rank_index = RankIndex()
+
+
+@register_commit_listener
+def _add_committed(entries):
+    # 第一次載入中的紀錄也要暫存，因此只看 loaded_at 不夠
+    if rank_index.loaded_at is not None or rank_index._pending is not None:
+        rank_index.add(entries)
+
+
+def _reload_worker():
+    while True:
+        started = time.perf_counter()
+        try:
+            with db_cursor() as (conn, cursor):
+                if not conn:
+                    raise RuntimeError("資料庫連線失敗")
+                regions = rank_index.load(cursor)
+            print(f"🏅 排名索引已載入: {regions} 個區域 ({time.perf_counter() - started:.2f}s)")
+        except Exception as e:
+            print(f"⚠️ 排名索引載入失敗: {e}")
+        # 還沒載入成功前較快重試
+        time.sleep(RANK_INDEX_RELOAD_INTERVAL if rank_index.loaded_at else min(RANK_INDEX_RELOAD_INTERVAL, 10))
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start():
+    """啟動背景載入 (含定期重新載入)，重複呼叫只會啟動一次"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_reload_worker, name="rank-index-loader", daemon=True).start()
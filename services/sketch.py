@@ -0,0 +1,141 @@
+# services/sketch.py
+"""
+可合併的分位數 sketch (對數分箱直方圖，DDSketch 的做法)
+
+- 分箱邊界固定、與資料無關：每 10 倍切成 BUCKETS_PER_DECADE 個箱，第 i 箱為 (γ^(i-1), γ^i]
+  γ = 10^(1/60) ≈ 1.039，箱內任何值與代表值的相對誤差不超過 RELATIVE_ACCURACY (約 1.9%)
+- 負值 (例如廢棄物回收的減碳) 以絕對值分箱，放在鏡像的負箱號：-1 - i 為 [-γ^i, -γ^(i-1))，
+  箱號大小與數值大小同向，排序箱號即排序數值
+- 絕對值不超過 1 (含 0，例如騎腳踏車的交通碳排) 歸到 ZERO_BUCKET，絕對值超過 MAX_VALUE 歸到兩端的最後一箱，
+  因此每個 (區域, 指標) 最多 BUCKET_COUNT 個箱，大小有上限
+- sketch 只是 {箱號: 次數}，合併 = 各箱次數相加，行政區可以往上合併成縣市 / 全台
+- 分位數 (p50 / p90 / p99) 與顯示用直方圖都由箱子的次數算出，不需排序原始資料
+"""
+import math
+
+BUCKETS_PER_DECADE = 60
+MAX_DECADES = 6                     # 最大值 10^6 (kg CO2e)
+MAX_VALUE = 10 ** MAX_DECADES
+GAMMA = 10 ** (1 / BUCKETS_PER_DECADE)
+LOG_GAMMA = math.log(GAMMA)
+RELATIVE_ACCURACY = (GAMMA - 1) / (GAMMA + 1)
+
+ZERO_BUCKET = -1
+MAX_BUCKET = MAX_DECADES * BUCKETS_PER_DECADE
+MIN_BUCKET = ZERO_BUCKET - MAX_BUCKET
+BUCKET_COUNT = MAX_BUCKET - MIN_BUCKET + 1   # MIN_BUCKET..-2 (負值)、ZERO_BUCKET、1..MAX_BUCKET
+
+# 顯示用直方圖：每 HISTOGRAM_GROUP 個箱合併成一個長條，邊界為 10^(k/10) (約 1.26 倍寬)
+HISTOGRAM_GROUP = 6
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _magnitude_bucket(magnitude):
+    """絕對值 (> 1) -> 正箱號"""
+    return min(MAX_BUCKET, max(1, math.ceil(math.log(magnitude) / LOG_GAMMA)))
+
+
+def bucket_of(value):
+    """數值 -> 箱號"""
+    if value is None or -1 <= value <= 1:
+        return ZERO_BUCKET
+    if value > 1:
+        return _magnitude_bucket(value)
+    return ZERO_BUCKET - _magnitude_bucket(-value)
+
+
+def bucket_sql(expr):
+    """與 bucket_of 相同的 SQL 運算式 (重建時在資料庫端分箱；NULL 與 bucket_of(None) 相同歸到 ZERO_BUCKET)"""
+    def magnitude(e):
+        return f"LEAST({MAX_BUCKET}, GREATEST(1, CEIL(LN({e}) / {LOG_GAMMA!r})))"
+    return (f"IF({expr} > 1, {magnitude(expr)}, "
+            f"IF({expr} < -1, {ZERO_BUCKET} - {magnitude(f'-({expr})')}, {ZERO_BUCKET}))")
+
+
+def bucket_bounds(bucket):
+    """箱號 -> (下界, 上界)"""
+    if bucket == ZERO_BUCKET:
+        return -1.0, 1.0
+    if bucket < ZERO_BUCKET:
+        lower, upper = bucket_bounds(ZERO_BUCKET - bucket)
+        return -upper, -lower
+    return GAMMA ** (bucket - 1), GAMMA ** bucket
+
+
+def bucket_value(bucket):
+    """箱子的代表值 (與箱內任何值的相對誤差 <= RELATIVE_ACCURACY)"""
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    if bucket < ZERO_BUCKET:
+        return -bucket_value(ZERO_BUCKET - bucket)
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+def merge(*sketches):
+    """合併多個 {箱號: 次數}"""
+    merged = {}
+    for sketch in sketches:
+        for bucket, count in sketch.items():
+            merged[bucket] = merged.get(bucket, 0) + count
+    return merged
+
+
+def quantiles(sketch, qs=DEFAULT_QUANTILES):
+    """回傳 {q: 估計值}，sketch 為空時回傳 {}"""
+    total = sum(sketch.values())
+    if not total:
+        return {}
+    buckets = sorted(sketch.items())
+    result = {}
+    for q in sorted(qs):
+        rank = q * (total - 1)
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen > rank:
+                result[q] = bucket_value(bucket)
+                break
+    return result
+
+
+def histogram(sketch):
+    """
+    顯示用直方圖：[{"lower", "upper", "count"}, ...]，由最小到最大的非空長條，中間的空長條也會列出
+    ZERO_BUCKET 自成一條 (-1 ~ 1)，負值的長條與正值對稱
+    """
+    # 長條編號：ZERO_BUCKET 為 0，正值第 g 組為 g + 1，負值 (依絕對值) 第 g 組為 -(g + 1)
+    groups = {}
+    for bucket, count in sketch.items():
+        if count:
+            if bucket == ZERO_BUCKET:
+                key = 0
+            elif bucket > 0:
+                key = (bucket - 1) // HISTOGRAM_GROUP + 1
+            else:
+                key = -((ZERO_BUCKET - bucket - 1) // HISTOGRAM_GROUP + 1)
+            groups[key] = groups.get(key, 0) + count
+    if not groups:
+        return []
+
+    bins = []
+    for key in range(min(groups), max(groups) + 1):
+        if key == 0:
+            lower, upper = bucket_bounds(ZERO_BUCKET)
+        else:
+            first = (abs(key) - 1) * HISTOGRAM_GROUP + 1
+            lower = bucket_bounds(first)[0]
+            upper = bucket_bounds(first + HISTOGRAM_GROUP - 1)[1]
+            if key < 0:
+                lower, upper = -upper, -lower
+        bins.append({"lower": round(lower, 1), "upper": round(upper, 1), "count": groups.get(key, 0)})
+    return bins
+
+
+def summarize(sketch, qs=DEFAULT_QUANTILES):
+    """回傳給前端的分佈摘要：{"count", "p50", "p90", "p99", "histogram"}"""
+    summary = {"count": sum(sketch.values())}
+    for q, value in quantiles(sketch, qs).items():
+        summary[f"p{round(q * 100):g}"] = round(value, 1)
+    summary["histogram"] = histogram(sketch)
+    return summary
@@ -0,0 +1,102 @@
+# services/trends.py
+"""
+月 / 週趨勢的查詢 (資料由 log_store 寫入 user_trend_rollup 與 region_trend_rollup)
+
+一條 24 個月的序列只需讀主鍵 (user_id 或 city, district) + period + bucket_start 範圍內的最多 24 列，
+與 carbon_logs 的筆數無關；沒有紀錄的期間補 0，前端可以直接畫圖
+"""
+from datetime import date, timedelta
+
+from services.log_store import BREAKDOWN_KEYS, TREND_PERIODS
+
+TREND_DEFAULT_POINTS = {"month": 24, "week": 26}
+TREND_MAX_POINTS = 120
+
+_SUMS = ", ".join(f"SUM(sum_{k}) AS sum_{k}" for k in BREAKDOWN_KEYS)
+
+
+def bucket_start(day, period):
+    """日期 -> 所屬期間的起始日 (與 log_store.trend_bucket_sql 相同)"""
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _previous(start, period, n):
+    """往前 n 個期間的起始日"""
+    if period == "week":
+        return start - timedelta(weeks=n)
+    months = start.year * 12 + start.month - 1 - n
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def parse_trend_args(args):
+    """解析 period=month|week、points；參數錯誤時丟出 ValueError"""
+    period = args.get('period', 'month')
+    if period not in TREND_PERIODS:
+        raise ValueError(f"不支援的期間: {period}")
+    points = int(args.get('points', TREND_DEFAULT_POINTS[period]))
+    if not 1 <= points <= TREND_MAX_POINTS:
+        raise ValueError(f"points 需介於 1 ~ {TREND_MAX_POINTS}")
+    return period, points
+
+
+def query_user_trend(cursor, user_id, period, points):
+    """使用者的趨勢序列 (cursor 需為 dictionary cursor)"""
+    first = _previous(bucket_start(date.today(), period), period, points - 1)
+    cursor.execute(f"""
+        SELECT bucket_start, sample_count, sum_total, {", ".join(f"sum_{k}" for k in BREAKDOWN_KEYS)}
+        FROM user_trend_rollup
+        WHERE user_id = %s AND period = %s AND bucket_start >= %s
+        ORDER BY bucket_start
+    """, (user_id, period, first))
+    return build_series(cursor.fetchall(), period, points)
+
+
+def query_region_trend(cursor, city, district, period, points):
+    """
+    區域的趨勢序列 (city / district 為空字串代表全部，層級選擇與 region_stats_rollup 相同)
+    只指定行政區時合併各縣市的同名行政區
+    """
+    first = _previous(bucket_start(date.today(), period), period, points - 1)
+    if city:
+        where, params = "city = %s AND district = %s", [city, district or '']
+    elif district:
+        where, params = "city <> '' AND district = %s", [district]
+    else:
+        where, params = "city = '' AND district = ''", []
+    cursor.execute(f"""
+        SELECT bucket_start, SUM(sample_count) AS sample_count, SUM(sum_total) AS sum_total, {_SUMS}
+        FROM region_trend_rollup
+        WHERE {where} AND period = %s AND bucket_start >= %s
+        GROUP BY bucket_start
+        ORDER BY bucket_start
+    """, tuple(params + [period, first]))
+    return build_series(cursor.fetchall(), period, points)
+
+
+def build_series(rows, period, points):
+    """
+    彙總列 -> 連續的序列 [{"bucket", "count", "avg_total", "breakdown_avg"}, ...] (舊到新)
+    以今天所在的期間為最後一點；資料庫的日期若已進入下一期，以資料庫為準
+    """
+    by_start = {row['bucket_start']: row for row in rows}
+    last = bucket_start(date.today(), period)
+    if by_start:
+        last = max(last, max(by_start))
+    starts = [_previous(last, period, n) for n in range(points - 1, -1, -1)]
+
+    series = []
+    for start in starts:
+        row = by_start.get(start)
+        count = int(row['sample_count']) if row else 0
+        point = {"bucket": start.isoformat(), "count": count, "avg_total": 0, "breakdown_avg": {}}
+        if count:
+            point["avg_total"] = round(float(row['sum_total']) / count, 1)
+            point["breakdown_avg"] = {
+                k: round(float(row[f'sum_{k}']) / count, 1)
+                for k in BREAKDOWN_KEYS
+                if row[f'sum_{k}'] is not None
+            }
+        series.append(point)
+    return series
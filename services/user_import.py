@@ -0,0 +1,245 @@
+# services/user_import.py
+"""
+大量匯入使用者帳號 (學校 / 公司一次開通數十萬個帳號)
+
+register() 每個帳號要兩次 SELECT 檢查重複 + 一次雜湊 + 一次 INSERT，這裡改成串流處理：
+- 以串流方式讀取 CSV (第一列為欄位名稱) 或 NDJSON (每行一個 JSON)，欄位名稱與 /api/register 相同
+- 用與 register 相同的規則驗證 (必填欄位、Email 格式、密碼長度)
+- 密碼雜湊以多個 process 平行計算 (強度與 PASSWORD_HASH_METHOD 相同，登入時不會再被升級)
+- 以多列 INSERT 批次寫入，不預先 SELECT，重複的帳號 / Email 交給 users 的 unique key 擋下：
+  整批因重複 (1062) 失敗時，以一次 SELECT 找出已存在的帳號 / Email 剔除後重試 (重跑同一個檔案時每批只多兩個查詢)；
+  仍失敗 (例如檔案內自己重複、其他資料錯誤) 才對半拆開重試，最後剩下單筆失敗的就是被拒收的資料
+- 驗證失敗與重複的資料寫入 reject 檔 (NDJSON，含原始行號，不含密碼)
+- 同時只在記憶體保留少數幾批資料，記憶體用量與檔案大小無關
+重跑同一個檔案是安全的：已匯入的帳號會因為重複被寫進 reject 檔
+"""
+import csv
+import json
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from mysql.connector import DataError, IntegrityError
+
+from db_manager import db_connection
+from services.password_hasher import PASSWORD_HASH_METHOD, hash_with_method
+
+REQUIRED_FIELDS = ['username', 'email', 'password', 'fullName', 'gender', 'city', 'district', 'birthdate', 'occupation']
+EMAIL_REGEX = re.compile(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$')
+MIN_PASSWORD_LENGTH = 6
+
+INSERT_USER_SQL = """
+    INSERT INTO users (username, email, password_hash, full_name, gender, gender_other, city, district, birthdate, occupation)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# 同時在雜湊中 / 等待寫入的批次數 (決定記憶體上限)
+PIPELINE_DEPTH = 2
+
+# MySQL 的 ER_DUP_ENTRY，訊息為 "Duplicate entry 'x' for key 'users.username'"
+ER_DUP_ENTRY = 1062
+_DUP_KEY_RE = re.compile(r"for key '(?:[^'.]*\.)?([^']+)'")
+
+
+def validate_registration(data):
+    """
+    註冊資料驗證，通過回傳 None，否則回傳錯誤訊息 (register 與大量匯入共用)
+    與原本 register 的規則相同：必填欄位只檢查 key 是否存在，Email 與密碼檢查原始值 (不做型別轉換)
+    """
+    if not isinstance(data, dict) or not all(k in data for k in REQUIRED_FIELDS):
+        return "缺少必填欄位"
+    if not isinstance(data['email'], str) or not EMAIL_REGEX.match(data['email']):
+        return "Email 格式不正確"
+    if not isinstance(data['password'], str) or len(data['password']) < MIN_PASSWORD_LENGTH:
+        return f"密碼長度至少需 {MIN_PASSWORD_LENGTH} 個字元"
+    return None
+
+
+def _detect_format(path):
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def _read_records(path, fmt):
+    """逐筆產生 (行號, 資料)；無法解析的行產生 (行號, None)"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError:
+                yield line_no, None
+
+
+def _to_row(data, password_hash):
+    gender = data['gender']
+    return (
+        data['username'], data['email'], password_hash, data['fullName'],
+        gender, (data.get('genderOther') or None) if gender == 'Other' else None,
+        data['city'], data['district'], data['birthdate'], data['occupation']
+    )
+
+
+class _RejectWriter:
+    """reject 檔：每行一筆 {"line", "username", "email", "reason"}"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'w', encoding='utf-8') if path else None
+
+    def write(self, line_no, data, reason):
+        self.count += 1
+        if self._file:
+            data = data if isinstance(data, dict) else {}
+            record = {"line": line_no, "username": data.get('username'), "email": data.get('email'), "reason": reason}
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def _valid_batches(records, batch_size, rejects):
+    """驗證並分批，驗證失敗的直接寫入 reject 檔"""
+    batch = []
+    for line_no, data in records:
+        error = "無法解析" if data is None else validate_registration(data)
+        if error:
+            rejects.write(line_no, data, error)
+            continue
+        batch.append((line_no, data))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _reject_reason(error):
+    """寫入失敗的原因：重複時標明是哪個 unique key (username / email)"""
+    if isinstance(error, IntegrityError) and error.errno == ER_DUP_ENTRY:
+        match = _DUP_KEY_RE.search(error.msg or '')
+        return f"{match.group(1) if match else 'unique key'} 已存在"
+    return error.msg
+
+
+def _existing(cursor, items):
+    """items 中帳號或 Email 已存在於 users 的項目 -> {索引: 'username' / 'email'}"""
+    usernames = [data['username'] for _, data, _ in items]
+    emails = [data['email'] for _, data, _ in items]
+    cursor.execute(f"""
+        SELECT username, email FROM users
+        WHERE username IN ({", ".join(["%s"] * len(usernames))}) OR email IN ({", ".join(["%s"] * len(emails))})
+    """, tuple(usernames + emails))
+    # users 的欄位是不分大小寫的 collation，比對時一併忽略大小寫；漏掉的 (例如全形 / 重音差異) 交給對半重試
+    rows = cursor.fetchall()
+    taken_usernames = {str(u).casefold() for u, _ in rows}
+    taken_emails = {str(e).casefold() for _, e in rows}
+    taken = {}
+    for i, (_, data, _) in enumerate(items):
+        if str(data['username']).casefold() in taken_usernames:
+            taken[i] = 'username'
+        elif str(data['email']).casefold() in taken_emails:
+            taken[i] = 'email'
+    return taken
+
+
+def _insert(conn, cursor, items, rejects, check_existing=True):
+    """
+    items: [(行號, 資料, 雜湊), ...]，以一個多列 INSERT 寫入並 commit，回傳成功寫入的筆數
+    違反 unique key 或資料不合法時整批 rollback：
+    重複 (1062) 時先剔除資料庫中已存在的帳號 / Email 再重試，其餘情況對半拆開重試
+    連線中斷等其他錯誤直接往上丟，中止匯入
+    """
+    if not items:
+        return 0
+    try:
+        cursor.executemany(INSERT_USER_SQL, [_to_row(data, password_hash) for _, data, password_hash in items])
+        conn.commit()
+        return len(items)
+    except (IntegrityError, DataError) as e:
+        conn.rollback()
+        if len(items) == 1:
+            line_no, data, _ = items[0]
+            rejects.write(line_no, data, _reject_reason(e))
+            return 0
+        if check_existing and isinstance(e, IntegrityError) and e.errno == ER_DUP_ENTRY:
+            taken = _existing(cursor, items)
+            if taken:
+                for i, key in taken.items():
+                    line_no, data, _ = items[i]
+                    rejects.write(line_no, data, f"{key} 已存在")
+                rest = [item for i, item in enumerate(items) if i not in taken]
+                return _insert(conn, cursor, rest, rejects, check_existing=False)
+    mid = len(items) // 2
+    return (_insert(conn, cursor, items[:mid], rejects, check_existing=False)
+            + _insert(conn, cursor, items[mid:], rejects, check_existing=False))
+
+
+def run_import(path, fmt=None, reject_path=None, batch_size=1000, workers=None, method=PASSWORD_HASH_METHOD):
+    """
+    匯入使用者帳號，回傳統計 {"read", "imported", "rejected", "seconds", "rows_per_second"}
+    workers=0 時在目前的 process 內計算雜湊
+    """
+    fmt = fmt or _detect_format(path)
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    start = time.perf_counter()
+    rejects = _RejectWriter(reject_path)
+    imported = 0
+
+    executor = None
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    chunksize = max(1, batch_size // (max(workers, 1) * 4))
+
+    def hash_batch(batch):
+        passwords = [data['password'] for _, data in batch]
+        if executor is None:
+            return [hash_with_method(password, method) for password in passwords]
+        # map 會立刻把整批送進 worker，結果在取用時才等待，寫入上一批的同時這一批已在雜湊
+        return executor.map(hash_with_method, passwords, repeat(method), chunksize=chunksize)
+
+    try:
+        with db_connection() as conn:
+            if not conn:
+                raise RuntimeError("資料庫連線失敗")
+            cursor = conn.cursor()
+            pending = deque()
+
+            def flush_oldest():
+                nonlocal imported
+                batch, hashes = pending.popleft()
+                items = [(line_no, data, password_hash) for (line_no, data), password_hash in zip(batch, hashes)]
+                imported += _insert(conn, cursor, items, rejects)
+                print(f"📥 已匯入 {imported} 筆 (拒絕 {rejects.count} 筆)")
+
+            for batch in _valid_batches(_read_records(path, fmt), batch_size, rejects):
+                pending.append((batch, hash_batch(batch)))
+                if len(pending) >= PIPELINE_DEPTH:
+                    flush_oldest()
+            while pending:
+                flush_oldest()
+            cursor.close()
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        rejects.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "read": imported + rejects.count,
+        "imported": imported,
+        "rejected": rejects.count,
+        "seconds": seconds,
+        "rows_per_second": imported / seconds if seconds else 0.0,
+    }
@@ -0,0 +1,156 @@
+# services/vector_calculator.py
+"""
+向量化計算引擎 (NumPy)
+一次處理整欄資料 (例如重算歷史紀錄、模擬數百萬筆)，結果與 calculator.py 的逐筆計算完全一致：
+- 每一步運算的順序與逐筆版本相同，浮點數結果逐位元相等
+- 四捨五入採用與 Python round() 相同的規則 (見 round1)
+"""
+import numpy as np
+
+from .carbon_data import get_compiled_coeffs
+from .coeff_versions import Categorical
+
+# 詳細分析需要的數值欄位
+DETAILED_COLUMNS = (
+    "electricity", "water", "gas",
+    "transport_km",
+    "meat", "veg", "grain",
+    "clothes", "electronics",
+    "bags", "recycle",
+)
+
+# 快速估算的月消費金額 (與 calculate_quick_footprint 相同)
+SHOPPING_SPEND = {"low": 10000, "medium": 20000, "high": 40000}
+_SHOPPING_SPEND = Categorical(SHOPPING_SPEND, 20000)
+AVG_COMMUTE_KM_YEAR = 20 * 250
+
+
+def round1(values):
+    """
+    與 Python round(x, 1) 結果相同的向量化四捨五入
+    np.round 先乘 10 再取整，在 .x5 邊界可能與 Python 的「正確捨入」不同，
+    這些極少數的邊界值改用 Python round() 逐一處理
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 10
+    rounded = np.rint(scaled) / 10
+    suspect = np.nonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)[0]
+    for i in suspect:
+        rounded[i] = round(float(values[i]), 1)
+    return rounded
+
+
+def map_categorical(values, categorical):
+    """將類別欄位 (例如交通工具) 透過預先編譯的索引轉成係數陣列，未知類別使用預設值"""
+    values = list(values)
+    return categorical.vector[categorical.indices(values)]
+
+
+def _column(columns, name):
+    return np.asarray(columns[name], dtype=np.float64)
+
+
+def calculate_detailed_columns(columns, transport_types, compiled=None):
+    """
+    詳細分析的向量化版本
+    columns: {欄位名稱: 數值陣列}，欄位見 DETAILED_COLUMNS
+    transport_types: 交通工具類別陣列
+    compiled: 已編譯的係數版本 (預設為目前版本)
+    回傳: {"total": 四捨五入後的總量, "raw_total": 未捨入總量, "breakdown": {類別: 陣列}, "coeff_version": 版本 id}
+    """
+    C = compiled or get_compiled_coeffs()
+
+    # 1. 能源 (Module A)
+    elec_total = _column(columns, 'electricity') * 12 * C.elec
+    water_total = _column(columns, 'water') * 12 * C.water
+    gas_total = _column(columns, 'gas') * 12 * C.gas
+    energy_sum = elec_total + water_total + gas_total
+
+    # 2. 交通 (Module B)
+    trans_coeff = map_categorical(transport_types, C.transport)
+    trans_sum = _column(columns, 'transport_km') * 12 * trans_coeff
+
+    # 3. 飲食 (Module C)
+    meat_sum = _column(columns, 'meat') * 52 * C.meat
+    veg_sum = _column(columns, 'veg') * 52 * C.veg
+    grain_sum = _column(columns, 'grain') * 52 * C.grain
+    diet_sum = meat_sum + veg_sum + grain_sum
+
+    # 4. 消費 (Module D)
+    clothes_sum = (_column(columns, 'clothes') * 12 / 1000) * C.clothes
+    elec_goods_sum = (_column(columns, 'electronics') * 12 / 1000) * C.electronics
+    cons_sum = clothes_sum + elec_goods_sum
+
+    # 5. 廢棄物 (Module E)
+    trash_sum = _column(columns, 'bags') * 52 * C.trash
+    recycle_sum = _column(columns, 'recycle') * 52 * C.recycle
+    waste_sum = trash_sum + recycle_sum
+
+    total = energy_sum + trans_sum + diet_sum + cons_sum + waste_sum
+    return {
+        "coeff_version": C.version,
+        "total": round1(total),
+        "raw_total": total,
+        "breakdown": {
+            "energy": round1(energy_sum),
+            "transport": round1(trans_sum),
+            "diet": round1(diet_sum),
+            "consumption": round1(cons_sum),
+            "waste": round1(waste_sum),
+        }
+    }
+
+
+def calculate_quick_columns(commute, diet, shopping, compiled=None):
+    """快速估算的向量化版本，三個參數皆為類別陣列"""
+    C = compiled or get_compiled_coeffs()
+
+    transport_total = map_categorical(commute, C.transport) * AVG_COMMUTE_KM_YEAR
+    diet_total = map_categorical(diet, C.diet) * 365
+
+    shopping = list(shopping)
+    monthly_spend = map_categorical(shopping, _SHOPPING_SPEND)
+    consumption_coeff = map_categorical(shopping, C.consumption)
+    consumption_total = (monthly_spend * 12) * (consumption_coeff / 1000)
+
+    total = transport_total + diet_total + consumption_total
+    return {
+        "coeff_version": C.version,
+        "total": round1(total),
+        "raw_total": total,
+        "breakdown": {
+            "transport": round1(transport_total),
+            "diet": round1(diet_total),
+            "consumption": round1(consumption_total),
+        }
+    }
+
+
+def detailed_records_to_columns(records):
+    """將多筆詳細分析輸入 (dict) 轉成欄位陣列，回傳 (columns, transport_types)"""
+    n = len(records)
+    columns = {name: np.empty(n, dtype=np.float64) for name in DETAILED_COLUMNS}
+    transport_types = np.empty(n, dtype=object)
+    for i, data in enumerate(records):
+        columns['electricity'][i] = float(data['energy']['electricity'])
+        columns['water'][i] = float(data['energy']['water'])
+        columns['gas'][i] = float(data['energy']['gas'])
+        columns['transport_km'][i] = float(data['transport']['km'])
+        transport_types[i] = data['transport']['type']
+        columns['meat'][i] = float(data['diet']['meat'])
+        columns['veg'][i] = float(data['diet']['veg'])
+        columns['grain'][i] = float(data['diet']['grain'])
+        columns['clothes'][i] = float(data['consumption']['clothes'])
+        columns['electronics'][i] = float(data['consumption']['electronics'])
+        columns['bags'][i] = float(data['waste']['bags'])
+        columns['recycle'][i] = float(data['waste']['recycle'])
+    return columns, transport_types
+
+
+def unpack_row(result, i):
+    """取出第 i 筆的 (未捨入總量, 四捨五入總量, breakdown dict)，型別轉回 Python float"""
+    return (
+        float(result['raw_total'][i]),
+        float(result['total'][i]),
+        {k: float(v[i]) for k, v in result['breakdown'].items()},
+    )
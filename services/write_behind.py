@@ -0,0 +1,416 @@
+# services/write_behind.py
+"""
+計算紀錄的 write-behind 佇列 (選用，WRITE_BEHIND=1 開啟)
+
+API 算完結果後不再同步 INSERT + COMMIT，而是：
+1. 先把紀錄附加到 spill 檔 (JSON lines)，程序崩潰時不會遺失
+2. 放進有上限的記憶體佇列後立刻回應
+3. 背景 writer 累積到 WRITE_BEHIND_BATCH_SIZE 筆或等待超過 WRITE_BEHIND_FLUSH_INTERVAL 秒，
+   就以 save_logs() 在單一交易內 executemany 寫入，commit 後在 spill 檔記下 ack
+
+重放不會重複寫入：每次寫入前先在 spill 檔記下這批的 token，並在同一個交易內寫入 write_behind_batches 表
+(database/migrations/007)；在 commit 之後、ack 之前崩潰的批次，重啟時查得到 token，直接 ack 不再寫入
+
+- 佇列滿時 submit() 最多等待 WRITE_BEHIND_PUT_TIMEOUT 秒 (backpressure)，仍滿則回傳 False，
+  由呼叫端改走同步寫入
+- 啟動時會重放 spill 檔中尚未 ack 的紀錄；程序結束時 (atexit) 會把佇列寫完
+- spill 檔為單一程序專用，多個 worker process 時請各自設定不同的 WRITE_BEHIND_SPILL_PATH
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from mysql.connector import DataError, IntegrityError, ProgrammingError
+
+from db_manager import db_cursor
+from services.log_store import save_logs
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "0.05"))
+# 1 = 每筆都 fsync (連機器斷電都不遺失，但較慢)；預設只 flush 到 OS (程序崩潰不遺失)
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "0") == "1"
+WRITE_BEHIND_SPILL_PATH = os.getenv(
+    "WRITE_BEHIND_SPILL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "database", "write_behind_spill.jsonl")
+)
+# spill 檔超過此大小時改寫成只含未 ack 的紀錄
+WRITE_BEHIND_SPILL_MAX_BYTES = int(os.getenv("WRITE_BEHIND_SPILL_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# write_behind_batches 保留天數 (需大於程序崩潰後到重啟的最長時間)，每 LEDGER_PRUNE_EVERY 批清除一次
+WRITE_BEHIND_LEDGER_DAYS = int(os.getenv("WRITE_BEHIND_LEDGER_DAYS", "7"))
+LEDGER_PRUNE_EVERY = 1000
+
+INSERT_BATCH_SQL = "INSERT INTO write_behind_batches (token) VALUES (%s)"
+
+# 寫入失敗 (例如資料庫暫時斷線) 後重試前的等待秒數
+RETRY_DELAY = 1.0
+
+# 紀錄本身有問題 (重試也不會成功) 的錯誤：只有這些會丟棄紀錄；
+# 其他錯誤 (lock wait timeout、deadlock、連線中斷...) 都保留在 spill 檔稍後重試
+DATA_ERRORS = (DataError, IntegrityError, ProgrammingError, KeyError, TypeError, ValueError)
+
+
+class WriteBehindQueue:
+    """有上限的紀錄佇列 + spill 檔 + 背景批次 writer"""
+
+    def __init__(self, spill_path=WRITE_BEHIND_SPILL_PATH, maxsize=WRITE_BEHIND_QUEUE_SIZE,
+                 batch_size=WRITE_BEHIND_BATCH_SIZE, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 put_timeout=WRITE_BEHIND_PUT_TIMEOUT, fsync=WRITE_BEHIND_FSYNC):
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.fsync = fsync
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()      # 保護 spill 檔與 _pending
+        self._pending = {}                 # 已寫入 spill 檔但尚未 commit 的紀錄 {seq: record}
+        self._tokens = {}                  # 未 ack 的紀錄曾嘗試寫入的批次 token {seq: [token, ...]}
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._spill = None
+
+        # 請求執行緒與 writer 都會累加，以 _stats_lock 保護
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "rejected": 0, "written": 0, "dropped": 0, "batches": 0}
+
+    # --- spill 檔 ---
+
+    def _append(self, obj):
+        """呼叫端需持有 _lock"""
+        self._spill.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        self._spill.flush()
+        if self.fsync:
+            os.fsync(self._spill.fileno())
+
+    def _recover(self):
+        """讀出 spill 檔中尚未 ack 的紀錄 (依原本順序) 與其批次 token，回傳 ({seq: record}, {seq: [token, ...]})"""
+        records = {}
+        tokens = {}
+        acked = set()
+        try:
+            with open(self.spill_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        # 崩潰時寫到一半的最後一行
+                        continue
+                    if 'ack' in item:
+                        acked.update(item['ack'])
+                    elif 'batch' in item:
+                        for seq in item['seqs']:
+                            tokens.setdefault(seq, []).append(item['batch'])
+                    else:
+                        records[item['seq']] = item['record']
+                        tokens.setdefault(item['seq'], []).extend(item.get('batches', []))
+        except FileNotFoundError:
+            return {}, {}
+        records = {seq: tuple(r) for seq, r in sorted(records.items()) if seq not in acked}
+        return records, {seq: tokens[seq] for seq in records if tokens.get(seq)}
+
+    def _compact(self):
+        """改寫 spill 檔只保留未 ack 的紀錄；呼叫端需持有 _lock"""
+        self._spill.close()
+        tmp_path = f"{self.spill_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for seq, record in sorted(self._pending.items()):
+                item = {"seq": seq, "record": record}
+                if seq in self._tokens:
+                    item["batches"] = self._tokens[seq]
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spill_path)
+        self._spill = open(self.spill_path, 'a', encoding='utf-8')
+
+    def _ack(self, seqs):
+        with self._lock:
+            self._append({"ack": seqs})
+            for seq in seqs:
+                self._pending.pop(seq, None)
+                self._tokens.pop(seq, None)
+            if not self._pending:
+                # 全部都已 commit，直接清空檔案
+                self._spill.seek(0)
+                self._spill.truncate()
+            elif self._spill.tell() > WRITE_BEHIND_SPILL_MAX_BYTES:
+                self._compact()
+
+    def _begin_batch(self, seqs):
+        """寫入前在 spill 檔記下這批的 token，回傳 token (交易內需寫入 write_behind_batches)"""
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._append({"batch": token, "seqs": seqs})
+            for seq in seqs:
+                self._tokens.setdefault(seq, []).append(token)
+        return token
+
+    # --- 生命週期 ---
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+        recovered, tokens = self._recover()
+        with self._lock:
+            self._pending = dict(recovered)
+            self._tokens = tokens
+            self._seq = max(recovered, default=0)
+            self._spill = open(self.spill_path, 'a', encoding='utf-8')
+            self._compact()
+        if recovered:
+            print(f"♻️ Write-behind: 重放 {len(recovered)} 筆未寫入的紀錄")
+
+        self._thread = threading.Thread(
+            target=self._run, args=(list(recovered.items()),), name="write-behind", daemon=True
+        )
+        self._thread.start()
+        print(f"✍️ Write-behind 已啟動 (batch {self.batch_size}, interval {self.flush_interval}s)")
+        return self
+
+    def shutdown(self, timeout=30.0):
+        """停止接收並把佇列中的紀錄寫完"""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"⚠️ Write-behind: {timeout}s 內未寫完，剩餘紀錄保留在 spill 檔，下次啟動時重放")
+        else:
+            print(f"✅ Write-behind 已關閉 (共寫入 {self._stats['written']} 筆)")
+        self._thread = None
+
+    # --- 寫入端 ---
+
+    def submit(self, record):
+        """
+        record: (user_id, log_type, data, result)
+        成功排入佇列回傳 True；已關閉或佇列滿 (等待 put_timeout 後) 回傳 False
+        """
+        if self._stop.is_set():
+            return False
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._append({"seq": seq, "record": record})
+            self._pending[seq] = record
+        try:
+            self._queue.put((seq, record), timeout=self.put_timeout)
+        except queue.Full:
+            # 交給呼叫端同步寫入，spill 檔中的這筆直接 ack 掉
+            self._count("rejected")
+            self._ack([seq])
+            return False
+        self._count("submitted")
+        return True
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+            return self._stats[name]
+
+    # --- 背景 writer ---
+
+    def _collect(self):
+        """等到第一筆後，再收集到 batch_size 筆或 flush_interval 秒為止"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """
+        寫入一批紀錄，回傳還沒寫入、需要稍後重試的紀錄 (空 list = 全部已 commit 或因資料錯誤丟棄)
+        已 commit 的紀錄在這裡就 ack；整批因資料錯誤失敗時改逐筆寫入，只丟棄本身有問題的那幾筆
+        """
+        with db_cursor() as (conn, cursor):
+            if not conn:
+                return batch
+            try:
+                token = self._begin_batch([seq for seq, _ in batch])
+                cursor.execute(INSERT_BATCH_SQL, (token,))
+                save_logs(conn, cursor, [record for _, record in batch])
+                self._count("written", len(batch))
+                self._ack([seq for seq, _ in batch])
+                return []
+            except Exception as e:
+                if not self._rollback(conn, e) or not isinstance(e, DATA_ERRORS):
+                    return batch
+                print(f"⚠️ Write-behind 批次寫入失敗，改逐筆寫入: {e}")
+
+            for i, (seq, record) in enumerate(batch):
+                try:
+                    cursor.execute(INSERT_BATCH_SQL, (self._begin_batch([seq]),))
+                    save_logs(conn, cursor, [record])
+                    self._count("written")
+                except Exception as e:
+                    if not self._rollback(conn, e) or not isinstance(e, DATA_ERRORS):
+                        # 暫時性錯誤：已寫入的已 ack，其餘留在 spill 檔重試
+                        return batch[i:]
+                    self._count("dropped")
+                    print(f"❌ Write-behind 丟棄紀錄 #{seq} (user {record[0]}): {e}")
+                self._ack([seq])
+        return []
+
+    def _rollback(self, conn, error):
+        """寫入失敗後 rollback；連線已中斷時回傳 False"""
+        if not conn.is_connected():
+            print(f"⚠️ Write-behind 連線中斷: {error}")
+            return False
+        try:
+            conn.rollback()
+        except Exception as e:
+            print(f"⚠️ Write-behind rollback 失敗: {e}")
+            return False
+        if not isinstance(error, DATA_ERRORS):
+            print(f"⚠️ Write-behind 寫入失敗，稍後重試: {error}")
+        return True
+
+    def _flush(self, batch):
+        """寫入直到完成；停止中且仍無法寫入時放棄 (紀錄留在 spill 檔)"""
+        while True:
+            batch = self._write(batch)
+            if not batch:
+                break
+            if self._stop.is_set():
+                return False
+            print(f"⚠️ Write-behind: {len(batch)} 筆尚未寫入，{RETRY_DELAY}s 後重試")
+            time.sleep(RETRY_DELAY)
+        if self._count("batches") % LEDGER_PRUNE_EVERY == 0:
+            self._prune_ledger()
+        return True
+
+    def _committed_seqs(self, seqs):
+        """
+        查詢 write_behind_batches：seqs 中已隨某個批次 commit 的紀錄 (set)
+        資料庫無法連線時回傳 None
+        """
+        by_token = {}
+        with self._lock:
+            for seq in seqs:
+                for token in self._tokens.get(seq, []):
+                    by_token.setdefault(token, []).append(seq)
+        if not by_token:
+            return set()
+        with db_cursor() as (conn, cursor):
+            if not conn:
+                return None
+            try:
+                committed = set()
+                tokens = list(by_token)
+                for i in range(0, len(tokens), 1000):
+                    chunk = tokens[i:i + 1000]
+                    cursor.execute(
+                        f"SELECT token FROM write_behind_batches WHERE token IN ({', '.join(['%s'] * len(chunk))})",
+                        tuple(chunk)
+                    )
+                    for (token,) in cursor.fetchall():
+                        committed.update(by_token[token])
+                return committed
+            except Exception as e:
+                print(f"⚠️ Write-behind 查詢已寫入批次失敗: {e}")
+                return None
+
+    def _skip_committed(self, recovered):
+        """重放前排除 commit 後來不及 ack 的紀錄 (直接 ack)；停止中且資料庫仍無法連線時回傳 None"""
+        while True:
+            committed = self._committed_seqs([seq for seq, _ in recovered])
+            if committed is not None:
+                break
+            if self._stop.is_set():
+                return None
+            print(f"⚠️ Write-behind: 資料庫連線失敗，{RETRY_DELAY}s 後重試")
+            time.sleep(RETRY_DELAY)
+        if committed:
+            self._ack(sorted(committed))
+            print(f"♻️ Write-behind: {len(committed)} 筆紀錄已在上次 commit，略過不重放")
+        return [(seq, record) for seq, record in recovered if seq not in committed]
+
+    def _prune_ledger(self):
+        """清除超過 WRITE_BEHIND_LEDGER_DAYS 天的批次 token"""
+        with db_cursor() as (conn, cursor):
+            if not conn:
+                return
+            try:
+                cursor.execute(
+                    "DELETE FROM write_behind_batches WHERE created_at < NOW() - INTERVAL %s DAY",
+                    (WRITE_BEHIND_LEDGER_DAYS,)
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ Write-behind 清除批次紀錄失敗: {e}")
+
+    def _run(self, recovered):
+        if recovered:
+            recovered = self._skip_committed(recovered)
+            if recovered is None:
+                return
+            self._prune_ledger()
+        for i in range(0, len(recovered), self.batch_size):
+            if not self._flush(recovered[i:i + self.batch_size]):
+                return
+
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch and not self._flush(batch):
+                return
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        data["queued"] = self._queue.qsize()
+        data["pending"] = len(self._pending)
+        return data
+
+
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def start(**options):
+    """啟動 (或取得已啟動的) write-behind 佇列，程序結束時自動寫完"""
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = WriteBehindQueue(**options).start()
+            atexit.register(shutdown)
+        return _instance
+
+
+def shutdown(timeout=30.0):
+    global _instance
+    with _instance_lock:
+        instance, _instance = _instance, None
+    if instance:
+        instance.shutdown(timeout)
+
+
+def submit(record):
+    """
+    WRITE_BEHIND 開啟 (或已手動 start()) 時把紀錄交給背景 writer
+    回傳 False 代表呼叫端需要自己同步寫入
+    """
+    instance = _instance or (start() if WRITE_BEHIND_ENABLED else None)
+    return instance.submit(record) if instance else False
+
+
+def get_stats():
+    return _instance.stats() if _instance else None